@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the AI assistant's per-message hot paths.
+
+Covers intent classification, entity extraction, knowledge base search and
+lookup (synthetic KBs of 10 to 10,000 entries) and the full process_message /
+process_batch path, over a USSD-style corpus in all four LanguageCodes.
+Redis and OpenAI are replaced by in-memory fakes, so results measure this
+code only.
+
+Usage:
+    python scripts/bench_ai_assistant.py --output bench.json
+    python scripts/bench_ai_assistant.py --baseline bench-baseline.json --threshold 0.15
+    python scripts/bench_ai_assistant.py --quick --filter kb.
+
+Exits 1 when --baseline is given and any benchmark's median regressed by
+more than --threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, 'src')
+
+KB_SIZES = (10, 100, 1000, 10000)
+
+# USSD-style messages: short, lower-case, code-switched, with typical entities
+CORPUS = {
+    'en': [
+        "hi",
+        "menu",
+        "i want to apply for a bursary for my child",
+        "how do i apply for a bursary? my id is 8001015009087",
+        "what documents do i need for bursary application",
+        "check status of my application ref 8001015009087",
+        "where is my bursary money",
+        "water pipe broken in VW12 since monday",
+        "street light not working near the school, report problem",
+        "garbage not collected for 2 weeks",
+        "contact office phone number pls",
+        "what are the office hours",
+        "which area does the ward cover",
+        "emergency fire at house 45 call 0821234567",
+        "urgent help needed immediately",
+        "thanks bye",
+        "pay R 1,500.00 by 12/05/2024",
+        "email me at resident@example.co.za",
+    ],
+    'af': [
+        "hallo",
+        "ek wil aansoek doen vir n bursary vir my kind",
+        "hoe doen ek aansoek vir n beurs? id 8001015009087",
+        "wat is die status van my application",
+        "water pyp is broken in VW12",
+        "straatlig werk nie, ek wil n problem report",
+        "kontak die kantoor asseblief 0731234567",
+        "watter area dek die wyk",
+        "noodgeval! brand by huis 12, help asap",
+        "dankie, totsiens",
+    ],
+    'zu': [
+        "sawubona",
+        "ngifuna ukufaka isicelo se bursary",
+        "ngingenza kanjani isicelo se bursary? id yami 8001015009087",
+        "ngicela ukubheka i-status yesicelo sami",
+        "amanzi ayaphuma epayipini eliphukile e VW12, problem",
+        "ugesi awusebenzi, ngifuna ukubika i-issue",
+        "ngicela inombolo ye office 0611234567",
+        "isiphi i-area esihlanganiswa yi-ward",
+        "usizo oluphuthumayo! umlilo, emergency",
+        "ngiyabonga, sala kahle",
+    ],
+    'xh': [
+        "molo",
+        "ndifuna ukufaka isicelo se bursary",
+        "ndingenza njani isicelo se bursary? id 8001015009087",
+        "ndicela ukujonga i-status yesicelo sam",
+        "umbhobho wamanzi wophukile e VW12, yi problem",
+        "izibane zesitrato azisebenzi, report issue",
+        "ndicela inombolo ye office 0791234567",
+        "yeyiphi i-area egqunywe yi-ward",
+        "emergency! umlilo endlwini, help",
+        "enkosi, usale kakuhle",
+    ],
+}
+
+KB_TOPICS = {
+    'bursary_info': ["bursary", "scholarship", "funding", "tuition", "registration", "transcript"],
+    'issue_reporting': ["water", "electricity", "road", "street light", "garbage", "sewage"],
+    'contact_info': ["office", "councillor", "hours", "email", "phone", "address"],
+    'services': ["housing", "clinic", "permit", "grant", "library", "youth programme"],
+    'areas': ["boundary", "district", "section", "village", "zone", "settlement"],
+}
+
+KB_QUESTION_TEMPLATES = [
+    "How do I apply for {topic} in {area}?",
+    "What documents do I need for {topic}?",
+    "When will I hear back about my {topic} request?",
+    "Who do I contact about {topic} problems in {area}?",
+    "Where can I get help with {topic}?",
+    "What is the status of {topic} services in {area}?",
+]
+
+
+def synthetic_knowledge_base(entries: int, seed: int = 7) -> Dict[str, List[Dict[str, str]]]:
+    """Build a KB with `entries` distinct questions spread over the topic categories"""
+    rng = random.Random(seed)
+    categories = list(KB_TOPICS)
+    data: Dict[str, List[Dict[str, str]]] = {category: [] for category in categories}
+    seen = set()
+
+    while len(seen) < entries:
+        category = categories[len(seen) % len(categories)]
+        topic = rng.choice(KB_TOPICS[category])
+        area = f"area {rng.randint(1, max(10, entries // 5))}"
+        question = rng.choice(KB_QUESTION_TEMPLATES).format(topic=topic, area=area)
+        if question.lower() in seen:
+            continue
+        seen.add(question.lower())
+        data[category].append({
+            "question": question,
+            "answer": f"For {topic} in {area}, dial *120*8001# or visit the ward office."
+        })
+
+    return data
+
+
+def prepare_environment(workdir: str):
+    """Point the module at scratch files and unreachable backends before it is imported"""
+    os.environ['AI_KNOWLEDGE_BASE_PATH'] = os.path.join(workdir, 'knowledge_base.json')
+    os.environ['REDIS_HOST'] = '127.0.0.1'
+    os.environ['REDIS_PORT'] = '1'
+    os.environ['REDIS_CONNECT_TIMEOUT'] = '0.05'
+    os.environ['REDIS_RETRIES'] = '0'
+    os.environ.pop('OPENAI_API_KEY', None)
+    os.environ.pop('AI_KB_RELOAD_INTERVAL', None)
+    # The module logs to ai_assistant.log in the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, SRC_DIR)
+
+
+def build_fakes(ai):
+    """Classes for the in-memory Redis store and OpenAI client, built on the imported module"""
+
+    class InMemorySessionStore(ai.RedisSessionStore):
+        """RedisSessionStore with the same interface, backed by dicts"""
+
+        def __init__(self, io_loop):
+            super().__init__(io_loop)
+            self.values: Dict[str, str] = {}
+            self.lists: Dict[str, List[str]] = {}
+
+        @property
+        def available(self) -> bool:
+            return True
+
+        async def aconnect(self) -> bool:
+            return True
+
+        async def load_sessions(self, user_ids, history_window):
+            return [
+                (self.values.get(self.context_key(user_id)), self.lists.get(self.history_key(user_id), [])[-history_window:])
+                for user_id in user_ids
+            ]
+
+        async def save_sessions(self, sessions, ttl, history_max):
+            for user_id, context_json, history in sessions:
+                self.values[self.context_key(user_id)] = context_json
+                if history:
+                    items = self.lists.setdefault(self.history_key(user_id), [])
+                    items.extend(history)
+                    del items[:-history_max]
+
+        async def get_values(self, keys):
+            return [self.values.get(key) for key in keys]
+
+        async def set_values(self, values, ttl):
+            self.values.update(values)
+
+        async def close(self):
+            pass
+
+    class FakeChatCompletion:
+        """Stands in for openai.ChatCompletion with a fixed answer and optional latency"""
+
+        latency = 0.0
+
+        @classmethod
+        async def acreate(cls, messages, **kwargs):
+            if cls.latency:
+                await asyncio.sleep(cls.latency)
+            content = f"Thank you. Dial *120*8001# for help with: {messages[-1]['content'][:40]}"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    return InMemorySessionStore, SimpleNamespace(ChatCompletion=FakeChatCompletion)
+
+
+def measure(fn: Callable[[], Any], number: int, repeat: int) -> List[float]:
+    """Per-call seconds for each of `repeat` rounds of `number` calls"""
+    fn()  # warm up
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - started) / number)
+    return rounds
+
+
+def summarize(rounds: List[float], items_per_call: int = 1) -> Dict[str, float]:
+    """Microsecond statistics per item"""
+    per_item = sorted(r / items_per_call * 1e6 for r in rounds)
+    return {
+        "min_us": round(per_item[0], 3),
+        "median_us": round(statistics.median(per_item), 3),
+        "mean_us": round(statistics.fmean(per_item), 3),
+        "max_us": round(per_item[-1], 3),
+        "ops_per_sec": round(1e6 / statistics.median(per_item), 1),
+        "rounds": len(per_item),
+    }
+
+
+class BenchmarkSuite:
+    """Registers and runs the benchmarks against one imported module"""
+
+    def __init__(self, ai, number: int, repeat: int, kb_sizes: Tuple[int, ...], workdir: str, name_filter: Optional[str]):
+        self.ai = ai
+        self.number = number
+        self.repeat = repeat
+        self.kb_sizes = kb_sizes
+        self.workdir = workdir
+        self.name_filter = name_filter
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, name: str, fn: Callable[[], Any], items_per_call: int = 1, number: Optional[int] = None, **meta):
+        if self.name_filter and self.name_filter not in name:
+            return
+        stats = summarize(measure(fn, number or self.number, self.repeat), items_per_call)
+        stats.update(meta)
+        self.results[name] = stats
+        print(f"{name:<44} median {stats['median_us']:>10.2f}us  min {stats['min_us']:>10.2f}us  ({stats['ops_per_sec']:,.0f}/s)")
+
+    def run_nlu(self):
+        assistant = self.ai.get_assistant()
+        classifier = assistant.intent_classifier
+        extractor = assistant.entity_extractor
+
+        for language, messages in CORPUS.items():
+            texts = iter_cycle(messages)
+            self.run(f"intent.classify.{language}", lambda: classifier.classify_intent(next(texts)), messages=len(messages))
+            texts = iter_cycle(messages)
+            self.run(f"entities.extract.{language}", lambda: extractor.extract_entities(next(texts)), messages=len(messages))
+
+        everything = [text for messages in CORPUS.values() for text in messages]
+        batch = (everything * (64 // len(everything) + 1))[:64]
+        self.run("intent.classify_batch.64", lambda: classifier.classify_batch(batch), items_per_call=len(batch), number=max(1, self.number // 32))
+        self.run("entities.extract_batch.64", lambda: extractor.extract_batch(batch), items_per_call=len(batch), number=max(1, self.number // 32))
+
+    def run_kb(self):
+        queries = [
+            "how do i apply for a bursary",
+            "who do i contact about water problems in area 3",
+            "what documents do i need for housing",
+            "where can i get help with street light",
+            "status of clinic services",
+        ]
+        for size in self.kb_sizes:
+            path = os.path.join(self.workdir, f'kb_{size}.json')
+            data = synthetic_knowledge_base(size)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+
+            started = time.perf_counter()
+            kb = self.ai.KnowledgeBase(path)
+            build_ms = (time.perf_counter() - started) * 1000
+
+            texts = iter_cycle(queries)
+            self.run(f"kb.search.{size}", lambda: kb.search_knowledge(next(texts)), entries=size, build_ms=round(build_ms, 1))
+            self.run(f"kb.search_batch.{size}.32", lambda: kb.search_knowledge_batch(queries * 6 + queries[:2]), items_per_call=32,
+                     number=max(1, self.number // 16), entries=size)
+
+            questions = iter_cycle([entry["question"] for entries in data.values() for entry in entries][:1000])
+            self.run(f"kb.get_answer.{size}", lambda: kb.get_answer(next(questions)), entries=size)
+
+    def run_pipeline(self):
+        assistant = self.ai.get_assistant()
+        LanguageCode = self.ai.LanguageCode
+        ConversationContext = self.ai.ConversationContext
+
+        for language, messages in CORPUS.items():
+            contexts = [
+                ConversationContext(user_id=f"bench-{language}-{i}", phone_number="0821234567", language=LanguageCode(language))
+                for i in range(50)
+            ]
+            turns = iter_cycle([(text, context) for context in contexts for text in messages])
+
+            def one_turn():
+                text, context = next(turns)
+                return self.loop.run_until_complete(assistant.process_message(text, context))
+
+            self.run(f"pipeline.process_message.{language}", one_turn, number=max(1, self.number // 4))
+
+        everything = [text for messages in CORPUS.values() for text in messages]
+        contexts = [ConversationContext(user_id=f"bench-batch-{i}", phone_number=None) for i in range(32)]
+        batch = [(everything[i % len(everything)], contexts[i]) for i in range(32)]
+        self.run("pipeline.process_batch.32", lambda: self.loop.run_until_complete(assistant.process_batch(batch)),
+                 items_per_call=len(batch), number=max(1, self.number // 64))
+
+
+def iter_cycle(items):
+    """Endless iterator over a list, cheaper per step than itertools.cycle plus a lambda"""
+    while True:
+        yield from items
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Print median ratios against the baseline and return the names that regressed"""
+    regressions = []
+    print(f"\n{'benchmark':<44} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<44} {'-':>12} {stats['median_us']:>12.2f} {'new':>8}")
+            continue
+        ratio = stats['median_us'] / base['median_us'] if base['median_us'] else float('inf')
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<44} {base['median_us']:>12.2f} {stats['median_us']:>12.2f} {ratio:>7.2f}x{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the AI assistant's per-message hot paths")
+    parser.add_argument('--output', default='bench-ai-assistant.json', help="results file to write (JSON)")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed median slowdown before failing (default 0.10 = 10%%)")
+    parser.add_argument('--number', type=int, default=2000, help="calls per round for single-message benchmarks")
+    parser.add_argument('--repeat', type=int, default=7, help="timed rounds per benchmark")
+    parser.add_argument('--kb-sizes', default=','.join(map(str, KB_SIZES)), help="comma-separated synthetic KB sizes")
+    parser.add_argument('--filter', dest='name_filter', help="only run benchmarks whose name contains this")
+    parser.add_argument('--quick', action='store_true', help="fewer calls and rounds, for smoke runs")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.number, args.repeat = min(args.number, 200), min(args.repeat, 3)
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    with tempfile.TemporaryDirectory(prefix='ai-bench-') as workdir:
+        prepare_environment(workdir)
+        logging.disable(logging.WARNING)
+        import ai_assistant as ai
+
+        # Swap the unreachable backends for in-memory fakes
+        InMemorySessionStore, fake_openai = build_fakes(ai)
+        assistant = ai.get_assistant()
+        assistant.session_store = InMemorySessionStore(assistant.io_loop)
+        if assistant.response_cache:
+            assistant.response_cache.store = assistant.session_store
+        assistant.init_write_behind()
+        assistant.openai_client = fake_openai
+        assistant.llm_gateway = ai.LLMGateway(fake_openai, assistant.io_loop, 'fake-model', 8, 4.0, 5, 30.0)
+
+        suite = BenchmarkSuite(ai, args.number, args.repeat, tuple(int(size) for size in args.kb_sizes.split(',') if size),
+                               workdir, args.name_filter)
+        suite.run_nlu()
+        suite.run_kb()
+        suite.run_pipeline()
+        suite.loop.close()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": sys.modules['numpy'].__version__,
+            "number": args.number,
+            "repeat": args.repeat,
+        },
+        "results": suite.results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(suite.results, baseline.get("results", {}), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+        print("\nNo regressions against baseline")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
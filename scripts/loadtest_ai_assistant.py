@@ -0,0 +1,834 @@
+#!/usr/bin/env python3
+"""
+End-to-end load generator for the AI assistant's chat routes.
+
+Starts the service (``src/ai_assistant.py --asgi`` by default) against a local
+Redis stand-in and a fake OpenAI-compatible server with configurable latency
+and failure rate, then replays thousands of concurrent multi-turn USSD-style
+sessions over HTTP, mixing intents, languages and the /chat, /chat/stream and
+/chat/batch routes. Reports throughput, p50/p95/p99 latency per route and per
+intent, and error rates, and writes them as JSON for regression comparison.
+
+The Redis stand-in is ``redis-server`` when it is on PATH, else the fakeredis
+package (whose Lua support needs ``lupa``; without it the rate limiter falls
+back to its in-process buckets). The service only reaches the fake LLM when
+the ``openai`` package is installed; otherwise LLM-bound turns are answered
+from templates and a warning is printed.
+
+Usage:
+    python scripts/loadtest_ai_assistant.py --sessions 2000 --ramp-up 10 --output load.json
+    python scripts/loadtest_ai_assistant.py --workers 4 --llm-latency-ms 1500 --llm-failure-rate 0.05
+    python scripts/loadtest_ai_assistant.py --baseline load-baseline.json --threshold 0.2
+    python scripts/loadtest_ai_assistant.py --url http://127.0.0.1:5000 --redis none
+
+Exits 1 when --baseline is given and any route's or intent's p95 regressed by
+more than --threshold, or its error rate rose by more than --error-threshold.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bench_ai_assistant import CORPUS, git_revision
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, 'src')
+
+ROUTES = {'chat': '/chat', 'stream': '/chat/stream', 'batch': '/chat/batch'}
+
+# uvicorn drops keep-alive connections idle for 5s; retire ours before that
+KEEPALIVE_IDLE = 4.0
+
+
+def parse_weights(spec: str, choices) -> Dict[str, float]:
+    """Parse ``name=weight,...`` into normalised weights over known names"""
+    weights = {}
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in choices:
+            raise argparse.ArgumentTypeError(f"unknown name {name!r}, expected one of {', '.join(choices)}")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError(f"weights must add up to more than 0: {spec!r}")
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"nothing listening on {host}:{port} after {timeout:.0f}s")
+            time.sleep(0.1)
+
+
+def raise_open_file_limit():
+    """Thousands of sockets need more than the usual soft limit of 1024"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+        if soft != resource.RLIM_INFINITY and soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# --- Minimal HTTP/1.1 over asyncio streams, shared by the client and the fake LLM ---
+
+async def read_head(reader: asyncio.StreamReader) -> Tuple[str, Dict[str, str]]:
+    """First line and lower-cased headers of a request or response; raises ConnectionError at EOF"""
+    first = await reader.readline()
+    if not first:
+        raise ConnectionError("connection closed")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return first.decode('latin-1').rstrip('\r\n'), headers
+
+
+class HTTPConnection:
+    """One keep-alive HTTP/1.1 connection with Content-Length and chunked bodies"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+        self.reusable = True
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> 'HTTPConnection':
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer, f"{host}:{port}")
+
+    async def request(self, method: str, path: str, body: bytes = b'') -> Tuple[int, Dict[str, str]]:
+        """Send a request and read the status and headers; the body is read with ``chunks``"""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+        )
+        await self.writer.drain()
+        status_line, headers = await read_head(self.reader)
+        if headers.get('connection', '').lower() == 'close':
+            self.reusable = False
+        return int(status_line.split()[1]), headers
+
+    async def chunks(self, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                data = await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+                yield data
+        elif 'content-length' in headers:
+            yield await self.reader.readexactly(int(headers['content-length']))
+        else:
+            self.reusable = False
+            yield await self.reader.read()
+
+    async def read_body(self, headers: Dict[str, str]) -> bytes:
+        return b''.join([chunk async for chunk in self.chunks(headers)])
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+class ConnectionPool:
+    """Bounded pool of keep-alive connections, like a gateway's HTTP client"""
+
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = port
+        self.slots = asyncio.Semaphore(size)
+        self.idle: List[HTTPConnection] = []
+        self.opened = 0
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[HTTPConnection]:
+        async with self.slots:
+            conn = None
+            while self.idle and conn is None:
+                conn = self.idle.pop()
+                if time.monotonic() - conn.last_used > KEEPALIVE_IDLE:
+                    conn.close()
+                    conn = None
+            if conn is None:
+                conn = await HTTPConnection.open(self.host, self.port)
+                self.opened += 1
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            if conn.reusable:
+                conn.last_used = time.monotonic()
+                self.idle.append(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle.clear()
+
+
+class ServiceClient:
+    """JSON and SSE calls to the service's chat routes"""
+
+    def __init__(self, pool: ConnectionPool, timeout: float):
+        self.pool = pool
+        self.timeout = timeout
+
+    async def post_json(self, path: str, payload: Any) -> Tuple[int, Any]:
+        async def call():
+            async with self.pool.connection() as conn:
+                status, headers = await conn.request('POST', path, json.dumps(payload).encode('utf-8'))
+                body = await conn.read_body(headers)
+            try:
+                return status, json.loads(body) if body else None
+            except ValueError:
+                return status, None
+        return await asyncio.wait_for(call(), self.timeout)
+
+    async def get_json(self, path: str) -> Tuple[int, Any]:
+        async with self.pool.connection() as conn:
+            status, headers = await conn.request('GET', path)
+            body = await conn.read_body(headers)
+        return status, json.loads(body) if body else None
+
+    async def stream(self, path: str, payload: Any) -> Tuple[int, Optional[float], Optional[str], Any]:
+        """POST and read server-sent events; returns (status, seconds to first event, last event, its data)"""
+        started = time.perf_counter()
+
+        async def call():
+            first_event = None
+            event, data = None, None
+            async with self.pool.connection() as conn:
+                status, headers = await conn.request('POST', path, json.dumps(payload).encode('utf-8'))
+                if not headers.get('content-type', '').startswith('text/event-stream'):
+                    body = await conn.read_body(headers)
+                    return status, None, None, json.loads(body) if body else None
+                buffer = b''
+                async for chunk in conn.chunks(headers):
+                    buffer += chunk
+                    while b'\n\n' in buffer:
+                        frame, buffer = buffer.split(b'\n\n', 1)
+                        if first_event is None:
+                            first_event = time.perf_counter() - started
+                        for line in frame.decode('utf-8').splitlines():
+                            if line.startswith('event:'):
+                                event = line[6:].strip()
+                            elif line.startswith('data:'):
+                                data = line[5:].strip()
+            return status, first_event, event, json.loads(data) if data else None
+        return await asyncio.wait_for(call(), self.timeout)
+
+
+class Batcher:
+    """Groups messages into /chat/batch requests by size or time window, like a gateway aggregator"""
+
+    def __init__(self, client: ServiceClient, size: int, window: float):
+        self.client = client
+        self.size = size
+        self.window = window
+        self.pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+
+    async def send(self, message: Dict[str, Any]) -> Tuple[int, Any]:
+        """(HTTP status, this message's result) once its batch has been answered"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((message, future))
+        if len(self.pending) >= self.size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        items, self.pending = self.pending, []
+        if items:
+            task = asyncio.ensure_future(self._post(items))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _post(self, items: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        try:
+            status, payload = await self.client.post_json(ROUTES['batch'], {"messages": [message for message, _ in items]})
+            results = payload.get('results') if status == 200 and isinstance(payload, dict) else None
+            for i, (_, future) in enumerate(items):
+                future.set_result((status, results[i] if results else payload))
+        except BaseException as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+
+# --- Measurements ---
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(latencies: List[float], requests: int, errors: int, duration: float) -> Dict[str, Any]:
+    """Millisecond latency statistics plus throughput and error rate"""
+    values = sorted(latencies)
+    stats: Dict[str, Any] = {
+        "requests": requests,
+        "ok": len(values),
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "throughput_rps": round(len(values) / duration, 1) if duration else 0.0,
+    }
+    if values:
+        stats.update({
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        })
+    return stats
+
+
+class Recorder:
+    """Latencies of answered turns by route and intent, and failures by route and kind"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.intent_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.first_event: List[float] = []
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def ok(self, route: str, seconds: float, intent: Optional[str]):
+        self.requests[route] += 1
+        self.latencies[route].append(seconds)
+        self.intent_latencies[intent or "none"].append(seconds)
+
+    def error(self, route: str, kind: str):
+        self.requests[route] += 1
+        self.errors[(route, kind)] += 1
+
+    @property
+    def completed(self) -> int:
+        return sum(self.requests.values())
+
+    def report(self) -> Dict[str, Any]:
+        duration = (self.finished or time.perf_counter()) - self.started
+        errors_by_route = Counter()
+        for (route, _), count in self.errors.items():
+            errors_by_route[route] += count
+        all_latencies = [seconds for values in self.latencies.values() for seconds in values]
+        return {
+            "duration_s": round(duration, 2),
+            "total": summarize(all_latencies, self.completed, sum(self.errors.values()), duration),
+            "routes": {
+                route: summarize(self.latencies[route], self.requests[route], errors_by_route[route], duration)
+                for route in sorted(self.requests)
+            },
+            "intents": {
+                intent: summarize(values, len(values), 0, duration)
+                for intent, values in sorted(self.intent_latencies.items())
+            },
+            "stream_first_event": summarize(self.first_event, len(self.first_event), 0, duration) if self.first_event else None,
+            "errors": {f"{route}:{kind}": count for (route, kind), count in sorted(self.errors.items())},
+        }
+
+
+# --- Load ---
+
+class LoadGenerator:
+    """Replays multi-turn sessions against the service and records every turn"""
+
+    def __init__(self, args: argparse.Namespace, client: ServiceClient, run_id: str):
+        self.args = args
+        self.client = client
+        self.run_id = run_id
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.batcher = Batcher(client, args.batch_size, args.batch_window_ms / 1000)
+        self.active = 0
+
+    def session_script(self) -> Tuple[str, List[str]]:
+        """A language and its turns: a greeting, a few requests, often a goodbye"""
+        language = self.rng.choices(list(self.args.languages), weights=list(self.args.languages.values()))[0]
+        messages = CORPUS[language]
+        turns = [messages[0]] + self.rng.choices(messages[1:-1], k=self.rng.randint(self.args.min_turns, self.args.max_turns))
+        if self.rng.random() < 0.5:
+            turns.append(messages[-1])
+        return language, turns
+
+    async def run(self):
+        tasks = []
+        for n in range(self.args.sessions):
+            delay = n * self.args.ramp_up / self.args.sessions
+            tasks.append(asyncio.ensure_future(self.session(n, delay, *self.session_script())))
+        progress = asyncio.ensure_future(self.progress())
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            progress.cancel()
+            self.recorder.finished = time.perf_counter()
+
+    async def progress(self):
+        while True:
+            await asyncio.sleep(5)
+            elapsed = time.perf_counter() - self.recorder.started
+            print(f"  {elapsed:6.1f}s  {self.active:5d} sessions active  {self.recorder.completed:7d} turns  "
+                  f"{sum(self.recorder.errors.values()):5d} errors", flush=True)
+
+    async def session(self, n: int, delay: float, language: str, turns: List[str]):
+        await asyncio.sleep(delay)
+        self.active += 1
+        try:
+            for sequence_id, text in enumerate(turns):
+                if self.rng.random() < self.args.unique_rate:
+                    # Unseen wording, so the response cache cannot answer it
+                    text = f"{text} ({self.run_id} {n} {sequence_id})"
+                message = {
+                    "message": text,
+                    "user_id": f"load-{self.run_id}-{n}",
+                    "phone_number": f"08{n:08d}",
+                    "language": language,
+                    "sequence_id": sequence_id,
+                }
+                route = self.rng.choices(list(self.args.routes), weights=list(self.args.routes.values()))[0]
+                if route == 'chat' and self.rng.random() < self.args.retry_rate:
+                    # A gateway that timed out and resent the same message
+                    await asyncio.gather(self.turn('chat', message), self.turn('chat_retry', message, 0.05))
+                else:
+                    await self.turn(route, message)
+                if self.args.think_ms:
+                    await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+        finally:
+            self.active -= 1
+
+    async def turn(self, route: str, message: Dict[str, Any], delay: float = 0.0):
+        if delay:
+            await asyncio.sleep(delay)
+        started = time.perf_counter()
+        try:
+            if route == 'stream':
+                status, first_event, event, payload = await self.client.stream(ROUTES['stream'], message)
+                if status == 200 and first_event is not None:
+                    self.recorder.first_event.append(first_event)
+                if status == 200 and event != 'done':
+                    self.recorder.error(route, f"event_{event or 'none'}")
+                    return
+            elif route == 'batch':
+                status, payload = await self.batcher.send(message)
+            else:
+                status, payload = await self.client.post_json(ROUTES['chat'], message)
+        except asyncio.TimeoutError:
+            self.recorder.error(route, "timeout")
+            return
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            self.recorder.error(route, type(e).__name__)
+            return
+
+        if status != 200:
+            self.recorder.error(route, f"http_{status}")
+        elif not isinstance(payload, dict) or 'error' in payload:
+            # Per-message failures inside a batch
+            self.recorder.error(route, "http_429" if isinstance(payload, dict) and 'retry_after' in payload else "item_error")
+        else:
+            self.recorder.ok(route, time.perf_counter() - started, payload.get('intent'))
+
+
+# --- Stand-ins ---
+
+def serve_fake_llm(port: int, latency_ms: float, jitter_ms: float, token_ms: float, failure_rate: float, seed: int):
+    """OpenAI-compatible /v1/chat/completions with configurable latency and failure rate (child process)"""
+    rng = random.Random(seed)
+    counters = Counter()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line, headers = await read_head(reader)
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method, path = request_line.split()[:2]
+
+                if method == 'GET' and path.endswith('/stats'):
+                    data = json.dumps(dict(counters)).encode()
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(data), data))
+                    await writer.drain()
+                    continue
+
+                counters["requests"] += 1
+                request = json.loads(body or b'{}')
+                await asyncio.sleep(max(0.0, rng.gauss(latency_ms, jitter_ms)) / 1000)
+
+                if rng.random() < failure_rate:
+                    counters["failed"] += 1
+                    data = json.dumps({"error": {"message": "Injected failure", "type": "server_error"}}).encode()
+                    writer.write(b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(data), data))
+                    await writer.drain()
+                    continue
+
+                question = (request.get('messages') or [{}])[-1].get('content', '')
+                content = f"Thank you for your message. Dial *120*8001# or visit the ward office for help with: {question[:60]}"
+                base = {"id": f"chatcmpl-{counters['requests']}", "created": int(time.time()), "model": request.get('model', 'fake')}
+
+                if request.get('stream'):
+                    counters["streamed"] += 1
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+                    for word in content.split(' '):
+                        chunk = dict(base, object="chat.completion.chunk",
+                                     choices=[{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}])
+                        writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        await writer.drain()
+                        if token_ms:
+                            await asyncio.sleep(token_ms / 1000)
+                    chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                    writer.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+                    await writer.drain()
+                    return
+
+                data = json.dumps(dict(
+                    base, object="chat.completion",
+                    choices=[{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    usage={"prompt_tokens": len(question.split()), "completion_tokens": len(content.split()),
+                           "total_tokens": len(question.split()) + len(content.split())}
+                )).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(data), data))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def serve_fakeredis(port: int):
+    """fakeredis TCP server (child process)"""
+    from fakeredis import TcpFakeServer
+    TcpFakeServer(('127.0.0.1', port), server_type='redis').serve_forever()
+
+
+def start_redis(spec: str, workdir: str) -> Tuple[Optional[Tuple[str, int]], Any, str]:
+    """(address, process, kind) for --redis auto | none | HOST:PORT"""
+    if spec == 'none':
+        return None, None, 'none'
+    if spec != 'auto':
+        host, _, port = spec.rpartition(':')
+        return (host or '127.0.0.1', int(port)), None, 'external'
+
+    port = free_port()
+    binary = shutil.which('redis-server')
+    if binary:
+        process = subprocess.Popen(
+            [binary, '--bind', '127.0.0.1', '--port', str(port), '--save', '', '--appendonly', 'no', '--maxclients', '10000'],
+            cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        kind = 'redis-server'
+    else:
+        if importlib.util.find_spec('fakeredis') is None:
+            raise SystemExit("--redis auto needs redis-server on PATH or the fakeredis package; "
+                             "or pass --redis HOST:PORT or --redis none")
+        process = multiprocessing.Process(target=serve_fakeredis, args=(port,), daemon=True)
+        process.start()
+        kind = 'fakeredis'
+    wait_for_port('127.0.0.1', port, 10)
+    return ('127.0.0.1', port), process, kind
+
+
+def start_service(args: argparse.Namespace, workdir: str, redis: Optional[Tuple[str, int]], llm_port: int) -> Tuple[subprocess.Popen, int, str]:
+    """Launch the service with its backends pointed at the stand-ins; returns (process, port, log path)"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'AI_HOST': '127.0.0.1',
+        'AI_PORT': str(port),
+        'AI_KNOWLEDGE_BASE_PATH': os.path.abspath(args.knowledge_base) if args.knowledge_base
+        else os.path.join(workdir, 'knowledge_base.json'),
+        'OPENAI_API_KEY': 'loadtest',
+        'OPENAI_API_BASE': f'http://127.0.0.1:{llm_port}/v1',
+    })
+    env.pop('AI_KB_RELOAD_INTERVAL', None)
+    if redis:
+        env['REDIS_HOST'], env['REDIS_PORT'] = redis[0], str(redis[1])
+    else:
+        env.update({'REDIS_HOST': '127.0.0.1', 'REDIS_PORT': '1', 'REDIS_CONNECT_TIMEOUT': '0.05', 'REDIS_RETRIES': '0'})
+    for assignment in args.env:
+        name, _, value = assignment.partition('=')
+        env[name] = value
+
+    command = [sys.executable, os.path.join(SRC_DIR, 'ai_assistant.py')]
+    if args.server == 'asgi':
+        command += ['--asgi', '--workers', str(args.workers)]
+    log_path = os.path.join(workdir, 'service.log')
+    with open(log_path, 'w') as log:
+        # The module logs to ai_assistant.log in its working directory
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, port, log_path
+
+
+async def wait_for_service(client: ServiceClient, process: Optional[subprocess.Popen], timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"service exited with status {process.returncode}")
+        try:
+            status, _ = await asyncio.wait_for(client.get_json('/health'), 2)
+            if status == 200:
+                return
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            pass
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"service not healthy after {timeout:.0f}s")
+        await asyncio.sleep(0.2)
+
+
+def stop(process: Any):
+    if process is None:
+        return
+    if isinstance(process, multiprocessing.Process):
+        process.terminate()
+        process.join(5)
+        return
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# --- Output ---
+
+def print_report(report: Dict[str, Any]):
+    header = f"{'':<26} {'requests':>9} {'ok/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+
+    def row(name: str, stats: Dict[str, Any]):
+        latency = "".join(f" {stats[key]:>9.1f}" if key in stats else f" {'-':>9}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+        print(f"{name:<26} {stats['requests']:>9} {stats['throughput_rps']:>8.1f} {stats['error_rate']:>7.2%}{latency}")
+
+    print(f"\n{header}")
+    row("all", report["total"])
+    for route, stats in report["routes"].items():
+        row(f"route {route}", stats)
+    for intent, stats in report["intents"].items():
+        row(f"intent {intent}", stats)
+    if report["stream_first_event"]:
+        row("stream first event", report["stream_first_event"])
+    if report["errors"]:
+        print("\nErrors: " + ", ".join(f"{name} x{count}" for name, count in report["errors"].items()))
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float, error_threshold: float) -> List[str]:
+    """Print p95 ratios and error rates against the baseline and return what regressed"""
+    regressions = []
+    print(f"\n{'':<26} {'base p95':>10} {'p95':>10} {'ratio':>7} {'base err':>9} {'err':>7}")
+    for section in ('routes', 'intents'):
+        for name, stats in report.get(section, {}).items():
+            label = f"{section[:-1]} {name}"
+            base = baseline.get(section, {}).get(name)
+            if not base or 'p95_ms' not in base or 'p95_ms' not in stats:
+                print(f"{label:<26} {'-':>10} {stats.get('p95_ms', 0):>10.1f} {'new':>7}")
+                continue
+            ratio = stats['p95_ms'] / base['p95_ms'] if base['p95_ms'] else float('inf')
+            flag = ""
+            if ratio > 1 + threshold:
+                flag += "  P95 REGRESSION"
+            if stats['error_rate'] - base['error_rate'] > error_threshold:
+                flag += "  ERROR REGRESSION"
+            if flag:
+                regressions.append(label)
+            print(f"{label:<26} {base['p95_ms']:>10.1f} {stats['p95_ms']:>10.1f} {ratio:>6.2f}x "
+                  f"{base['error_rate']:>9.2%} {stats['error_rate']:>7.2%}{flag}")
+    return regressions
+
+
+async def run_load(args: argparse.Namespace, host: str, port: int, process: Optional[subprocess.Popen]) -> Tuple[Dict[str, Any], Any]:
+    pool = ConnectionPool(host, port, args.connections)
+    client = ServiceClient(pool, args.timeout)
+    try:
+        await wait_for_service(client, process, args.startup_timeout)
+        generator = LoadGenerator(args, client, format(int(time.time()), 'x'))
+        print(f"Running {args.sessions} sessions over {args.ramp_up:.0f}s against http://{host}:{port} "
+              f"({args.connections} connections)", flush=True)
+        await generator.run()
+        report = generator.recorder.report()
+        report["connections_opened"] = pool.opened
+        _, health = await client.get_json('/health')
+        return report, health
+    finally:
+        pool.close()
+
+
+async def fetch_llm_stats(port: int) -> Optional[Dict[str, int]]:
+    try:
+        conn = await HTTPConnection.open('127.0.0.1', port)
+        status, headers = await conn.request('GET', '/v1/stats')
+        body = await conn.read_body(headers)
+        conn.close()
+        return json.loads(body) if status == 200 else None
+    except (OSError, ConnectionError, ValueError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Concurrent multi-turn load test of the AI assistant's chat routes")
+    parser.add_argument('--sessions', type=int, default=2000, help="USSD sessions to simulate (default 2000)")
+    parser.add_argument('--ramp-up', type=float, default=10.0, help="seconds over which sessions start (default 10)")
+    parser.add_argument('--min-turns', type=int, default=2, help="fewest requests per session after the greeting")
+    parser.add_argument('--max-turns', type=int, default=5, help="most requests per session after the greeting")
+    parser.add_argument('--think-ms', type=float, default=1500, help="mean pause between a session's turns (exponential)")
+    parser.add_argument('--languages', type=lambda spec: parse_weights(spec, CORPUS), default='en=0.55,af=0.15,zu=0.15,xh=0.15',
+                        help="language mix, e.g. en=0.55,af=0.15,zu=0.15,xh=0.15")
+    parser.add_argument('--routes', type=lambda spec: parse_weights(spec, ROUTES), default='chat=0.8,stream=0.1,batch=0.1',
+                        help="route mix, e.g. chat=0.8,stream=0.1,batch=0.1")
+    parser.add_argument('--unique-rate', type=float, default=0.3, help="fraction of messages reworded to miss the response cache")
+    parser.add_argument('--retry-rate', type=float, default=0.02, help="fraction of /chat turns resent by a 'gateway retry'")
+    parser.add_argument('--batch-size', type=int, default=16, help="messages per /chat/batch request at most")
+    parser.add_argument('--batch-window-ms', type=float, default=50, help="longest a message waits for its batch to fill")
+    parser.add_argument('--connections', type=int, default=256, help="keep-alive connections to the service")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument('--seed', type=int, default=7, help="random seed for sessions and the fake LLM")
+    parser.add_argument('--llm-latency-ms', type=float, default=800, help="fake LLM mean response latency")
+    parser.add_argument('--llm-jitter-ms', type=float, default=300, help="fake LLM latency standard deviation")
+    parser.add_argument('--llm-token-ms', type=float, default=15, help="fake LLM delay between streamed tokens")
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0, help="fraction of fake LLM calls that fail with 500")
+    parser.add_argument('--redis', default='auto', help="auto (redis-server or fakeredis stand-in), none, or HOST:PORT")
+    parser.add_argument('--server', choices=('asgi', 'flask'), default='asgi', help="how to serve the app (default asgi)")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn workers for --server asgi")
+    parser.add_argument('--knowledge-base', help="knowledge base JSON for the service (default: its built-in KB)")
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE', help="extra service environment, repeatable")
+    parser.add_argument('--url', help="load an already running service instead of starting one and the stand-ins")
+    parser.add_argument('--startup-timeout', type=float, default=120.0, help="seconds to wait for /health")
+    parser.add_argument('--output', default='loadtest-ai-assistant.json', help="results file to write (JSON)")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.20, help="allowed p95 slowdown before failing (default 0.20 = 20%%)")
+    parser.add_argument('--error-threshold', type=float, default=0.01, help="allowed error-rate increase before failing (default 0.01)")
+    args = parser.parse_args()
+    if args.workers > 1 and args.server != 'asgi':
+        parser.error("--workers requires --server asgi")
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    raise_open_file_limit()
+
+    stand_ins = {}
+    processes = []
+    with tempfile.TemporaryDirectory(prefix='ai-load-') as workdir:
+        service = None
+        log_path = None
+        llm_port = None
+        try:
+            if args.url:
+                target = urlsplit(args.url)
+                host, port = target.hostname or '127.0.0.1', target.port or 80
+            else:
+                llm_port = free_port()
+                llm = multiprocessing.Process(target=serve_fake_llm, daemon=True, args=(
+                    llm_port, args.llm_latency_ms, args.llm_jitter_ms, args.llm_token_ms, args.llm_failure_rate, args.seed))
+                llm.start()
+                processes.append(llm)
+                wait_for_port('127.0.0.1', llm_port, 10)
+                redis, redis_process, stand_ins['redis'] = start_redis(args.redis, workdir)
+                processes.append(redis_process)
+                service, port, log_path = start_service(args, workdir, redis, llm_port)
+                host = '127.0.0.1'
+                print(f"Stand-ins: fake LLM on :{llm_port}, Redis {stand_ins['redis']}" + (f" on :{redis[1]}" if redis else ""))
+
+            report, health = asyncio.run(run_load(args, host, port, service))
+            if llm_port:
+                stand_ins['llm'] = asyncio.run(fetch_llm_stats(llm_port))
+        except (RuntimeError, TimeoutError) as e:
+            print(f"Load test failed: {e}", file=sys.stderr)
+            if log_path and os.path.exists(log_path):
+                with open(log_path, encoding='utf-8', errors='replace') as f:
+                    print("".join(f.readlines()[-30:]), file=sys.stderr)
+            return 2
+        finally:
+            stop(service)
+            for process in processes:
+                stop(process)
+
+    if not args.url and isinstance(health, dict) and not health.get('llm_gateway'):
+        print("\nWARNING: the service has no LLM client (is the openai package installed?); "
+              "LLM-bound turns were answered from templates", file=sys.stderr)
+
+    print_report(report)
+    result = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {name: value for name, value in vars(args).items() if name not in ('output', 'baseline')},
+            "stand_ins": stand_ins,
+        },
+        **report,
+        "service_health": health,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.error_threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against baseline: {', '.join(regressions)}")
+            return 1
+        print("\nNo regressions against baseline")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Admission control: per-subscriber rate limits and load shedding"""
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import threading
+
+from sessions import RedisSessionStore
+
+class RateLimiter:
+    """Token buckets per user_id and phone_number, shared through Redis.
+    
+    A message is admitted only if every bucket it maps to has a token. While
+    Redis is unavailable each process falls back to its own buckets, so the
+    effective limit is multiplied by the number of workers.
+    """
+    
+    def __init__(self, store: RedisSessionStore, capacity: float, per_minute: float, max_local_keys: int = 100000):
+        self.store = store
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.max_local_keys = max_local_keys
+        
+        self._local: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+        self.local_decisions = 0
+    
+    @staticmethod
+    def keys(user_id: str, phone_number: Optional[str]) -> List[str]:
+        """Bucket keys a message draws from"""
+        keys = [f"ai_rate:user:{user_id}"]
+        if phone_number:
+            keys.append(f"ai_rate:phone:{phone_number}")
+        return keys
+    
+    async def acquire(self, user_id: str, phone_number: Optional[str], cost: float = 1.0) -> float:
+        """Seconds until the subscriber may send again; 0 admits the message"""
+        keys = self.keys(user_id, phone_number)
+        wait = None
+        if self.store.available:
+            try:
+                wait = await self.store.take_tokens(keys, self.capacity, self.rate, cost)
+            except Exception:
+                pass  # Counted by the store; decide locally instead
+        if wait is None:
+            self.local_decisions += 1
+            wait = self._take_local(keys, cost)
+        if wait:
+            self.limited += 1
+        return wait
+    
+    def _take_local(self, keys: List[str], cost: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            levels, wait = [], 0.0
+            for key in keys:
+                tokens, updated = self._local.get(key, (self.capacity, now))
+                level = min(self.capacity, tokens + (now - updated) * self.rate)
+                levels.append(level)
+                if level < cost:
+                    wait = max(wait, (cost - level) / self.rate)
+            if wait:
+                return wait
+            
+            for key, level in zip(keys, levels):
+                self._local[key] = (level - cost, now)
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_local_keys:
+                self._local.popitem(last=False)
+        return 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Limit settings and decision counters"""
+        return {
+            "burst": self.capacity,
+            "per_minute": self.rate * 60,
+            "limited": self.limited,
+            "local_decisions": self.local_decisions
+        }
+
+class LoadShedder:
+    """Overload detector over turns in flight and a moving average of turn latency.
+    
+    Enters overload when either crosses its threshold and leaves once both are
+    back under ``recover`` of it, so it does not flap at the boundary. A
+    threshold of 0 disables that signal.
+    """
+    
+    def __init__(self, max_in_flight: int, latency_threshold: float, recover: float = 0.8, smoothing: float = 0.1):
+        self.max_in_flight = max_in_flight
+        self.latency_threshold = latency_threshold
+        self.recover = recover
+        self.smoothing = smoothing
+        
+        self.in_flight = 0
+        self.latency = 0.0
+        self.shedding = False
+        self.shed = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def track(self, turns: int = 1):
+        """Count turns as in flight and fold their latency into the average"""
+        with self._lock:
+            self.in_flight += turns
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.in_flight -= turns
+                self.latency += self.smoothing * (elapsed - self.latency)
+    
+    def load(self) -> float:
+        """Highest ratio of a signal to its threshold"""
+        load = 0.0
+        if self.max_in_flight:
+            load = self.in_flight / self.max_in_flight
+        if self.latency_threshold:
+            load = max(load, self.latency / self.latency_threshold)
+        return load
+    
+    def overloaded(self) -> bool:
+        """Whether expensive work should be shed now"""
+        load = self.load()
+        self.shedding = load > self.recover if self.shedding else load >= 1.0
+        return self.shedding
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current signals and how many LLM calls were shed"""
+        return {
+            "shedding": self.shedding,
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000, 1),
+            "shed": self.shed
+        }
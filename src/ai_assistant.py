@@ -14,26 +14,39 @@ Features:
 """
 
 import os
+import sys
+import time
 import json
+import argparse
+import importlib.util
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass, asdict
-from enum import Enum
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple, Any
 import re
+import bisect
+import hmac
+import threading
+
+_core_import_started = time.perf_counter()
 
-import openai
-from transformers import pipeline, AutoTokenizer, AutoModel
-import spacy
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
-import redis
-import pymongo
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import requests
+
+# Components live in their own modules next to this one. Heavy or optional
+# dependencies (openai, redis, scikit-learn, scipy) are imported on first use
+# through optional_import()
+from profiling import install_profile_signal, loaded_optional_modules, optional_import, sampling_profiler, startup_profiler
+from metrics import Metrics
+from conversation import HISTORY_MAX, HISTORY_WINDOW, AIResponse, ConversationContext, IntentType, LanguageCode
+from kb_index import KnowledgeBase, KnowledgeMatch
+from intent_model import IntentModel, train_intent_model
+from sessions import BackgroundEventLoop, LRUCache, RedisSessionStore, SessionWriteBehind
+from caching import MessageDeduplicator, ResponseCache
+from llm_gateway import LLMGateway, LLMStreamError
+from ingestion import TranscriptSink
+from admission import LoadShedder, RateLimiter
 
 # Configure logging
 logging.basicConfig(
@@ -46,185 +59,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class IntentType(Enum):
-    """Intent classification for user queries"""
-    BURSARY_APPLICATION = "bursary_application"
-    ISSUE_REPORTING = "issue_reporting"
-    INFORMATION_REQUEST = "information_request"
-    STATUS_CHECK = "status_check"
-    COMPLAINT = "complaint"
-    GREETING = "greeting"
-    GOODBYE = "goodbye"
-    UNKNOWN = "unknown"
-    AREA_INQUIRY = "area_inquiry"
-    CONTACT_INFO = "contact_info"
-    EMERGENCY = "emergency"
-
-class LanguageCode(Enum):
-    """Supported languages"""
-    ENGLISH = "en"
-    AFRIKAANS = "af"
-    ZULU = "zu"
-    XHOSA = "xh"
-
-@dataclass
-class ConversationContext:
-    """Context for ongoing conversation"""
-    user_id: str
-    phone_number: str
-    current_intent: Optional[IntentType] = None
-    entities: Dict[str, Any] = None
-    conversation_history: List[Dict] = None
-    language: LanguageCode = LanguageCode.ENGLISH
-    session_start: datetime = None
-    last_interaction: datetime = None
-    
-    def __post_init__(self):
-        if self.entities is None:
-            self.entities = {}
-        if self.conversation_history is None:
-            self.conversation_history = []
-        if self.session_start is None:
-            self.session_start = datetime.now()
-        if self.last_interaction is None:
-            self.last_interaction = datetime.now()
-
-@dataclass
-class AIResponse:
-    """AI Assistant response structure"""
-    text: str
-    intent: IntentType
-    confidence: float
-    entities: Dict[str, Any]
-    next_actions: List[str]
-    requires_human: bool = False
-    language: LanguageCode = LanguageCode.ENGLISH
-
-class KnowledgeBase:
-    """Knowledge base for FAQ and information retrieval"""
-    
-    def __init__(self):
-        self.knowledge_data = {}
-        self.vectorizer = TfidfVectorizer(stop_words='english', max_features=1000)
-        self.knowledge_vectors = None
-        self.knowledge_texts = []
-        self.load_knowledge_base()
-    
-    def load_knowledge_base(self):
-        """Load knowledge base from JSON file"""
-        try:
-            with open('knowledge_base.json', 'r', encoding='utf-8') as f:
-                self.knowledge_data = json.load(f)
-            
-            # Prepare vectors for similarity search
-            self.knowledge_texts = []
-            for category, items in self.knowledge_data.items():
-                if isinstance(items, list):
-                    for item in items:
-                        if isinstance(item, dict) and 'question' in item:
-                            self.knowledge_texts.append(item['question'])
-                        elif isinstance(item, str):
-                            self.knowledge_texts.append(item)
-            
-            if self.knowledge_texts:
-                self.knowledge_vectors = self.vectorizer.fit_transform(self.knowledge_texts)
-            
-            logger.info(f"Knowledge base loaded with {len(self.knowledge_texts)} entries")
-            
-        except FileNotFoundError:
-            logger.warning("Knowledge base file not found, creating default")
-            self.create_default_knowledge_base()
-        except Exception as e:
-            logger.error(f"Error loading knowledge base: {e}")
-            self.create_default_knowledge_base()
-    
-    def create_default_knowledge_base(self):
-        """Create default knowledge base"""
-        self.knowledge_data = {
-            "bursary_info": [
-                {
-                    "question": "How do I apply for a bursary?",
-                    "answer": "To apply for a bursary, dial *120*8001# and follow the prompts. You'll need your ID number and school details."
-                },
-                {
-                    "question": "What documents do I need for bursary application?",
-                    "answer": "You need: ID copy, proof of registration, academic transcript, and proof of income (if applicable)."
-                },
-                {
-                    "question": "When will I know about my bursary application status?",
-                    "answer": "Bursary applications are reviewed within 30 days. You can check status by dialing *120*8001# and selecting 'Check Status'."
-                }
-            ],
-            "contact_info": [
-                {
-                    "question": "How can I contact the ward office?",
-                    "answer": "Ward office: 021-XXX-XXXX\nEmail: ward@voo.gov.za\nOffice hours: Monday-Friday 8AM-4PM"
-                },
-                {
-                    "question": "Where is the ward office located?",
-                    "answer": "VOO Ward Office\n123 Main Street, Cape Town\nBuilding A, Ground Floor"
-                }
-            ],
-            "services": [
-                {
-                    "question": "What services does the ward offer?",
-                    "answer": "Services include: Bursary applications, Issue reporting, Information requests, Document assistance, Community programs"
-                },
-                {
-                    "question": "How do I report a community issue?",
-                    "answer": "Dial *120*8001#, select 'Report Issue', and provide details. Include location, description, and urgency level."
-                }
-            ],
-            "areas": [
-                {
-                    "question": "Which areas does this ward cover?",
-                    "answer": "The ward covers multiple areas. Use *120*8001# and select 'Area Information' for specific area details."
-                }
-            ]
-        }
-        
-        # Save default knowledge base
-        try:
-            with open('knowledge_base.json', 'w', encoding='utf-8') as f:
-                json.dump(self.knowledge_data, f, indent=2, ensure_ascii=False)
-            logger.info("Default knowledge base created")
-        except Exception as e:
-            logger.error(f"Error creating default knowledge base: {e}")
-    
-    def search_knowledge(self, query: str, top_k: int = 3) -> List[Tuple[str, float]]:
-        """Search knowledge base using TF-IDF similarity"""
-        if not self.knowledge_vectors or not self.knowledge_texts:
-            return []
-        
-        try:
-            # Vectorize query
-            query_vector = self.vectorizer.transform([query])
-            
-            # Calculate similarities
-            similarities = cosine_similarity(query_vector, self.knowledge_vectors)[0]
-            
-            # Get top results
-            top_indices = np.argsort(similarities)[::-1][:top_k]
-            results = []
-            
-            for idx in top_indices:
-                if similarities[idx] > 0.1:  # Minimum similarity threshold
-                    results.append((self.knowledge_texts[idx], similarities[idx]))
-            
-            return results
-            
-        except Exception as e:
-            logger.error(f"Error searching knowledge base: {e}")
-            return []
-    
-    def get_answer(self, question: str) -> Optional[str]:
-        """Get answer for a specific question"""
-        for category, items in self.knowledge_data.items():
-            if isinstance(items, list):
-                for item in items:
-                    if isinstance(item, dict) and item.get('question', '').lower() == question.lower():
-                        return item.get('answer')
-        return None
+startup_profiler.record("import numpy, flask and components", time.perf_counter() - _core_import_started)
+
+metrics = Metrics()
+metrics.counter("ai_messages_total", "Messages processed by classified intent", "intent")
+metrics.counter("ai_requires_human_total", "Responses flagged for human intervention by intent", "intent")
+metrics.counter("ai_response_source_total", "Where each response text came from", "source")
+metrics.counter("ai_llm_requests_total", "LLM fallback attempts by outcome; failed ones get template text", "outcome")
+metrics.counter("ai_message_errors_total", "Messages answered with the technical difficulties response", "stage")
 
 class IntentClassifier:
     """Intent classification using NLP"""
@@ -283,22 +125,143 @@ class IntentClassifier:
             self.compiled_patterns[intent] = [
                 re.compile(pattern, re.IGNORECASE) for pattern in patterns
             ]
+        
+        # Fused single-pass scanner over every keyword pattern
+        self._word_pattern = re.compile(r'\w+')
+        self._ignorecase_fixes = {0x131: 'i', 0x17f: 's'}
+        self._word_char = re.compile(r'\w')
+        self._build_fused_index()
+        
+        # Optional learned model; the patterns above remain the fallback
+        self.model: Optional[IntentModel] = None
+        self.model_threshold = float(os.getenv('AI_INTENT_MODEL_THRESHOLD', 0.6))
+        model_path = os.getenv('AI_INTENT_MODEL_PATH', 'intent_model.npz')
+        if os.path.exists(model_path):
+            try:
+                self.model = IntentModel.load(model_path)
+                logger.info(f"Intent model {self.model.model_version} loaded with {len(self.model.classes)} intents")
+            except Exception as e:
+                logger.error(f"Error loading intent model {model_path}: {e}")
+    
+    def _build_fused_index(self):
+        """Compile all intent patterns into one keyword index keyed by first word.
+        
+        Patterns of the form ``\\b(a|b)\\b`` become keyword slots and patterns of
+        the form ``\\b(a|b)\\b.*\\b(c|d)\\b`` become head/tail sequence slots.
+        Anything else keeps its compiled regex and is scored the legacy way.
+        """
+        shape = re.compile(r'^\\b\(([^()]*)\)\\b(?:\.\*\\b\(([^()]*)\)\\b)?$')
+        literal = re.compile(r"^\w[\w' ]*\w$|^\w$")
+        
+        self._slot_kinds = []        # 'kw', 'seq' or 'regex' per pattern slot
+        self._slot_patterns = []     # compiled fallback for 'regex' slots
+        self._intent_slots = []      # (intent, [slot ids]) in declaration order
+        self._keyword_index = {}     # first word -> [(phrase, single_word, slot, role, rank)]
+        
+        for intent, patterns in self.intent_patterns.items():
+            slot_ids = []
+            for pattern, compiled in zip(patterns, self.compiled_patterns[intent]):
+                slot = len(self._slot_kinds)
+                slot_ids.append(slot)
+                parsed = shape.match(pattern)
+                groups = [g for g in parsed.groups() if g is not None] if parsed else []
+                alternatives = [group.split('|') for group in groups]
+                if not parsed or not all(
+                    literal.match(alt) and alt == alt.lower()
+                    for alts in alternatives for alt in alts
+                ):
+                    self._slot_kinds.append('regex')
+                    self._slot_patterns.append(compiled)
+                    continue
+                
+                self._slot_kinds.append('kw' if len(groups) == 1 else 'seq')
+                self._slot_patterns.append(None)
+                for role, alts in enumerate(alternatives):
+                    for rank, phrase in enumerate(alts):
+                        first_word = self._word_pattern.match(phrase).group()
+                        self._keyword_index.setdefault(first_word, []).append(
+                            (phrase, phrase == first_word, slot, role, rank)
+                        )
+            self._intent_slots.append((intent, slot_ids))
+    
+    def _count_matches(self, text: str) -> List[int]:
+        """Count non-overlapping matches for every pattern slot in one scan"""
+        slot_count = len(self._slot_kinds)
+        counts = [0] * slot_count
+        last_end = [0] * slot_count
+        head_line = [-1] * slot_count
+        head_end = [0] * slot_count
+        matched_line = [-1] * slot_count
+        
+        # re.IGNORECASE also folds these onto ASCII letters; lower() does not
+        scan_text = text if text.isascii() else text.translate(self._ignorecase_fixes)
+        newlines = [i for i, ch in enumerate(scan_text) if ch == '\n'] if '\n' in scan_text else None
+        index = self._keyword_index
+        text_len = len(scan_text)
+        
+        for word in self._word_pattern.finditer(scan_text):
+            entries = index.get(word.group())
+            if not entries:
+                continue
+            start = word.start()
+            line = bisect.bisect_left(newlines, start) if newlines else 0
+            best = {}
+            for phrase, single_word, slot, role, rank in entries:
+                if single_word:
+                    end = word.end()
+                else:
+                    end = start + len(phrase)
+                    if not scan_text.startswith(phrase, start):
+                        continue
+                    if end < text_len and self._word_char.match(scan_text, end):
+                        continue
+                
+                if self._slot_kinds[slot] == 'kw':
+                    # Leftmost-first: lowest alternative rank wins at a position
+                    if slot not in best or rank < best[slot][0]:
+                        best[slot] = (rank, end)
+                elif role == 0:
+                    # Earliest-ending head on this line opens the sequence
+                    if head_line[slot] != line or end < head_end[slot]:
+                        head_line[slot] = line
+                        head_end[slot] = end
+                elif head_line[slot] == line and start >= head_end[slot] and matched_line[slot] != line:
+                    # Greedy ``.*`` yields at most one match per line
+                    matched_line[slot] = line
+                    counts[slot] += 1
+            
+            for slot, (rank, end) in best.items():
+                if start >= last_end[slot]:
+                    counts[slot] += 1
+                    last_end[slot] = end
+        
+        for slot, pattern in enumerate(self._slot_patterns):
+            if pattern is not None:
+                counts[slot] = len(pattern.findall(text))
+        
+        return counts
     
     def classify_intent(self, text: str) -> Tuple[IntentType, float]:
         """Classify intent from text"""
+        if self.model is None:
+            return self.classify_rules(text)
+        return self.classify_batch([text])[0]
+    
+    def classify_rules(self, text: str) -> Tuple[IntentType, float]:
+        """Classify intent with the keyword patterns alone"""
         text = text.lower().strip()
+        counts = self._count_matches(text)
         
         # Score each intent
         intent_scores = {}
-        for intent, patterns in self.compiled_patterns.items():
+        for intent, slot_ids in self._intent_slots:
             score = 0
-            for pattern in patterns:
-                matches = len(pattern.findall(text))
+            for slot in slot_ids:
+                matches = counts[slot]
                 if matches > 0:
                     score += matches * 0.3  # Base score per match
                     # Bonus for exact matches
-                    if pattern.search(text):
-                        score += 0.2
+                    score += 0.2
             intent_scores[intent] = score
         
         # Find best intent
@@ -308,81 +271,402 @@ class IntentClassifier:
                 return best_intent[0], min(best_intent[1], 1.0)
         
         return IntentType.UNKNOWN, 0.0
+    
+    def classify_batch(self, texts: List[str]) -> List[Tuple[IntentType, float]]:
+        """Classify intents for a batch of texts, in order.
+        
+        With a model loaded, its prediction is used when its probability
+        reaches the threshold and the patterns do not flag an emergency;
+        otherwise the pattern result stands.
+        """
+        classify = self.classify_rules
+        rule_results = [classify(text) for text in texts]
+        if self.model is None or not texts:
+            return rule_results
+        
+        results = []
+        for rules, predicted in zip(rule_results, self.model.predict(texts)):
+            if predicted[1] >= self.model_threshold and rules[0] != IntentType.EMERGENCY:
+                results.append(predicted)
+            else:
+                results.append(rules)
+        return results
+
+class Entity(NamedTuple):
+    """Typed entity found in a message, with its normalised value and span"""
+    type: str
+    value: str
+    start: int
+    end: int
 
 class EntityExtractor:
-    """Extract entities from user input"""
+    """Extract entities from user input in one pass over the text.
+    
+    All entity patterns are fused into a single alternation scanned left to
+    right, so a span claimed by one entity is never reported as another.
+    At the same position the order of ``patterns`` is the precedence: an
+    e-mail beats an area code, and dates, phone and ID numbers beat amounts.
+    """
+    
+    # SA numbers match with 0, 27 or +27 in front and optional space/dash groups;
+    # only mobile ranges are kept, landlines are consumed so they are not read as amounts
+    PHONE_PREFIXES = ('6', '7', '8')
     
     def __init__(self):
-        # Common entity patterns
+        # Common entity patterns, in precedence order (non-capturing)
         self.patterns = {
-            'phone_number': re.compile(r'\b(?:\+27|0)(?:6[0-9]|7[0-9]|8[0-9])\d{7}\b'),
-            'id_number': re.compile(r'\b\d{13}\b'),
-            'amount': re.compile(r'\b(?:R\s*)?(\d+(?:,\d{3})*(?:\.\d{2})?)\b'),
-            'date': re.compile(r'\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\w*\s+\d{2,4})\b'),
-            'area_code': re.compile(r'\b[A-Z]{2,3}\d{2,4}\b'),
-            'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+            'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b',
+            'date': r'\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\w*\s+\d{2,4})\b',
+            'phone_number': r'(?<![\w+])(?:\+?27[ -]?|0)[1-8]\d(?:[ -]?\d{3})(?:[ -]?\d{4})\b',
+            'id_number': r'\b\d{13}\b',
+            'area_code': r'\b[A-Z]{2,3}\d{2,4}\b',
+            'amount': r'\b(?:R\s*)?\d+(?:,\d{3})*(?:\.\d{2})?\b'
+        }
+        self.scanner = self._fuse(self.patterns)
+        # Without an '@' only digit-bearing entities can match, and each starts with +, R, a digit or a capital
+        self.digit_scanner = self._fuse({k: v for k, v in self.patterns.items() if k != 'email'}, r'[+\dA-Z]')
+        self.has_digit = re.compile(r'\d').search
+        self.normalizers = {
+            'phone_number': self.normalize_phone,
+            'id_number': self.validate_id_number,
+            'amount': self.normalize_amount
         }
     
-    def extract_entities(self, text: str) -> Dict[str, Any]:
-        """Extract entities from text"""
-        entities = {}
+    @staticmethod
+    def _fuse(patterns: Dict[str, str], first_char: str = '') -> 're.Pattern':
+        """Join patterns into one named-group alternation, optionally gated on the first character"""
+        alternation = '|'.join(f'(?P<{entity_type}>{pattern})' for entity_type, pattern in patterns.items())
+        return re.compile(f'(?={first_char})(?:{alternation})' if first_char else alternation)
+    
+    @classmethod
+    def normalize_phone(cls, raw: str) -> Optional[str]:
+        """Return the number in local 0XXXXXXXXX form, or None if it is not a mobile number"""
+        digits = ''.join(ch for ch in raw if ch.isdigit())
+        if digits.startswith('27'):
+            digits = '0' + digits[2:]
+        if len(digits) != 10 or digits[1] not in cls.PHONE_PREFIXES:
+            return None
+        return digits
+    
+    @staticmethod
+    def validate_id_number(raw: str) -> Optional[str]:
+        """Return a SA ID number if its birth date and Luhn check digit are valid"""
+        month, day = int(raw[2:4]), int(raw[4:6])
+        if not (1 <= month <= 12 and 1 <= day <= 31):
+            return None
+        
+        total = 0
+        for i, ch in enumerate(reversed(raw)):
+            digit = ord(ch) - 48
+            if i % 2:
+                digit *= 2
+                if digit > 9:
+                    digit -= 9
+            total += digit
+        return raw if total % 10 == 0 else None
+    
+    @staticmethod
+    def normalize_amount(raw: str) -> Optional[str]:
+        """Drop the currency prefix, keeping the number as written"""
+        return raw.lstrip('R').lstrip()
+    
+    def scan(self, text: str) -> List[Entity]:
+        """Return every valid entity in order of appearance"""
+        if '@' in text:
+            scanner = self.scanner
+        elif self.has_digit(text):
+            scanner = self.digit_scanner
+        else:
+            return []
+        
+        found = []
+        normalizers = self.normalizers
+        for match in scanner.finditer(text):
+            entity_type = match.lastgroup
+            value = match.group()
+            normalize = normalizers.get(entity_type)
+            if normalize is not None:
+                value = normalize(value)
+                if value is None:
+                    continue
+            found.append(Entity(entity_type, value, match.start(), match.end()))
         
-        for entity_type, pattern in self.patterns.items():
-            matches = pattern.findall(text)
-            if matches:
-                entities[entity_type] = matches[0] if len(matches) == 1 else matches
+        return found
+    
+    def extract_entities(self, text: str) -> Dict[str, Any]:
+        """Extract entities from text: one value per type, or a list when repeated"""
+        grouped: Dict[str, List[str]] = {}
+        for entity in self.scan(text):
+            grouped.setdefault(entity.type, []).append(entity.value)
         
-        return entities
+        return {
+            entity_type: values[0] if len(values) == 1 else values
+            for entity_type in self.patterns if (values := grouped.get(entity_type))
+        }
+    
+    def extract_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Extract entities for a batch of texts, in order"""
+        extract = self.extract_entities
+        return [extract(text) for text in texts]
 
 class VOOWardAIAssistant:
     """Main AI Assistant class"""
     
     def __init__(self):
-        self.knowledge_base = KnowledgeBase()
-        self.intent_classifier = IntentClassifier()
-        self.entity_extractor = EntityExtractor()
+        started = time.perf_counter()
+        
+        with startup_profiler.measure("load knowledge base"):
+            self.knowledge_base = KnowledgeBase()
+        
+        # Optionally pick up knowledge base edits without a restart
+        reload_interval = float(os.getenv('AI_KB_RELOAD_INTERVAL', 0))
+        if reload_interval > 0:
+            self.knowledge_base.start_watcher(reload_interval)
+        
+        with startup_profiler.measure("compile intent and entity patterns"):
+            self.intent_classifier = IntentClassifier()
+            self.entity_extractor = EntityExtractor()
         
         # Initialize Redis for session management
-        self.redis_client = None
-        self.init_redis()
+        self.io_loop = BackgroundEventLoop()
+        self.session_store = RedisSessionStore(self.io_loop)
+        self.context_ttl = int(os.getenv('AI_CONTEXT_TTL', 3600))
+        with startup_profiler.measure("connect redis"):
+            self.init_redis()
+        
+        # In-process session tier in front of Redis; it also covers Redis outages
+        cache_size = int(os.getenv('AI_SESSION_CACHE_SIZE', 10000))
+        cache_ttl = float(os.getenv('AI_SESSION_CACHE_TTL', self.context_ttl))
+        self.session_cache = LRUCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.write_behind = None
+        self.init_write_behind()
+        # Redis may only come up after startup; write-behind starts when it does
+        self.session_store.on_connect.append(self.init_write_behind)
+        
+        # Cache LLM fallback answers for repeated questions
+        response_cache_size = int(os.getenv('AI_LLM_CACHE_SIZE', 5000))
+        self.response_cache = None
+        if response_cache_size > 0:
+            self.response_cache = ResponseCache(
+                self.session_store,
+                self.knowledge_base,
+                response_cache_size,
+                int(os.getenv('AI_LLM_CACHE_TTL', 86400)),
+                float(os.getenv('AI_LLM_CACHE_SIMILARITY', 0))
+            )
+        
+        # Answer gateway retries from the original turn instead of processing them again
+        dedup_ttl = int(os.getenv('AI_DEDUP_TTL', 15))
+        dedup_size = int(os.getenv('AI_DEDUP_CACHE_SIZE', 10000))
+        dedup_wait = float(os.getenv('AI_DEDUP_WAIT', 10))
+        self.deduplicator = None
+        if dedup_ttl > 0:
+            self.deduplicator = MessageDeduplicator(self.session_store, dedup_ttl, dedup_size, dedup_wait)
+        # Retries without a sequence id are matched on their text, over a window short
+        # enough that a subscriber repeating "1" or "yes" on purpose is rarely caught
+        text_window = int(os.getenv('AI_DEDUP_TEXT_WINDOW', 3))
+        self.text_deduplicator = None
+        if text_window > 0:
+            self.text_deduplicator = MessageDeduplicator(self.session_store, text_window, dedup_size, dedup_wait)
+        
+        # Admission control: per-subscriber token buckets, and shedding of LLM calls under overload
+        per_minute = float(os.getenv('AI_RATE_LIMIT_PER_MINUTE', 30))
+        self.rate_limiter = None
+        if per_minute > 0:
+            self.rate_limiter = RateLimiter(self.session_store, float(os.getenv('AI_RATE_LIMIT_BURST', 10)), per_minute)
+        self.load_shedder = LoadShedder(
+            int(os.getenv('AI_SHED_MAX_IN_FLIGHT', 64)),
+            float(os.getenv('AI_SHED_LATENCY_MS', 3000)) / 1000
+        )
+        
+        # Persist finished turns for analytics off the request path
+        self.transcript_sink = None
+        self.init_transcript_sink()
         
         # Initialize OpenAI if API key available
         self.openai_client = None
-        self.init_openai()
+        self.llm_gateway = None
+        with startup_profiler.measure("initialise openai"):
+            self.init_openai()
         
         # Response templates
         self.response_templates = self.load_response_templates()
         
+        # Component counters are read when /metrics is scraped
+        metrics.collector(self.collect_metrics)
+        
+        self.startup_seconds = time.perf_counter() - started
+        startup_budget_ms = float(os.getenv('AI_STARTUP_BUDGET_MS', 0))
+        if startup_budget_ms and self.startup_seconds * 1000 > startup_budget_ms:
+            logger.warning(
+                f"Startup took {self.startup_seconds * 1000:.0f}ms, over the {startup_budget_ms:.0f}ms budget"
+            )
+        
         logger.info("VOO Ward AI Assistant initialized")
     
+    def collect_metrics(self) -> List[Tuple[str, str, str, Any, Tuple[str, ...]]]:
+        """Cache, Redis, write-behind, gateway and KB samples for the metrics registry"""
+        samples = [
+            ("ai_redis_up", "gauge", "Whether the Redis session store is connected",
+             int(self.session_store.available), ()),
+            ("ai_redis_errors_total", "counter", "Failed Redis round trips by operation",
+             {(operation,): count for operation, count in self.session_store.errors.items()}, ("operation",)),
+            ("ai_redis_reconnects_total", "counter", "Redis connections re-established after a failure",
+             self.session_store.reconnects, ()),
+            ("ai_kb_entries", "gauge", "Knowledge base entries in the live index",
+             len(self.knowledge_base.index.questions), ()),
+        ]
+        
+        for cache_name, cache in (("session", self.session_cache), ("response", self.response_cache)):
+            if cache:
+                stats = cache.stats()
+                samples.append((f"ai_{cache_name}_cache_entries", "gauge", f"Entries in the {cache_name} cache", stats["size"], ()))
+                # Shared and near-duplicate hits are local misses answered elsewhere
+                shared_hits, near_hits = stats.get("shared_hits", 0), stats.get("near_duplicate_hits", 0)
+                lookups = {("hit",): stats["hits"], ("miss",): stats["misses"] - shared_hits - near_hits}
+                if cache is self.response_cache:
+                    lookups[("shared_hit",)] = shared_hits
+                    lookups[("near_duplicate_hit",)] = near_hits
+                samples.append((f"ai_{cache_name}_cache_lookups_total", "counter",
+                                f"{cache_name.capitalize()} cache lookups by result", lookups, ("result",)))
+        
+        if self.write_behind:
+            stats = self.write_behind.stats()
+            samples.append(("ai_session_write_behind_pending", "gauge", "Sessions queued for Redis", stats["pending"], ()))
+            samples.append(("ai_session_write_behind_total", "counter", "Queued sessions by outcome", {
+                ("flushed",): stats["flushed"],
+                ("dropped",): stats["dropped"]
+            }, ("outcome",)))
+            samples.append(("ai_session_write_behind_failed_flushes_total", "counter", "Write-behind flushes that failed and were requeued",
+                            stats["failed_flushes"], ()))
+        
+        if self.rate_limiter:
+            stats = self.rate_limiter.stats()
+            samples.append(("ai_rate_limited_total", "counter", "Messages refused by the per-subscriber rate limiter",
+                            stats["limited"], ()))
+            samples.append(("ai_rate_limit_local_decisions_total", "counter",
+                            "Rate limit decisions made in process because Redis was unavailable", stats["local_decisions"], ()))
+        
+        if self.transcript_sink:
+            stats = self.transcript_sink.stats()
+            samples.append(("ai_transcripts_pending", "gauge", "Transcripts queued for MongoDB", stats["pending"], ()))
+            samples.append(("ai_transcripts_total", "counter", "Transcripts by outcome", {
+                ("written",): stats["written"],
+                ("spilled",): stats["spilled"],
+                ("replayed",): stats["replayed"],
+                ("dropped",): stats["dropped"]
+            }, ("outcome",)))
+        
+        duplicates = {}
+        for key, deduplicator in (("sequence_id", self.deduplicator), ("text", self.text_deduplicator)):
+            if deduplicator:
+                stats = deduplicator.stats()
+                for outcome in ("replayed", "joined", "shared"):
+                    duplicates[(outcome, key)] = stats[outcome]
+        if duplicates:
+            samples.append(("ai_duplicate_messages_total", "counter", "Retried messages answered from the original turn",
+                            duplicates, ("outcome", "key")))
+        
+        stats = self.load_shedder.stats()
+        samples.append(("ai_overloaded", "gauge", "1 while LLM calls are being shed", int(stats["shedding"]), ()))
+        samples.append(("ai_turns_in_flight", "gauge", "Turns being processed", stats["in_flight"], ()))
+        samples.append(("ai_turn_latency_average_seconds", "gauge", "Moving average of turn latency", stats["latency_ms"] / 1000, ()))
+        
+        if self.llm_gateway:
+            stats = self.llm_gateway.stats()
+            samples.append(("ai_llm_breaker_open", "gauge", "1 while the LLM circuit breaker is open or half-open",
+                            int(stats["state"] != "closed"), ()))
+            samples.append(("ai_llm_in_flight", "gauge", "Distinct LLM calls in flight", stats["in_flight"], ()))
+            samples.append(("ai_llm_gateway_total", "counter", "LLM gateway events", {
+                (event,): stats[event] for event in ("calls", "coalesced", "rejected", "timeouts", "failures")
+            }, ("event",)))
+        
+        return samples
+    
     def init_redis(self):
-        """Initialize Redis connection"""
-        try:
-            redis_host = os.getenv('REDIS_HOST', 'localhost')
-            redis_port = int(os.getenv('REDIS_PORT', 6379))
-            redis_password = os.getenv('REDIS_PASSWORD')
-            
-            self.redis_client = redis.Redis(
-                host=redis_host,
-                port=redis_port,
-                password=redis_password,
-                decode_responses=True
-            )
-            
-            # Test connection
-            self.redis_client.ping()
-            logger.info("Redis connection established")
-            
-        except Exception as e:
-            logger.warning(f"Redis connection failed: {e}")
-            self.redis_client = None
+        """Initialize Redis connection pool"""
+        self.session_store.connect()
+    
+    def init_write_behind(self):
+        """Write cached sessions back to Redis asynchronously when both tiers exist"""
+        if self.write_behind or not self.session_cache or not self.session_store.available:
+            return
+        self.write_behind = SessionWriteBehind(
+            self.session_store,
+            self.context_ttl,
+            float(os.getenv('AI_SESSION_FLUSH_MS', 10)) / 1000,
+            self.session_cache.max_entries
+        )
+    
+    def init_transcript_sink(self):
+        """Write transcripts to MongoDB when AI_TRANSCRIPT_MONGO_URI is set and pymongo is installed"""
+        uri = os.getenv('AI_TRANSCRIPT_MONGO_URI')
+        if not uri:
+            return
+        if importlib.util.find_spec('pymongo') is None:
+            logger.warning("AI_TRANSCRIPT_MONGO_URI set but the pymongo package is not installed")
+            return
+        self.transcript_sink = TranscriptSink(
+            uri,
+            os.getenv('AI_TRANSCRIPT_DB') or None,
+            os.getenv('AI_TRANSCRIPT_COLLECTION', 'ai_transcripts'),
+            int(os.getenv('AI_TRANSCRIPT_BATCH_SIZE', 500)),
+            float(os.getenv('AI_TRANSCRIPT_FLUSH_MS', 1000)) / 1000,
+            int(os.getenv('AI_TRANSCRIPT_QUEUE_SIZE', 50000)),
+            os.getenv('AI_TRANSCRIPT_SPILL_PATH', 'transcripts.spill.jsonl'),
+            int(float(os.getenv('AI_TRANSCRIPT_SPILL_MAX_MB', 100)) * 1024 * 1024)
+        )
+    
+    async def startup(self):
+        """Bind pooled clients to the running loop and warm the hot paths (ASGI lifespan)"""
+        loop = asyncio.get_running_loop()
+        if self.io_loop.loop is not loop:
+            # Clients created at import time live on the background thread's loop
+            await self.session_store.close()
+            self.io_loop.adopt(loop)
+            if self.llm_gateway:
+                self.llm_gateway.rebind()
+            await self.session_store.aconnect()
+        
+        with startup_profiler.measure("warm up"):
+            self.warm_up()
+        logger.info("VOO Ward AI Assistant serving on the ASGI event loop")
+    
+    async def shutdown(self):
+        """Flush queued sessions and close pools (ASGI lifespan)"""
+        self.knowledge_base.stop_watcher()
+        if self.write_behind:
+            await self.write_behind.drain()
+        if self.transcript_sink:
+            await asyncio.get_running_loop().run_in_executor(None, self.transcript_sink.close)
+        await self.session_store.close()
+        logger.info("VOO Ward AI Assistant stopped")
+    
+    def warm_up(self):
+        """Run the per-message paths once so the first request does not pay for it"""
+        self.entity_extractor.extract_entities("warm up 0821234567")
+        self.intent_classifier.classify_intent("hello, how do I apply for a bursary?")
+        self.knowledge_base.search_knowledge("how do I apply for a bursary?")
     
     def init_openai(self):
         """Initialize OpenAI client"""
         api_key = os.getenv('OPENAI_API_KEY')
         if api_key:
+            openai = optional_import('openai')
+            if openai is None:
+                logger.warning("OpenAI API key set but the openai package is not installed")
+                return
             openai.api_key = api_key
             self.openai_client = openai
+            self.llm_gateway = LLMGateway(
+                openai,
+                self.io_loop,
+                model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+                max_concurrency=int(os.getenv('AI_LLM_MAX_CONCURRENCY', 8)),
+                timeout=float(os.getenv('AI_LLM_TIMEOUT', 4.0)),
+                failure_threshold=int(os.getenv('AI_LLM_BREAKER_FAILURES', 5)),
+                cooldown=float(os.getenv('AI_LLM_BREAKER_COOLDOWN', 30.0))
+            )
             logger.info("OpenAI client initialized")
         else:
             logger.warning("OpenAI API key not found")
@@ -424,137 +708,409 @@ class VOOWardAIAssistant:
     
     async def process_message(self, user_input: str, context: ConversationContext) -> AIResponse:
         """Process user message and generate response"""
+        started = time.perf_counter()
+        with self.load_shedder.track():
+            try:
+                # Extract entities
+                entities = self.entity_extractor.extract_entities(user_input)
+                extracted = time.perf_counter()
+                metrics.observe("entities", extracted - started)
+                
+                # Classify intent
+                intent, confidence = self.intent_classifier.classify_intent(user_input)
+                classified = time.perf_counter()
+                metrics.observe("intent", classified - extracted)
+                
+                context.language = self.knowledge_base.detect_language(user_input, context.language)
+                metrics.observe("language", time.perf_counter() - classified)
+                
+                response = await self.complete_turn(user_input, context, entities, intent, confidence)
+                latency = time.perf_counter() - started
+                metrics.observe("total", latency)
+                self.record_transcript(user_input, context, response, latency, "chat")
+                return response
+                
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                metrics.inc("ai_message_errors_total", "process_message")
+                return self.technical_difficulties_response()
+        
+    async def process_batch(self, turns: List[Tuple[str, ConversationContext]]) -> List[AIResponse]:
+        """Process a batch of (message, context) turns, returning responses in order.
+        
+        Entity extraction, intent classification and knowledge base scoring run
+        once across the whole batch. Turns for the same user are completed in
+        order; different users are completed concurrently.
+        """
+        with self.load_shedder.track(len(turns)):
+            return await self._process_batch(turns)
+    
+    async def _process_batch(self, turns: List[Tuple[str, ConversationContext]]) -> List[AIResponse]:
+        texts = [user_input for user_input, _ in turns]
+        started = time.perf_counter()
         try:
-            # Update context
-            context.last_interaction = datetime.now()
-            context.conversation_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "role": "user",
-                "content": user_input
-            })
-            
-            # Extract entities
-            entities = self.entity_extractor.extract_entities(user_input)
-            context.entities.update(entities)
-            
-            # Classify intent
-            intent, confidence = self.intent_classifier.classify_intent(user_input)
-            context.current_intent = intent
-            
-            # Generate response based on intent
-            response_text = await self.generate_response(intent, user_input, context)
-            
-            # Determine next actions
-            next_actions = self.get_next_actions(intent, entities)
-            
-            # Check if human intervention needed
-            requires_human = self.requires_human_intervention(intent, confidence, entities)
+            entities_batch = self.entity_extractor.extract_batch(texts)
+            extracted = time.perf_counter()
+            metrics.observe("batch_entities", extracted - started)
+            intents_batch = self.intent_classifier.classify_batch(texts)
+            classified = time.perf_counter()
+            metrics.observe("batch_intent", classified - extracted)
+            languages = [
+                self.knowledge_base.detect_language(user_input, context.language)
+                for user_input, context in turns
+            ]
+            detected = time.perf_counter()
+            metrics.observe("batch_language", detected - classified)
             
-            # Create response
-            response = AIResponse(
-                text=response_text,
-                intent=intent,
-                confidence=confidence,
-                entities=entities,
-                next_actions=next_actions,
-                requires_human=requires_human,
-                language=context.language
+            # Score every KB-answerable message in one product per language
+            info_indices = [
+                i for i, (intent, _) in enumerate(intents_batch)
+                if self.searches_knowledge_base(intent, languages[i])
+            ]
+            kb_batch = self.knowledge_base.search_knowledge_batch(
+                [texts[i] for i in info_indices], languages=[languages[i] for i in info_indices]
             )
+            kb_results = dict(zip(info_indices, kb_batch))
+            if info_indices:
+                metrics.observe("batch_kb_search", time.perf_counter() - detected)
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            metrics.inc("ai_message_errors_total", "process_batch", len(turns))
+            return [self.technical_difficulties_response() for _ in turns]
+        
+        responses: List[Optional[AIResponse]] = [None] * len(turns)
+        
+        async def complete_user_turns(indices: List[int]):
+            for i in indices:
+                user_input, context = turns[i]
+                intent, confidence = intents_batch[i]
+                context.language = languages[i]
+                try:
+                    responses[i] = await self.complete_turn(
+                        user_input, context, entities_batch[i], intent, confidence,
+                        kb_results=kb_results.get(i), save=False
+                    )
+                    self.record_transcript(user_input, context, responses[i], time.perf_counter() - started, "batch")
+                except Exception as e:
+                    logger.error(f"Error processing message: {e}")
+                    metrics.inc("ai_message_errors_total", "process_batch")
+                    responses[i] = self.technical_difficulties_response()
+        
+        by_user: Dict[str, List[int]] = {}
+        for i, (_, context) in enumerate(turns):
+            by_user.setdefault(context.user_id, []).append(i)
+        await asyncio.gather(*(complete_user_turns(indices) for indices in by_user.values()))
+        
+        # Save every touched context in one pipelined round trip
+        saving = time.perf_counter()
+        await self.save_contexts([turns[indices[-1]][1] for indices in by_user.values()])
+        finished = time.perf_counter()
+        metrics.observe("batch_context_save", finished - saving)
+        metrics.observe("batch_total", finished - started)
+        
+        return responses
+    
+    async def complete_turn(self, user_input: str, context: ConversationContext,
+                            entities: Dict[str, Any], intent: IntentType, confidence: float,
+                            kb_results: Optional[List[KnowledgeMatch]] = None,
+                            save: bool = True) -> AIResponse:
+        """Finish a turn once entities and intent are known"""
+        self.begin_turn(user_input, context, entities, intent)
+        
+        # Generate response based on intent
+        response_text = await self.generate_response(intent, user_input, context, kb_results)
+        
+        return await self.finish_turn(user_input, context, entities, intent, confidence, response_text, save)
+    
+    def begin_turn(self, user_input: str, context: ConversationContext, entities: Dict[str, Any], intent: IntentType):
+        """Record the user's message and what was understood from it"""
+        context.last_interaction = datetime.now()
+        context.append_history({
+            "timestamp": datetime.now().isoformat(),
+            "role": "user",
+            "content": user_input
+        })
+        context.entities.update(entities)
+        context.current_intent = intent
+    
+    async def finish_turn(self, user_input: str, context: ConversationContext, entities: Dict[str, Any],
+                          intent: IntentType, confidence: float, response_text: str, save: bool = True) -> AIResponse:
+        """Build the response for a generated answer, record it and save the context"""
+        # Determine next actions
+        next_actions = self.get_next_actions(intent, entities)
             
-            # Add to conversation history
-            context.conversation_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "role": "assistant",
-                "content": response_text,
-                "intent": intent.value,
-                "confidence": confidence
-            })
-            
-            # Save context to Redis
+        # Check if human intervention needed
+        requires_human = self.requires_human_intervention(intent, confidence, entities)
+        metrics.inc("ai_messages_total", intent.value)
+        if requires_human:
+            metrics.inc("ai_requires_human_total", intent.value)
+        
+        # Create response
+        response = AIResponse(
+            text=response_text,
+            intent=intent,
+            confidence=confidence,
+            entities=entities,
+            next_actions=next_actions,
+            requires_human=requires_human,
+            language=context.language
+        )
+        
+        # Add to conversation history
+        context.append_history({
+            "timestamp": datetime.now().isoformat(),
+            "role": "assistant",
+            "content": response_text,
+            "intent": intent.value,
+            "confidence": confidence
+        })
+        
+        # Save context to Redis
+        if save:
+            saving = time.perf_counter()
             await self.save_context(context)
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            return AIResponse(
-                text="I'm experiencing technical difficulties. Please try again or contact support.",
-                intent=IntentType.UNKNOWN,
-                confidence=0.0,
-                entities={},
-                next_actions=["contact_support"],
-                requires_human=True
-            )
+            metrics.observe("context_save", time.perf_counter() - saving)
+        
+        return response
+    
+    def record_transcript(self, user_input: str, context: ConversationContext, response: AIResponse,
+                          latency: float, route: str):
+        """Queue a finished turn for the transcript store; never waits on MongoDB"""
+        if self.transcript_sink is None:
+            return
+        self.transcript_sink.record({
+            "_id": os.urandom(12).hex(),
+            "timestamp": time.time(),
+            "user_id": context.user_id,
+            "route": route,
+            "language": response.language.value,
+            "message": user_input,
+            "response": response.text,
+            "intent": response.intent.value,
+            "confidence": response.confidence,
+            "entities": response.entities,
+            "requires_human": response.requires_human,
+            "latency_ms": round(latency * 1000, 2)
+        })
+    
+    def technical_difficulties_response(self) -> AIResponse:
+        """Fallback response when a turn cannot be processed"""
+        return AIResponse(
+            text="I'm experiencing technical difficulties. Please try again or contact support.",
+            intent=IntentType.UNKNOWN,
+            confidence=0.0,
+            entities={},
+            next_actions=["contact_support"],
+            requires_human=True,
+            failed=True
+        )
+    
+    async def stream_message(self, user_input: str, context: ConversationContext) -> AsyncIterator[Tuple[str, Any]]:
+        """Process a message, yielding ("token", text) as LLM text arrives and then ("response", AIResponse).
+        
+        Knowledge base, cached and template answers yield no tokens, only the response.
+        """
+        started = time.perf_counter()
+        with self.load_shedder.track():
+            try:
+                entities = self.entity_extractor.extract_entities(user_input)
+                extracted = time.perf_counter()
+                metrics.observe("entities", extracted - started)
+                
+                intent, confidence = self.intent_classifier.classify_intent(user_input)
+                classified = time.perf_counter()
+                metrics.observe("intent", classified - extracted)
+                
+                context.language = self.knowledge_base.detect_language(user_input, context.language)
+                metrics.observe("language", time.perf_counter() - classified)
+                
+                self.begin_turn(user_input, context, entities, intent)
+                response_text = await self.lookup_response(intent, user_input, context)
+                
+                if response_text is None and self.uses_llm(intent) and not self.sheds_llm():
+                    parts: List[str] = []
+                    llm_started = time.perf_counter()
+                    try:
+                        async for text in self.llm_gateway.stream(self.build_llm_messages(user_input, context)):
+                            if not parts:
+                                metrics.observe("llm_first_token", time.perf_counter() - llm_started)
+                            parts.append(text)
+                            yield "token", text
+                        completed = True
+                    except LLMStreamError as e:
+                        # The user already has the partial text; keep it but don't cache it
+                        logger.warning(f"{e}")
+                        completed = False
+                    metrics.observe("llm", time.perf_counter() - llm_started)
+                    
+                    if parts:
+                        response_text = "".join(parts).strip()
+                        if completed and self.response_cache:
+                            await self.response_cache.put(user_input, intent, context.language, response_text)
+                        metrics.inc("ai_llm_requests_total", "answered" if completed else "interrupted")
+                        metrics.inc("ai_response_source_total", "llm")
+                    else:
+                        metrics.inc("ai_llm_requests_total", "failed")
+                
+                if response_text is None:
+                    response_text = self.template_response(intent, context)
+                
+                response = await self.finish_turn(user_input, context, entities, intent, confidence, response_text)
+                latency = time.perf_counter() - started
+                metrics.observe("total", latency)
+                self.record_transcript(user_input, context, response, latency, "stream")
+                
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                metrics.inc("ai_message_errors_total", "stream_message")
+                response = self.technical_difficulties_response()
+        
+        yield "response", response
+    
+    def dedup_key(self, user_id: Any, user_input: str,
+                  sequence_id: Any) -> Tuple[Optional[MessageDeduplicator], Optional[str]]:
+        """Deduplicator and key for a message: by sequence id if the gateway sent one, else by text"""
+        if sequence_id is not None:
+            if self.deduplicator:
+                return self.deduplicator, self.deduplicator.key(user_id, user_input, sequence_id)
+        elif self.text_deduplicator:
+            return self.text_deduplicator, self.text_deduplicator.text_key(user_id, user_input)
+        return None, None
+    
+    async def admit(self, user_input: str, user_id: str, phone_number: Optional[str]) -> float:
+        """Seconds the subscriber must wait before sending; 0 admits the message.
+        
+        Emergencies are admitted even when the subscriber is over the limit.
+        """
+        if self.rate_limiter is None:
+            return 0.0
+        wait = await self.rate_limiter.acquire(user_id, phone_number)
+        if wait and self.intent_classifier.classify_intent(user_input)[0] == IntentType.EMERGENCY:
+            return 0.0
+        return wait
+    
+    def uses_llm(self, intent: IntentType) -> bool:
+        """Whether an intent without a KB or cached answer goes to the LLM"""
+        return bool(self.llm_gateway) and intent in [IntentType.INFORMATION_REQUEST, IntentType.UNKNOWN]
     
-    async def generate_response(self, intent: IntentType, user_input: str, context: ConversationContext) -> str:
+    def sheds_llm(self) -> bool:
+        """Whether to answer from templates instead of the LLM because the service is overloaded.
+        
+        Only LLM-bound turns ask; everything else, EMERGENCY included, never
+        touches the LLM and is answered on the fast path regardless.
+        """
+        if not self.load_shedder.overloaded():
+            return False
+        self.load_shedder.shed += 1
+        metrics.inc("ai_llm_requests_total", "shed")
+        return True
+    
+    def searches_knowledge_base(self, intent: IntentType, language: LanguageCode) -> bool:
+        """Whether a message is looked up in the knowledge base.
+        
+        The intent patterns are English, so non-English questions mostly come
+        back as UNKNOWN; those are tried against their language's index too.
+        """
+        return intent == IntentType.INFORMATION_REQUEST or (
+            intent == IntentType.UNKNOWN and language is not LanguageCode.ENGLISH
+        )
+    
+    async def lookup_response(self, intent: IntentType, user_input: str, context: ConversationContext,
+                              kb_results: Optional[List[KnowledgeMatch]] = None) -> Optional[str]:
+        """Answer from the knowledge base or the LLM response cache, if either has one"""
+        # For information requests, try knowledge base first
+        if self.searches_knowledge_base(intent, context.language):
+            if kb_results is None:
+                started = time.perf_counter()
+                kb_results = self.knowledge_base.search_knowledge(user_input, language=context.language)
+                metrics.observe("kb_search", time.perf_counter() - started)
+            if kb_results:
+                best_match = kb_results[0]
+                if best_match.score > 0.5 and best_match.answer:  # High similarity
+                    metrics.inc("ai_response_source_total", "kb")
+                    return best_match.answer
+        
+        if self.response_cache and self.uses_llm(intent):
+            started = time.perf_counter()
+            cached_response = await self.response_cache.get(user_input, intent, context.language)
+            metrics.observe("response_cache", time.perf_counter() - started)
+            if cached_response:
+                metrics.inc("ai_response_source_total", "response_cache")
+                return cached_response
+        
+        return None
+    
+    async def generate_response(self, intent: IntentType, user_input: str, context: ConversationContext,
+                                kb_results: Optional[List[KnowledgeMatch]] = None) -> str:
         """Generate appropriate response based on intent"""
+        answer = await self.lookup_response(intent, user_input, context, kb_results)
+        if answer is not None:
+            return answer
+        
+        # Use OpenAI for enhanced responses if available
+        if self.uses_llm(intent) and not self.sheds_llm():
+            started = time.perf_counter()
+            enhanced_response = await self.get_openai_response(user_input, context)
+            metrics.observe("llm", time.perf_counter() - started)
+            if enhanced_response:
+                if self.response_cache:
+                    await self.response_cache.put(user_input, intent, context.language, enhanced_response)
+                metrics.inc("ai_llm_requests_total", "answered")
+                metrics.inc("ai_response_source_total", "llm")
+                return enhanced_response
+            metrics.inc("ai_llm_requests_total", "failed")
         
+        return self.template_response(intent, context)
+    
+    def template_response(self, intent: IntentType, context: ConversationContext) -> str:
+        """Canned text for an intent in the user's language"""
         # Check if we have a template response
         template_key = intent.value
         if template_key in self.response_templates:
-            template = self.response_templates[template_key].get(
+            metrics.inc("ai_response_source_total", "template")
+            return self.response_templates[template_key].get(
                 context.language.value, 
                 self.response_templates[template_key]["en"]
             )
-            
-            # For information requests, try knowledge base first
-            if intent == IntentType.INFORMATION_REQUEST:
-                kb_results = self.knowledge_base.search_knowledge(user_input)
-                if kb_results:
-                    best_match = kb_results[0]
-                    if best_match[1] > 0.5:  # High similarity
-                        answer = self.knowledge_base.get_answer(best_match[0])
-                        if answer:
-                            return answer
-            
-            # Use OpenAI for enhanced responses if available
-            if self.openai_client and intent in [IntentType.INFORMATION_REQUEST, IntentType.UNKNOWN]:
-                enhanced_response = await self.get_openai_response(user_input, context)
-                if enhanced_response:
-                    return enhanced_response
-            
-            return template
         
         # Fallback response
+        metrics.inc("ai_response_source_total", "fallback")
         return self.response_templates[IntentType.UNKNOWN.value][context.language.value]
     
     async def get_openai_response(self, user_input: str, context: ConversationContext) -> Optional[str]:
         """Get enhanced response from OpenAI"""
         try:
-            # Prepare conversation history for context
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "You are a helpful assistant for VOO Ward services. Provide accurate, helpful information about bursaries, issue reporting, and community services. Keep responses concise and actionable."
-                }
-            ]
-            
-            # Add recent conversation history
-            for msg in context.conversation_history[-5:]:  # Last 5 messages
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Add current message
-            messages.append({
-                "role": "user",
-                "content": user_input
-            })
-            
-            response = await self.openai_client.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=200,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
+            return await self.llm_gateway.complete(self.build_llm_messages(user_input, context))
             
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return None
     
+    def build_llm_messages(self, user_input: str, context: ConversationContext) -> List[Dict[str, str]]:
+        """System prompt, recent history and the current message for a chat completion"""
+        # Prepare conversation history for context
+        messages = [
+            {
+                "role": "system", 
+                "content": "You are a helpful assistant for VOO Ward services. Provide accurate, helpful information about bursaries, issue reporting, and community services. Keep responses concise and actionable."
+            }
+        ]
+        
+        # Add recent conversation history
+        for msg in context.conversation_history[-HISTORY_WINDOW:]:  # Last 5 messages by default
+            messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+        
+        # Add current message
+        messages.append({
+            "role": "user",
+            "content": user_input
+        })
+        
+        return messages
+    
     def get_next_actions(self, intent: IntentType, entities: Dict[str, Any]) -> List[str]:
         """Determine next actions based on intent and entities"""
         actions = []
@@ -600,136 +1156,673 @@ class VOOWardAIAssistant:
     
     async def save_context(self, context: ConversationContext):
         """Save conversation context to Redis"""
-        if not self.redis_client:
+        await self.save_contexts([context])
+    
+    async def save_contexts(self, contexts: List[ConversationContext]):
+        """Cache conversation contexts in memory and write them back to Redis"""
+        if not contexts:
+            return
+        
+        if self.session_cache:
+            for context in contexts:
+                self.session_cache.put(context.user_id, context)
+        
+        if not self.session_store.available:
+            for context in contexts:
+                context.pending_history.clear()
+            return
+        
+        snapshots = [context.take_snapshot() for context in contexts]
+        if self.write_behind:
+            self.write_behind.enqueue(snapshots)
             return
         
         try:
-            key = f"ai_context:{context.user_id}"
-            context_data = asdict(context)
-            
-            # Convert datetime objects to strings
-            context_data['session_start'] = context.session_start.isoformat()
-            context_data['last_interaction'] = context.last_interaction.isoformat()
-            context_data['current_intent'] = context.current_intent.value if context.current_intent else None
-            context_data['language'] = context.language.value
-            
-            await self.redis_client.setex(
-                key, 
-                3600,  # 1 hour TTL
-                json.dumps(context_data, default=str)
-            )
-            
+            await self.session_store.save_sessions(snapshots, self.context_ttl, HISTORY_MAX)  # 1 hour TTL by default
         except Exception as e:
             logger.error(f"Error saving context: {e}")
     
     async def load_context(self, user_id: str) -> Optional[ConversationContext]:
-        """Load conversation context from Redis"""
-        if not self.redis_client:
-            return None
+        """Load conversation context from the session cache or Redis"""
+        return (await self.load_contexts([user_id]))[0]
+    
+    async def load_contexts(self, user_ids: List[str]) -> List[Optional[ConversationContext]]:
+        """Load several conversation contexts, fetching cache misses from Redis in one round trip"""
+        contexts: List[Optional[ConversationContext]] = [None] * len(user_ids)
+        missing = []
+        for i, user_id in enumerate(user_ids):
+            context = self.session_cache.get(user_id) if self.session_cache else None
+            if context is not None:
+                contexts[i] = context
+            else:
+                missing.append(i)
+        
+        if not missing or not self.session_store.available:
+            return contexts
         
         try:
-            key = f"ai_context:{user_id}"
-            context_data = await self.redis_client.get(key)
-            
-            if context_data:
-                data = json.loads(context_data)
-                
-                # Convert string timestamps back to datetime
-                data['session_start'] = datetime.fromisoformat(data['session_start'])
-                data['last_interaction'] = datetime.fromisoformat(data['last_interaction'])
-                data['current_intent'] = IntentType(data['current_intent']) if data['current_intent'] else None
-                data['language'] = LanguageCode(data['language'])
-                
-                return ConversationContext(**data)
-            
+            sessions = await self.session_store.load_sessions([user_ids[i] for i in missing], HISTORY_WINDOW)
         except Exception as e:
             logger.error(f"Error loading context: {e}")
+            return contexts
         
-        return None
+        for i, (raw_context, raw_history) in zip(missing, sessions):
+            if not raw_context:
+                continue
+            try:
+                contexts[i] = ConversationContext.from_json(raw_context, raw_history)
+            except Exception as e:
+                logger.error(f"Error loading context: {e}")
+                continue
+            if self.session_cache:
+                self.session_cache.put(contexts[i].user_id, contexts[i])
+        
+        return contexts
 
 # Flask API for integration
 app = Flask(__name__)
 CORS(app)
 
-# Initialize AI Assistant
-ai_assistant = VOOWardAIAssistant()
+# The assistant is created on first use, so offline CLI modes never start it
+_assistant: Optional[VOOWardAIAssistant] = None
+_assistant_lock = threading.Lock()
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+def get_assistant() -> VOOWardAIAssistant:
+    """The process-wide assistant, created on first use"""
+    global _assistant
+    if _assistant is None:
+        with _assistant_lock:
+            if _assistant is None:
+                _assistant = VOOWardAIAssistant()
+    return _assistant
+
+# Upper bound on messages accepted by /chat/batch
+MAX_BATCH_SIZE = int(os.getenv('AI_MAX_BATCH_SIZE', 100))
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Keep proxies from buffering server-sent events
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def check_admin_key(provided_key: str, remote_addr: Optional[str]) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Return an error payload unless the X-Admin-Key value is valid"""
+    admin_key = os.getenv('AI_ADMIN_KEY')
+    
+    if not admin_key:
+        return {"error": "Admin endpoints are disabled"}, 403
+    if not hmac.compare_digest(provided_key.encode(), admin_key.encode()):
+        logger.warning(f"Invalid admin key from {remote_addr}")
+        return {"error": "Invalid admin key"}, 401
+    return None
+
+def response_payload(response: AIResponse) -> Dict[str, Any]:
+    """Serialise an AIResponse for the chat endpoints"""
+    return {
+        "response": response.text,
+        "intent": response.intent.value,
+        "confidence": response.confidence,
+        "entities": response.entities,
+        "next_actions": response.next_actions,
+        "requires_human": response.requires_human,
+        "language": response.language.value
+    }
+
+# Route handlers shared by the Flask (WSGI) and ASGI apps; each returns (payload, status)
+
+def handle_health() -> Tuple[Dict[str, Any], int]:
+    """Health check with cache, queue and gateway counters"""
+    assistant = get_assistant()
+    return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
-    })
+        "version": "1.0.0",
+        "redis": assistant.session_store.available,
+        "session_cache": assistant.session_cache.stats() if assistant.session_cache else None,
+        "session_write_behind": assistant.write_behind.stats() if assistant.write_behind else None,
+        "response_cache": assistant.response_cache.stats() if assistant.response_cache else None,
+        "llm_gateway": assistant.llm_gateway.stats() if assistant.llm_gateway else None,
+        "rate_limiter": assistant.rate_limiter.stats() if assistant.rate_limiter else None,
+        "deduplicator": assistant.deduplicator.stats() if assistant.deduplicator else None,
+        "text_deduplicator": assistant.text_deduplicator.stats() if assistant.text_deduplicator else None,
+        "transcript_sink": assistant.transcript_sink.stats() if assistant.transcript_sink else None,
+        "load_shedder": assistant.load_shedder.stats()
+    }, 200
 
-@app.route('/chat', methods=['POST'])
-async def chat_endpoint():
-    """Main chat endpoint"""
+def rate_limited_payload(retry_after: float) -> Dict[str, Any]:
+    """429 body for a subscriber over the rate limit"""
+    return {
+        "error": "Too many requests",
+        "message": "You're sending messages too quickly. Please wait a moment and try again.",
+        "retry_after": round(retry_after, 1)
+    }
+
+def retry_after_headers(payload: Any) -> Dict[str, str]:
+    """Retry-After header for rate-limited responses"""
+    if isinstance(payload, dict) and 'retry_after' in payload:
+        return {"Retry-After": str(max(1, int(-(-payload['retry_after'] // 1))))}
+    return {}
+
+async def handle_chat(data: Any) -> Tuple[Dict[str, Any], int]:
+    """Process one chat message; a retry with the same ``sequence_id`` gets the original's result.
+    
+    Messages without a sequence id are only deduplicated on their text within
+    AI_DEDUP_TEXT_WINDOW seconds, since a subscriber may well send "1" or
+    "yes" twice in a row on purpose.
+    """
+    assistant = get_assistant()
     try:
-        data = request.get_json()
-        user_input = data.get('message', '').strip()
+        data = data if isinstance(data, dict) else {}
+        user_input = str(data.get('message') or '').strip()
         user_id = data.get('user_id')
         phone_number = data.get('phone_number')
-        language = data.get('language', 'en')
         
         if not user_input or not user_id:
-            return jsonify({
+            return {
                 "error": "Missing required fields: message, user_id"
-            }), 400
-        
-        # Load or create context
-        context = await ai_assistant.load_context(user_id)
-        if not context:
-            context = ConversationContext(
-                user_id=user_id,
-                phone_number=phone_number,
-                language=LanguageCode(language)
-            )
+            }, 400
+        try:
+            language = LanguageCode(data.get('language', 'en'))
+        except ValueError:
+            return {"error": f"Unsupported language: {data.get('language')}"}, 400
         
-        # Process message
-        response = await ai_assistant.process_message(user_input, context)
+        async def process() -> Tuple[Dict[str, Any], int, bool]:
+            retry_after = await assistant.admit(user_input, user_id, phone_number)
+            if retry_after:
+                return rate_limited_payload(retry_after), 429, False
+            
+            # Load or create context
+            context = await assistant.load_context(user_id)
+            if not context:
+                context = ConversationContext(
+                    user_id=user_id,
+                    phone_number=phone_number,
+                    language=language
+                )
+            
+            # Process message
+            response = await assistant.process_message(user_input, context)
+            
+            return response_payload(response), 200, not response.failed
         
-        return jsonify({
-            "response": response.text,
-            "intent": response.intent.value,
-            "confidence": response.confidence,
-            "entities": response.entities,
-            "next_actions": response.next_actions,
-            "requires_human": response.requires_human,
-            "language": response.language.value
-        })
+        deduplicator, key = assistant.dedup_key(user_id, user_input, data.get('sequence_id'))
+        if deduplicator:
+            return await deduplicator.run(key, process)
+        payload, status, _ = await process()
+        return payload, status
         
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}")
-        return jsonify({
+        return {
             "error": "Internal server error",
             "message": "I'm experiencing technical difficulties. Please try again."
-        }), 500
+        }, 500
 
-@app.route('/context/<user_id>', methods=['GET'])
-async def get_context(user_id: str):
+def sse_frame(event: str, data: Dict[str, Any]) -> str:
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def handle_chat_stream(data: Any) -> Tuple[Any, int]:
+    """Validate a streaming chat request; returns (SSE frame generator, 200) or an error payload.
+    
+    LLM-backed answers arrive as ``token`` frames followed by a ``done`` frame
+    carrying the usual response payload; other answers send only ``done``.
+    """
+    assistant = get_assistant()
+    data = data if isinstance(data, dict) else {}
+    user_input = str(data.get('message') or '').strip()
+    user_id = data.get('user_id')
+    
+    if not user_input or not user_id:
+        return {
+            "error": "Missing required fields: message, user_id"
+        }, 400
+    try:
+        language = LanguageCode(data.get('language', 'en'))
+    except ValueError:
+        return {"error": f"Unsupported language: {data.get('language')}"}, 400
+    
+    retry_after = await assistant.admit(user_input, user_id, data.get('phone_number'))
+    if retry_after:
+        return rate_limited_payload(retry_after), 429
+    
+    async def frames() -> AsyncIterator[str]:
+        try:
+            # Load or create context
+            context = await assistant.load_context(user_id)
+            if not context:
+                context = ConversationContext(
+                    user_id=user_id,
+                    phone_number=data.get('phone_number'),
+                    language=language
+                )
+            
+            async for kind, value in assistant.stream_message(user_input, context):
+                if kind == "token":
+                    yield sse_frame("token", {"text": value})
+                else:
+                    yield sse_frame("done", response_payload(value))
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield sse_frame("error", {
+                "error": "Internal server error",
+                "message": "I'm experiencing technical difficulties. Please try again."
+            })
+    
+    return frames(), 200
+
+async def handle_chat_batch(data: Any) -> Tuple[Dict[str, Any], int]:
+    """Process a batch of chat messages, returning per-message results in order.
+    
+    Retried messages get the original's result, matched like on /chat, and
+    copies within the batch share one turn.
+    """
+    assistant = get_assistant()
+    try:
+        messages = data.get('messages') if isinstance(data, dict) else None
+        
+        if not isinstance(messages, list) or not messages:
+            return {
+                "error": "Missing required field: messages"
+            }, 400
+        
+        if len(messages) > MAX_BATCH_SIZE:
+            return {
+                "error": f"Batch too large: at most {MAX_BATCH_SIZE} messages"
+            }, 400
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+        valid_items = []
+        keys: Dict[int, str] = {}
+        dedups: Dict[int, MessageDeduplicator] = {}
+        
+        for i, item in enumerate(messages):
+            if not isinstance(item, dict):
+                results[i] = {"error": "Message must be an object"}
+                continue
+            
+            user_input = str(item.get('message') or '').strip()
+            user_id = item.get('user_id')
+            if not user_input or not user_id:
+                results[i] = {"error": "Missing required fields: message, user_id"}
+                continue
+            
+            try:
+                language = LanguageCode(item.get('language', 'en'))
+            except ValueError:
+                results[i] = {"error": f"Unsupported language: {item.get('language')}"}
+                continue
+            
+            valid_items.append((i, user_input, user_id, item.get('phone_number'), language))
+            deduplicator, key = assistant.dedup_key(user_id, user_input, item.get('sequence_id'))
+            if deduplicator:
+                dedups[i], keys[i] = deduplicator, key
+        
+        # Claim each distinct message; duplicates of earlier or in-flight turns get their result
+        copies: Dict[int, int] = {}
+        owned: List[int] = []
+        if keys:
+            first_copies: Dict[str, int] = {}
+            distinct = []
+            for i, *_ in valid_items:
+                if i not in keys:
+                    continue
+                if keys[i] in first_copies:
+                    copies[i] = first_copies[keys[i]]
+                else:
+                    first_copies[keys[i]] = i
+                    distinct.append(i)
+            
+            claims = await asyncio.gather(*(dedups[i].claim(keys[i]) for i in distinct), return_exceptions=True)
+            for i, claimed in zip(distinct, claims):
+                if claimed is None:
+                    owned.append(i)
+                elif isinstance(claimed, BaseException):
+                    results[i] = {"error": "Internal server error"}
+                else:
+                    results[i] = claimed
+            valid_items = [item for item in valid_items if item[0] not in keys or item[0] in owned]
+        answered = set()
+        
+        try:
+            # Rate-limit each message; refused ones get a per-message error
+            waits = await asyncio.gather(*(
+                assistant.admit(user_input, user_id, phone_number)
+                for _, user_input, user_id, phone_number, _ in valid_items
+            ))
+            for (i, *_), retry_after in zip(valid_items, waits):
+                if retry_after:
+                    results[i] = rate_limited_payload(retry_after)
+            valid_items = [item for item, retry_after in zip(valid_items, waits) if not retry_after]
+            
+            # Load every user's context in one round trip; repeated users share one
+            user_ids = list(dict.fromkeys(user_id for _, _, user_id, _, _ in valid_items))
+            contexts = dict(zip(user_ids, await assistant.load_contexts(user_ids)))
+            
+            turns = []
+            turn_indices = []
+            for i, user_input, user_id, phone_number, language in valid_items:
+                if contexts[user_id] is None:
+                    contexts[user_id] = ConversationContext(
+                        user_id=user_id,
+                        phone_number=phone_number,
+                        language=language
+                    )
+                turns.append((user_input, contexts[user_id]))
+                turn_indices.append(i)
+            
+            # Process message batch
+            responses = await assistant.process_batch(turns) if turns else []
+            for i, response in zip(turn_indices, responses):
+                results[i] = response_payload(response)
+                if not response.failed:
+                    answered.add(i)
+        except BaseException:
+            await asyncio.gather(*(dedups[i].abandon(keys[i]) for i in owned))
+            raise
+        
+        # Keep answered turns for retries; release refused and failed ones
+        await asyncio.gather(*(
+            dedups[i].finish(keys[i], results[i]) if i in answered else dedups[i].abandon(keys[i]) for i in owned
+        ))
+        for i, first in copies.items():
+            results[i] = results[first]
+        
+        return {"results": results}, 200
+        
+    except Exception as e:
+        logger.error(f"Chat batch endpoint error: {e}")
+        return {
+            "error": "Internal server error",
+            "message": "I'm experiencing technical difficulties. Please try again."
+        }, 500
+
+def handle_kb_reload(full: bool) -> Tuple[Dict[str, Any], int]:
+    """Reload the knowledge base file"""
+    assistant = get_assistant()
+    try:
+        index = assistant.knowledge_base.reload(incremental=not full)
+        return {
+            "status": "reloaded",
+            "entries": len(index.questions),
+            "patched_rows": index.patched_rows
+        }, 200
+    except Exception as e:
+        logger.error(f"Knowledge base reload error: {e}")
+        return {"error": str(e)}, 500
+
+def handle_profile(seconds: str, interval_ms: Optional[str], include_idle: bool) -> Tuple[Any, int]:
+    """Sample live threads and return collapsed stacks, or an error payload"""
+    try:
+        duration = float(seconds)
+        interval = float(interval_ms) / 1000 if interval_ms else None
+    except ValueError:
+        return {"error": "seconds and interval_ms must be numbers"}, 400
+    if not 0 < duration or (interval is not None and not 0.001 <= interval <= 1):
+        return {"error": "seconds must be positive and interval_ms between 1 and 1000"}, 400
+    
+    try:
+        collapsed, samples = sampling_profiler.profile(duration, interval, include_idle)
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+    logger.info(f"Served a {samples}-sample profile")
+    return collapsed, 200
+
+async def handle_context(user_id: str) -> Tuple[Dict[str, Any], int]:
     """Get conversation context for a user"""
+    assistant = get_assistant()
     try:
-        context = await ai_assistant.load_context(user_id)
+        context = await assistant.load_context(user_id)
         if context:
-            return jsonify({
+            return {
                 "user_id": context.user_id,
                 "current_intent": context.current_intent.value if context.current_intent else None,
                 "language": context.language.value,
                 "session_duration": str(datetime.now() - context.session_start),
-                "interaction_count": len(context.conversation_history),
+                "interaction_count": context.interaction_count,
                 "entities": context.entities
-            })
+            }, 200
         else:
-            return jsonify({"error": "Context not found"}), 404
+            return {"error": "Context not found"}, 404
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+def handle_metrics() -> str:
+    """Prometheus text exposition of the process's metrics"""
+    return metrics.render()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(handle_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    payload, status = handle_health()
+    return jsonify(payload), status
+
+@app.route('/chat', methods=['POST'])
+async def chat_endpoint():
+    """Main chat endpoint"""
+    payload, status = await handle_chat(request.get_json(silent=True))
+    return jsonify(payload), status, retry_after_headers(payload)
+
+def iterate_async(agen) -> Iterator[Any]:
+    """Drive an async generator from a WSGI response iterator on a private event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream_endpoint():
+    """Streaming chat endpoint (server-sent events)"""
+    payload, status = await handle_chat_stream(request.get_json(silent=True))
+    if status != 200:
+        return jsonify(payload), status, retry_after_headers(payload)
+    return Response(iterate_async(payload), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/chat/batch', methods=['POST'])
+async def chat_batch_endpoint():
+    """Batch chat endpoint for gateway bulk delivery"""
+    payload, status = await handle_chat_batch(request.get_json(silent=True))
+    return jsonify(payload), status
+
+@app.route('/admin/kb/reload', methods=['POST'])
+def reload_knowledge_base():
+    """Reload the knowledge base file (admin only)"""
+    denied = check_admin_key(request.headers.get('X-Admin-Key', ''), request.remote_addr)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    
+    payload, status = handle_kb_reload(request.args.get('full', 'false').lower() == 'true')
+    return jsonify(payload), status
+
+@app.route('/admin/profile', methods=['POST'])
+def profile_endpoint():
+    """Time-boxed sampling profile of this worker as collapsed stacks (admin only)"""
+    denied = check_admin_key(request.headers.get('X-Admin-Key', ''), request.remote_addr)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    
+    payload, status = handle_profile(
+        request.args.get('seconds', '10'),
+        request.args.get('interval_ms'),
+        request.args.get('idle', 'false').lower() == 'true'
+    )
+    if status != 200:
+        return jsonify(payload), status
+    return Response(payload, content_type='text/plain; charset=utf-8')
+
+@app.route('/context/<user_id>', methods=['GET'])
+async def get_context(user_id: str):
+    """Get conversation context for a user"""
+    payload, status = await handle_context(user_id)
+    return jsonify(payload), status
+
+def create_asgi_app():
+    """Build the native ASGI app (Starlette) serving the same routes as the Flask app.
+    
+    Redis and OpenAI clients are bound to the server's event loop at startup
+    and shared by every request. Run with
+    ``uvicorn --factory ai_assistant:create_asgi_app`` or ``--asgi``.
+    """
+    if optional_import('starlette.applications') is None:
+        raise RuntimeError("starlette is required for ASGI mode (pip install starlette uvicorn)")
+    assistant = get_assistant()
+    install_profile_signal()
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import JSONResponse, Response as StarletteResponse, StreamingResponse
+    from starlette.routing import Route
+    
+    async def json_body(request):
+        try:
+            return await request.json()
+        except Exception:
+            return None
+    
+    async def metrics_route(request):
+        return StarletteResponse(handle_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+    
+    async def health(request):
+        payload, status = handle_health()
+        return JSONResponse(payload, status)
+    
+    async def chat(request):
+        payload, status = await handle_chat(await json_body(request))
+        return JSONResponse(payload, status, headers=retry_after_headers(payload))
+    
+    async def chat_stream(request):
+        payload, status = await handle_chat_stream(await json_body(request))
+        if status != 200:
+            return JSONResponse(payload, status, headers=retry_after_headers(payload))
+        return StreamingResponse(payload, media_type='text/event-stream', headers=SSE_HEADERS)
+    
+    async def chat_batch(request):
+        payload, status = await handle_chat_batch(await json_body(request))
+        return JSONResponse(payload, status)
+    
+    async def kb_reload(request):
+        denied = check_admin_key(request.headers.get('X-Admin-Key', ''), request.client.host if request.client else None)
+        if denied:
+            return JSONResponse(*denied)
+        # Refitting is CPU-bound; keep it off the event loop
+        payload, status = await asyncio.to_thread(handle_kb_reload, request.query_params.get('full', 'false').lower() == 'true')
+        return JSONResponse(payload, status)
+    
+    async def profile(request):
+        denied = check_admin_key(request.headers.get('X-Admin-Key', ''), request.client.host if request.client else None)
+        if denied:
+            return JSONResponse(*denied)
+        # Sampling sleeps between snapshots; run it beside the event loop so traffic keeps flowing
+        payload, status = await asyncio.to_thread(
+            handle_profile,
+            request.query_params.get('seconds', '10'),
+            request.query_params.get('interval_ms'),
+            request.query_params.get('idle', 'false').lower() == 'true'
+        )
+        if status != 200:
+            return JSONResponse(payload, status)
+        return StarletteResponse(payload, media_type='text/plain; charset=utf-8')
+    
+    async def context(request):
+        payload, status = await handle_context(request.path_params['user_id'])
+        return JSONResponse(payload, status)
+    
+    @asynccontextmanager
+    async def lifespan(_app):
+        await assistant.startup()
+        try:
+            yield
+        finally:
+            await assistant.shutdown()
+    
+    return Starlette(
+        routes=[
+            Route('/health', health, methods=['GET']),
+            Route('/metrics', metrics_route, methods=['GET']),
+            Route('/chat', chat, methods=['POST']),
+            Route('/chat/stream', chat_stream, methods=['POST']),
+            Route('/chat/batch', chat_batch, methods=['POST']),
+            Route('/admin/kb/reload', kb_reload, methods=['POST']),
+            Route('/admin/profile', profile, methods=['POST']),
+            Route('/context/{user_id}', context, methods=['GET']),
+        ],
+        middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+        lifespan=lifespan
+    )
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VOO Ward AI Assistant")
+    parser.add_argument('--build-kb-index', action='store_true',
+                        help="fit the knowledge base and write the memory-mappable index artifact, then exit")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print per-import and per-stage startup time and memory, then exit")
+    parser.add_argument('--train-intent-model', metavar='LOGS_JSONL',
+                        help="train the intent model from labelled JSON lines and write AI_INTENT_MODEL_PATH, then exit")
+    parser.add_argument('--model-version', help="version tag stored in the trained intent model (default: timestamp)")
+    parser.add_argument('--asgi', action='store_true',
+                        help="serve with uvicorn on a native event loop instead of the Flask dev server")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('AI_WORKERS', 1)),
+                        help="uvicorn worker processes for --asgi; they share one memory-mapped KB index")
+    args = parser.parse_args()
+    if args.workers > 1 and not args.asgi:
+        parser.error("--workers requires --asgi")
+    
+    if args.profile_startup:
+        get_assistant()
+        print(startup_profiler.report())
+        total_ms = (time.perf_counter() - _core_import_started) * 1000
+        budget_ms = float(os.getenv('AI_STARTUP_BUDGET_MS', 0))
+        print(f"\nTotal startup: {total_ms:.1f}ms" + (f" (budget {budget_ms:.0f}ms)" if budget_ms else ""))
+        loaded = loaded_optional_modules()
+        print(f"Optional modules loaded: {', '.join(loaded) or 'none'}")
+        raise SystemExit(1 if budget_ms and total_ms > budget_ms else 0)
+    
+    if args.build_kb_index:
+        KnowledgeBase().build_index_artifact()
+        raise SystemExit(0)
+    
+    if args.train_intent_model:
+        train_intent_model(args.train_intent_model, os.getenv('AI_INTENT_MODEL_PATH', 'intent_model.npz'), args.model_version)
+        raise SystemExit(0)
+    
+    if args.asgi:
+        uvicorn = optional_import('uvicorn')
+        if uvicorn is None:
+            raise SystemExit("uvicorn is required for --asgi (pip install starlette uvicorn)")
+        if args.workers > 1:
+            # Hand over to the uvicorn CLI so spawned workers import only the
+            # app module; the first to find the artifacts stale builds them
+            # under a lock and the rest map the same files
+            os.environ.setdefault('AI_KB_SHARED_INDEX', 'true')
+            os.execv(sys.executable, [
+                sys.executable, '-m', 'uvicorn', 'ai_assistant:create_asgi_app', '--factory',
+                '--app-dir', os.path.dirname(os.path.abspath(__file__)),
+                '--workers', str(args.workers),
+                '--host', os.getenv('AI_HOST', '0.0.0.0'),
+                '--port', os.getenv('AI_PORT', '5000')
+            ])
+        uvicorn.run(
+            create_asgi_app(),
+            host=os.getenv('AI_HOST', '0.0.0.0'),
+            port=int(os.getenv('AI_PORT', 5000))
+        )
+        raise SystemExit(0)
+    
     # Run the Flask app
+    get_assistant()
+    install_profile_signal()
     app.run(
         host=os.getenv('AI_HOST', '0.0.0.0'),
         port=int(os.getenv('AI_PORT', 5000)),
         debug=os.getenv('DEBUG', 'False').lower() == 'true'
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,369 @@
+"""Response caching and duplicate message suppression"""
+
+import time
+import json
+import hashlib
+import asyncio
+import concurrent.futures
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import re
+import threading
+
+import numpy as np
+
+from conversation import IntentType, LanguageCode
+from kb_index import KnowledgeBase
+from profiling import optional_import
+from sessions import LRUCache, RedisSessionStore
+
+logger = logging.getLogger(__name__)
+
+class NearDuplicateIndex:
+    """Cached query vectors of one (intent, language) bucket, stacked for scoring.
+    
+    New vectors are scored from a small pending list and stacked into the
+    matrix in batches. Replaced or evicted rows are masked out until the next
+    rebuild, so a put never restacks the whole bucket.
+    """
+    REBUILD_PENDING = 64
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.vectors: 'OrderedDict[str, Any]' = OrderedDict()  # key -> query vector, oldest first
+        self.pending: Dict[str, None] = {}                      # keys not stacked yet, in insertion order
+        self.keys: List[str] = []                               # stacked row -> key
+        self.rows: Dict[str, int] = {}                          # live stacked key -> row
+        self.alive = np.zeros(0, dtype=bool)
+        self.matrix = None
+        self.rebuilds = 0
+    
+    def __len__(self) -> int:
+        return len(self.vectors)
+    
+    def add(self, key: str, vector: Any):
+        """Insert or replace a key's vector, evicting the oldest past ``max_entries``"""
+        self.discard(key)
+        self.vectors[key] = vector
+        self.pending[key] = None
+        while len(self.vectors) > self.max_entries:
+            self.discard(next(iter(self.vectors)))
+    
+    def discard(self, key: str):
+        """Forget a key; a stacked row is masked until the next rebuild"""
+        if self.vectors.pop(key, None) is None:
+            return
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.alive[row] = False
+        else:
+            self.pending.pop(key, None)
+    
+    def candidates(self, sparse) -> Tuple[List[str], Any, np.ndarray, List[str], List[Any]]:
+        """Stacked keys, matrix and live-row mask, plus pending keys and vectors.
+        
+        The returned pieces are not changed by later puts, so callers can
+        score them after releasing their lock.
+        """
+        dead = len(self.keys) - len(self.rows)
+        if len(self.pending) > self.REBUILD_PENDING or dead > len(self.rows):
+            self.rebuild(sparse)
+        pending = list(self.pending)
+        return self.keys, self.matrix, self.alive.copy(), pending, [self.vectors[key] for key in pending]
+    
+    def rebuild(self, sparse):
+        """Stack every live vector into a fresh matrix"""
+        self.keys = list(self.vectors)
+        self.matrix = sparse.vstack(list(self.vectors.values())).tocsr() if self.keys else None
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.alive = np.ones(len(self.keys), dtype=bool)
+        self.pending.clear()
+        self.rebuilds += 1
+
+class ResponseCache:
+    """Cache of LLM fallback answers keyed by normalised text, intent and language.
+    
+    A local LRU answers repeats without a network hop and Redis shares answers
+    across workers. With a similarity threshold set, a miss can also be served
+    by a cached query whose TF-IDF vector under the knowledge base vectorizer
+    is close enough.
+    """
+    
+    def __init__(self, store: RedisSessionStore, knowledge_base: KnowledgeBase,
+                 max_entries: int, ttl: int, similarity: float = 0.0):
+        self.store = store
+        self.knowledge_base = knowledge_base
+        self.local = LRUCache(max_entries, ttl)
+        self.ttl = ttl
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.shared_hits = 0
+        self.near_duplicate_hits = 0
+        
+        # (intent, language) -> cached query vectors, for near-duplicate lookup
+        self._buckets: Dict[Tuple[str, str], NearDuplicateIndex] = {}
+        self._vectorizer = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace"""
+        return " ".join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+    
+    def cache_key(self, text: str, intent: IntentType, language: LanguageCode) -> str:
+        """Redis-safe key for a normalised query"""
+        digest = hashlib.sha1(f"{intent.value}|{language.value}|{self.normalize(text)}".encode('utf-8')).hexdigest()
+        return f"ai_llm_cache:{digest}"
+    
+    async def get(self, text: str, intent: IntentType, language: LanguageCode) -> Optional[str]:
+        """Look up an answer locally, then by near-duplicate, then in Redis"""
+        key = self.cache_key(text, intent, language)
+        answer = self.local.get(key)
+        if answer is not None:
+            return answer
+        
+        if self.similarity > 0:
+            answer = self._near_duplicate(text, intent, language)
+            if answer is not None:
+                self.near_duplicate_hits += 1
+                return answer
+        
+        if self.store.available:
+            try:
+                answer = (await self.store.get_values([key]))[0]
+            except Exception as e:
+                logger.warning(f"Response cache lookup failed: {e}")
+                answer = None
+            if answer is not None:
+                self.shared_hits += 1
+                self.local.put(key, answer)
+                self._index(key, text, intent, language)
+                return answer
+        
+        return None
+    
+    async def put(self, text: str, intent: IntentType, language: LanguageCode, answer: str):
+        """Store an answer locally and in Redis"""
+        key = self.cache_key(text, intent, language)
+        self.local.put(key, answer)
+        self._index(key, text, intent, language)
+        
+        if self.store.available:
+            try:
+                await self.store.set_values({key: answer}, self.ttl)
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e}")
+    
+    def _query_vector(self, text: str):
+        """Vectorise with the current KB vectorizer, resetting the index when it changes"""
+        vectorizer = self.knowledge_base.vectorizer
+        if vectorizer is None:
+            return None
+        if vectorizer is not self._vectorizer:
+            self._buckets.clear()
+            self._vectorizer = vectorizer
+        vector = vectorizer.transform([text])
+        return vector if vector.nnz else None
+    
+    def _index(self, key: str, text: str, intent: IntentType, language: LanguageCode):
+        if self.similarity <= 0:
+            return
+        with self._lock:
+            vector = self._query_vector(text)
+            if vector is None:
+                return
+            bucket_key = (intent.value, language.value)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = NearDuplicateIndex(self.max_entries)
+            bucket.add(key, vector)
+    
+    def _near_duplicate(self, text: str, intent: IntentType, language: LanguageCode) -> Optional[str]:
+        sparse = optional_import('scipy.sparse')
+        if sparse is None:
+            return None
+        
+        with self._lock:
+            vector = self._query_vector(text)
+            bucket = self._buckets.get((intent.value, language.value))
+            if vector is None or not bucket:
+                return None
+            keys, matrix, alive, pending_keys, pending_vectors = bucket.candidates(sparse)
+        
+        best_key, best_score = None, -np.inf
+        if matrix is not None and alive.any():
+            scores = (matrix @ vector.T).toarray().ravel()
+            scores[~alive] = -np.inf
+            row = int(np.argmax(scores))
+            best_key, best_score = keys[row], scores[row]
+        if pending_keys:
+            scores = (sparse.vstack(pending_vectors) @ vector.T).toarray().ravel()
+            row = int(np.argmax(scores))
+            if scores[row] > best_score:
+                best_key, best_score = pending_keys[row], scores[row]
+        if best_score < self.similarity:
+            return None
+        
+        answer = self.local.get(best_key)
+        if answer is None:
+            with self._lock:
+                if bucket is self._buckets.get((intent.value, language.value)):
+                    bucket.discard(best_key)
+        return answer
+    
+    def stats(self) -> Dict[str, int]:
+        """Local, shared and near-duplicate hit counters"""
+        stats = self.local.stats()
+        stats["shared_hits"] = self.shared_hits
+        stats["near_duplicate_hits"] = self.near_duplicate_hits
+        return stats
+
+class MessageDeduplicator:
+    """Idempotency for gateway retries, keyed on user, gateway sequence id and message text.
+    
+    Messages without a sequence id use ``text_key`` instead, in a deduplicator
+    with a TTL of a few seconds.
+    
+    The first copy of a message claims its key and is processed. A copy that
+    arrives while it is in flight waits for its payload: through a shared
+    future in this process, or by polling Redis when another worker holds the
+    claim. Later copies get the payload back until the TTL expires. A turn
+    that fails or is refused releases its key, and the next copy is processed.
+    """
+    
+    def __init__(self, store: RedisSessionStore, ttl: int, max_entries: int, wait: float,
+                 poll_interval: float = 0.05):
+        self.store = store
+        self.ttl = ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.local = LRUCache(max_entries, ttl)
+        self._in_flight: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.replayed = 0
+        self.joined = 0
+        self.shared = 0
+    
+    @staticmethod
+    def key(user_id: Any, user_input: str, sequence_id: Any) -> str:
+        """Redis-safe idempotency key"""
+        digest = hashlib.sha1(f"{user_id}|{sequence_id}|{user_input}".encode('utf-8')).hexdigest()
+        return f"ai_dedup:{digest}"
+    
+    @staticmethod
+    def text_key(user_id: Any, user_input: str) -> str:
+        """Redis-safe key for a message without a sequence id"""
+        digest = hashlib.sha1(f"{user_id}|{user_input}".encode('utf-8')).hexdigest()
+        return f"ai_dedup_text:{digest}"
+    
+    async def run(self, key: str,
+                  process: Callable[[], Awaitable[Tuple[Dict[str, Any], int, bool]]]) -> Tuple[Dict[str, Any], int]:
+        """Run ``process`` for the first copy of ``key`` and return its result to every copy.
+        
+        ``process`` returns (payload, status, answered); only answered 200s are kept.
+        """
+        payload = await self.claim(key)
+        if payload is not None:
+            return payload, 200
+        try:
+            payload, status, answered = await process()
+        except BaseException:
+            await self.abandon(key)
+            raise
+        if answered and status == 200:
+            await self.finish(key, payload)
+        else:
+            await self.abandon(key)
+        return payload, status
+    
+    async def claim(self, key: str) -> Optional[Dict[str, Any]]:
+        """The original's payload for a duplicate, or None once the caller owns ``key``.
+        
+        An owner must call ``finish`` or ``abandon``, or duplicates wait forever.
+        """
+        while True:
+            with self._lock:
+                payload = self.local.get(key)
+                future = self._in_flight.get(key) if payload is None else None
+                if payload is None and future is None:
+                    self._in_flight[key] = concurrent.futures.Future()
+            
+            if payload is not None:
+                self.replayed += 1
+                return payload
+            if future is None:
+                break
+            # A concurrent future, since Flask runs each request on its own event loop;
+            # None means the original was released and this copy may take over
+            payload = await asyncio.wrap_future(future)
+            if payload is not None:
+                self.joined += 1
+                return payload
+        
+        if self.store.available:
+            try:
+                payload = await self._claim_shared(key)
+            except Exception as e:
+                logger.warning(f"Idempotency claim failed: {e}")
+                payload = None
+            if payload is not None:
+                self.shared += 1
+                with self._lock:
+                    self.local.put(key, payload)
+                    future = self._in_flight.pop(key, None)
+                if future is not None:
+                    future.set_result(payload)
+                return payload
+        return None
+    
+    async def _claim_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        """Claim ``key`` in Redis, or wait for the worker holding it; None means process here"""
+        deadline = time.monotonic() + self.wait
+        while True:
+            claimed, value = await self.store.claim_value(key, self.ttl)
+            if claimed:
+                return None
+            if value:
+                return json.loads(value)
+            if time.monotonic() >= deadline:
+                # The holder is too slow; answering twice beats failing the retry
+                return None
+            await asyncio.sleep(self.poll_interval)
+    
+    async def finish(self, key: str, payload: Dict[str, Any]):
+        """Hand an answered turn's payload to waiting duplicates and keep it for later ones"""
+        with self._lock:
+            self.local.put(key, payload)
+            future = self._in_flight.pop(key, None)
+        if future is not None:
+            future.set_result(payload)
+        
+        if self.store.available:
+            try:
+                await self.store.set_values({key: json.dumps(payload, ensure_ascii=False)}, self.ttl)
+            except Exception as e:
+                logger.warning(f"Idempotency store failed: {e}")
+    
+    async def abandon(self, key: str):
+        """Release a claim without keeping anything; a waiting duplicate takes it over"""
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is not None:
+            future.set_result(None)
+        
+        if self.store.available:
+            try:
+                await self.store.delete_values([key])
+            except Exception as e:
+                logger.warning(f"Idempotency release failed: {e}")
+    
+    def stats(self) -> Dict[str, int]:
+        """Stored results and duplicates answered by how they were found"""
+        stats = self.local.stats()
+        with self._lock:
+            stats["in_flight"] = len(self._in_flight)
+        stats["replayed"] = self.replayed
+        stats["joined"] = self.joined
+        stats["shared"] = self.shared
+        return stats
@@ -0,0 +1,122 @@
+"""Conversation state and response types shared by the assistant components"""
+
+import os
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from enum import Enum
+
+class IntentType(Enum):
+    """Intent classification for user queries"""
+    BURSARY_APPLICATION = "bursary_application"
+    ISSUE_REPORTING = "issue_reporting"
+    INFORMATION_REQUEST = "information_request"
+    STATUS_CHECK = "status_check"
+    COMPLAINT = "complaint"
+    GREETING = "greeting"
+    GOODBYE = "goodbye"
+    UNKNOWN = "unknown"
+    AREA_INQUIRY = "area_inquiry"
+    CONTACT_INFO = "contact_info"
+    EMERGENCY = "emergency"
+
+class LanguageCode(Enum):
+    """Supported languages"""
+    ENGLISH = "en"
+    AFRIKAANS = "af"
+    ZULU = "zu"
+    XHOSA = "xh"
+
+# Messages kept in memory and loaded per turn; Redis keeps up to HISTORY_MAX
+HISTORY_WINDOW = max(1, int(os.getenv('AI_HISTORY_WINDOW', 5)))
+
+HISTORY_MAX = max(HISTORY_WINDOW, int(os.getenv('AI_HISTORY_MAX', 50)))
+
+@dataclass
+class ConversationContext:
+    """Context for ongoing conversation"""
+    user_id: str
+    phone_number: str
+    current_intent: Optional[IntentType] = None
+    entities: Dict[str, Any] = None
+    conversation_history: List[Dict] = None
+    language: LanguageCode = LanguageCode.ENGLISH
+    session_start: datetime = None
+    last_interaction: datetime = None
+    interaction_count: int = 0
+    pending_history: List[Dict] = field(default_factory=list, repr=False)
+    
+    def __post_init__(self):
+        if self.entities is None:
+            self.entities = {}
+        if self.conversation_history is None:
+            self.conversation_history = []
+        if self.session_start is None:
+            self.session_start = datetime.now()
+        if self.last_interaction is None:
+            self.last_interaction = datetime.now()
+    
+    def append_history(self, message: Dict[str, Any]):
+        """Record a message in the recent window and queue it for the Redis list"""
+        self.conversation_history.append(message)
+        del self.conversation_history[:-HISTORY_WINDOW]
+        self.pending_history.append(message)
+        del self.pending_history[:-HISTORY_MAX]
+        self.interaction_count += 1
+    
+    def take_snapshot(self) -> Tuple[str, str, List[str]]:
+        """Serialise for Redis and hand over the queued history messages"""
+        pending, self.pending_history = self.pending_history, []
+        return (
+            self.user_id,
+            self.to_json(),
+            [json.dumps(message, default=str, separators=(',', ':')) for message in pending]
+        )
+    
+    def to_json(self) -> str:
+        """Serialise the scalar context fields for Redis; history is stored separately"""
+        return json.dumps({
+            'user_id': self.user_id,
+            'phone_number': self.phone_number,
+            'current_intent': self.current_intent.value if self.current_intent else None,
+            'entities': self.entities,
+            'language': self.language.value,
+            'session_start': self.session_start.isoformat(),
+            'last_interaction': self.last_interaction.isoformat(),
+            'interaction_count': self.interaction_count
+        }, default=str)
+    
+    @classmethod
+    def from_json(cls, raw: str, history: Optional[List[str]] = None) -> 'ConversationContext':
+        """Rebuild a context from to_json output and the tail of its history list"""
+        data = json.loads(raw)
+        
+        # Convert string timestamps back to datetime
+        data['session_start'] = datetime.fromisoformat(data['session_start'])
+        data['last_interaction'] = datetime.fromisoformat(data['last_interaction'])
+        data['current_intent'] = IntentType(data['current_intent']) if data['current_intent'] else None
+        data['language'] = LanguageCode(data['language'])
+        
+        # Contexts saved before history moved to its own list embed it inline
+        legacy_history = data.pop('conversation_history', None)
+        if legacy_history is not None:
+            data.setdefault('interaction_count', len(legacy_history))
+            data['pending_history'] = legacy_history[-HISTORY_MAX:]
+            history_window = legacy_history[-HISTORY_WINDOW:]
+        else:
+            history_window = [json.loads(item) for item in history or []]
+        
+        return cls(conversation_history=history_window, **data)
+
+@dataclass
+class AIResponse:
+    """AI Assistant response structure"""
+    text: str
+    intent: IntentType
+    confidence: float
+    entities: Dict[str, Any]
+    next_actions: List[str]
+    requires_human: bool = False
+    language: LanguageCode = LanguageCode.ENGLISH
+    failed: bool = False
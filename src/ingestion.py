@@ -0,0 +1,207 @@
+"""Batched transcript ingestion into MongoDB with an on-disk spill"""
+
+import os
+import time
+import json
+import atexit
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import threading
+
+from profiling import optional_import
+
+logger = logging.getLogger(__name__)
+
+class TranscriptSink:
+    """Batched write-behind of finished turns to MongoDB for analytics and training.
+    
+    ``record`` only appends to a bounded in-memory queue, so it never adds
+    latency to a request; a full queue drops the new record. A background
+    thread writes the queue with ``insert_many`` once ``batch_size`` records
+    are waiting or every ``flush_interval``. While MongoDB is unreachable,
+    batches are appended to a JSON-lines spill file (up to ``spill_max_bytes``)
+    and replayed, oldest first, once a write succeeds. Records carry their own
+    ``_id``, so a replay that is cut short and repeated inserts nothing twice.
+    """
+    
+    def __init__(self, uri: str, database: Optional[str], collection: str, batch_size: int,
+                 flush_interval: float, max_pending: int, spill_path: str, spill_max_bytes: int):
+        self.uri = uri
+        self.database = database
+        self.collection_name = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.spill_max_bytes = spill_max_bytes
+        self._pending: deque = deque()
+        self._wakeup = threading.Condition(threading.Lock())
+        self._stopping = False
+        self._collection = None
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        
+        self._flusher = threading.Thread(target=self._run, name="transcript-sink", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+    
+    def record(self, transcript: Dict[str, Any]):
+        """Queue one turn; drops it rather than block when the queue is full"""
+        with self._wakeup:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(transcript)
+            if len(self._pending) == self.batch_size:
+                self._wakeup.notify()
+    
+    def close(self, timeout: float = 10.0):
+        """Write or spill everything queued and stop the flusher"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        self._flusher.join(timeout)
+    
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                stopping = self._stopping
+            
+            while True:
+                with self._wakeup:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    break
+                self._write(batch)
+            
+            # Spilled records also drain while no new turns arrive
+            if not stopping and time.monotonic() >= self._retry_at and self._has_spill():
+                self._write([])
+            if stopping:
+                return
+    
+    def _write(self, batch: List[Dict[str, Any]]):
+        """Insert a batch after any spilled records, spilling it while MongoDB is down"""
+        if time.monotonic() < self._retry_at:
+            self._spill(batch)
+            return
+        try:
+            self._replay()
+            if batch:
+                self._insert(batch)
+                self.written += len(batch)
+            self._retry_delay = 0.0
+        except Exception as e:
+            self.failed_flushes += 1
+            self._retry_delay = min(max(self._retry_delay * 2, 1.0), 60.0)
+            self._retry_at = time.monotonic() + self._retry_delay
+            logger.warning(f"Transcript write failed, spilling to {self.spill_path} for {self._retry_delay}s: {e}")
+            self._spill(batch)
+    
+    def _insert(self, records: List[Dict[str, Any]]):
+        pymongo = optional_import('pymongo')
+        if self._collection is None:
+            client = pymongo.MongoClient(self.uri, serverSelectionTimeoutMS=2000, connect=False)
+            database = client[self.database] if self.database else client.get_default_database('voo_ward')
+            collection = database[self.collection_name]
+            collection.create_index([("user_id", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)])
+            self._collection = collection
+        
+        documents = [
+            dict(record, timestamp=datetime.fromtimestamp(record["timestamp"], timezone.utc))
+            for record in records
+        ]
+        try:
+            self._collection.insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Duplicate keys are records a cut-short replay already inserted
+            details = e.details or {}
+            if details.get('writeConcernErrors') or any(
+                error.get('code') != 11000 for error in details.get('writeErrors', [])
+            ):
+                raise
+    
+    @contextmanager
+    def spill_lock(self):
+        """Exclusive lock across workers sharing the spill file"""
+        fcntl = optional_import('fcntl')
+        with open(f"{self.spill_path}.lock", 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _spill(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        try:
+            with self.spill_lock():
+                size = os.path.getsize(self.spill_path) if os.path.exists(self.spill_path) else 0
+                if size >= self.spill_max_bytes:
+                    self.dropped += len(records)
+                    return
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+            self.spilled += len(records)
+        except OSError as e:
+            self.dropped += len(records)
+            logger.error(f"Could not spill {len(records)} transcripts to {self.spill_path}: {e}")
+    
+    def _has_spill(self) -> bool:
+        """Whether spilled records, or a replay cut short, are waiting"""
+        return os.path.exists(self.spill_path) or os.path.exists(f"{self.spill_path}.replay")
+    
+    def _replay(self):
+        """Insert spilled records, oldest first; the file is removed only once all are in"""
+        if not self._has_spill():
+            return
+        with self.spill_lock():
+            replaying = f"{self.spill_path}.replay"
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replaying)
+            
+            with open(replaying, encoding='utf-8') as f:
+                batch = []
+                for line in f:
+                    try:
+                        batch.append(json.loads(line))
+                    except ValueError:
+                        # A torn last line from a crash mid-spill
+                        continue
+                    if len(batch) >= self.batch_size:
+                        self._insert(batch)
+                        self.replayed += len(batch)
+                        batch = []
+                if batch:
+                    self._insert(batch)
+                    self.replayed += len(batch)
+            os.remove(replaying)
+            logger.info(f"Replayed spilled transcripts from {self.spill_path}")
+    
+    def stats(self) -> Dict[str, int]:
+        """Queue depth and write, spill and drop counters"""
+        with self._wakeup:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes
+        }
@@ -0,0 +1,238 @@
+"""Learned intent model over hashed n-gram features, and its offline trainer"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+import re
+import zlib
+
+import numpy as np
+
+from conversation import IntentType
+from profiling import optional_import
+
+logger = logging.getLogger(__name__)
+
+class HashedFeatures:
+    """Hashed n-gram features: word unigrams and bigrams plus character trigrams of each word.
+    
+    The trigrams help with code-switched and agglutinative zu/xh text
+    ("isicelo sebursary"). Grams are hashed with CRC32 into ``n_features``
+    buckets, memoised per word and bigram since USSD vocabulary is small.
+    """
+    
+    MAX_MEMO = 200000
+    
+    def __init__(self, n_features: int):
+        self.n_features = n_features
+        self._word_buckets: Dict[str, Tuple[int, ...]] = {}
+        self._bigram_buckets: Dict[str, int] = {}
+        self._words = re.compile(r'\w+')
+    
+    def _bucket(self, gram: str) -> int:
+        return zlib.crc32(gram.encode('utf-8')) % self.n_features
+    
+    def counts(self, text: str) -> Dict[int, float]:
+        """Bucket counts for one text"""
+        words = self._words.findall(text.lower())
+        word_buckets = self._word_buckets
+        bigram_buckets = self._bigram_buckets
+        if len(word_buckets) > self.MAX_MEMO or len(bigram_buckets) > self.MAX_MEMO:
+            word_buckets.clear()
+            bigram_buckets.clear()
+        
+        counts: Dict[int, float] = {}
+        for word in words:
+            buckets = word_buckets.get(word)
+            if buckets is None:
+                padded = f"<{word}>"
+                grams = [word] + [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+                buckets = word_buckets[word] = tuple(self._bucket(gram) for gram in grams)
+            for bucket in buckets:
+                counts[bucket] = counts.get(bucket, 0.0) + 1.0
+        
+        for first, second in zip(words, words[1:]):
+            bigram = f"{first} {second}"
+            bucket = bigram_buckets.get(bigram)
+            if bucket is None:
+                bucket = bigram_buckets[bigram] = self._bucket(bigram)
+            counts[bucket] = counts.get(bucket, 0.0) + 1.0
+        return counts
+    
+    def transform(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """CSR parts (indptr, indices, L2-normalised values) for a batch of texts"""
+        indptr = [0]
+        indices: List[int] = []
+        values: List[float] = []
+        for text in texts:
+            counts = self.counts(text)
+            if counts:
+                norm = sum(count * count for count in counts.values()) ** 0.5
+                indices.extend(counts)
+                values.extend(count / norm for count in counts.values())
+            indptr.append(len(indices))
+        return (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64),
+                np.asarray(values, dtype=np.float32))
+
+@dataclass
+class IntentModel:
+    """Linear softmax intent model over hashed n-gram features, trained offline.
+    
+    Prediction gathers weight rows with NumPy, so the artifact loads in a few
+    milliseconds and scores without sklearn.
+    """
+    
+    FORMAT_VERSION = 1
+    N_FEATURES = 2 ** 16
+    
+    weights: np.ndarray                      # (n_features, n_classes) float32
+    bias: np.ndarray                         # (n_classes,) float32
+    classes: List[IntentType]
+    model_version: str = ""
+    meta: Dict[str, Any] = field(default_factory=dict)
+    featurizer: HashedFeatures = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        self.featurizer = HashedFeatures(self.weights.shape[0])
+    
+    def predict_proba(self, texts: List[str]) -> np.ndarray:
+        """Class probabilities, one row per text"""
+        indptr, indices, values = self.featurizer.transform(texts)
+        
+        if len(texts) == 1:
+            scores = (self.bias + values @ self.weights[indices])[None, :]
+        else:
+            scores = np.tile(self.bias, (len(texts), 1))
+            starts = indptr[:-1][np.diff(indptr) > 0]
+            if len(starts):
+                # Empty rows share their start with the next row, so reduce over non-empty rows only
+                scores[np.diff(indptr) > 0] += np.add.reduceat(self.weights[indices] * values[:, None], starts, axis=0)
+        
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+    
+    def predict(self, texts: List[str]) -> List[Tuple[IntentType, float]]:
+        """Most likely intent and its probability for each text"""
+        if not texts:
+            return []
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [(self.classes[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+    
+    @classmethod
+    def train(cls, texts: List[str], labels: List[IntentType], model_version: str,
+              n_features: int = N_FEATURES, regularization: float = 10.0) -> 'IntentModel':
+        """Fit multinomial logistic regression on hashed features (needs scikit-learn)"""
+        linear_model = optional_import('sklearn.linear_model')
+        sparse = optional_import('scipy.sparse')
+        if linear_model is None or sparse is None:
+            raise RuntimeError("Training the intent model requires scikit-learn")
+        
+        classes = sorted(set(labels), key=lambda intent: intent.value)
+        if len(classes) < 2:
+            raise ValueError("Training data needs at least two intents")
+        class_index = {intent: i for i, intent in enumerate(classes)}
+        
+        indptr, indices, values = HashedFeatures(n_features).transform(texts)
+        matrix = sparse.csr_matrix((values, indices, indptr), shape=(len(texts), n_features))
+        target = np.array([class_index[label] for label in labels])
+        
+        classifier = linear_model.LogisticRegression(C=regularization, max_iter=1000)
+        classifier.fit(matrix, target)
+        
+        coef, intercept = classifier.coef_, classifier.intercept_
+        if len(classes) == 2:
+            # Binary fits return one row for the positive class
+            coef, intercept = np.vstack([-coef, coef]) / 2, np.concatenate([-intercept, intercept]) / 2
+        
+        return cls(
+            weights=np.ascontiguousarray(coef.T, dtype=np.float32),
+            bias=np.asarray(intercept, dtype=np.float32),
+            classes=classes,
+            model_version=model_version,
+            meta={"trained_at": datetime.now().isoformat(), "examples": len(texts)}
+        )
+    
+    def save(self, path: str):
+        """Write the versioned artifact atomically"""
+        meta = dict(self.meta, format_version=self.FORMAT_VERSION, model_version=self.model_version,
+                    classes=[intent.value for intent in self.classes])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, weights=self.weights, bias=self.bias, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'IntentModel':
+        """Read an artifact written by save(); raises ValueError on a format mismatch"""
+        with np.load(path, allow_pickle=False) as artifact:
+            meta = json.loads(str(artifact['meta']))
+            if meta.get('format_version') != cls.FORMAT_VERSION:
+                raise ValueError(f"Unsupported intent model format {meta.get('format_version')}")
+            return cls(
+                weights=artifact['weights'],
+                bias=artifact['bias'],
+                classes=[IntentType(value) for value in meta['classes']],
+                model_version=meta.get('model_version', ''),
+                meta=meta
+            )
+
+def read_labelled_messages(path: str) -> Tuple[List[str], List[IntentType]]:
+    """Read JSON lines of {"message" | "text": ..., "intent" | "label": ...}, skipping bad rows"""
+    texts, labels = [], []
+    skipped = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                text = str(record.get('message') or record.get('text') or '').strip()
+                label = IntentType(record.get('intent') or record.get('label'))
+            except (ValueError, AttributeError):
+                skipped += 1
+                continue
+            if not text:
+                skipped += 1
+                continue
+            texts.append(text)
+            labels.append(label)
+    if skipped:
+        logger.warning(f"Skipped {skipped} unlabelled or malformed rows in {path}")
+    return texts, labels
+
+def train_intent_model(data_path: str, output_path: str, model_version: Optional[str] = None,
+                       holdout: float = 0.1) -> IntentModel:
+    """Train on labelled logs, report held-out accuracy, then refit on everything and save"""
+    texts, labels = read_labelled_messages(data_path)
+    model_version = model_version or datetime.now().strftime('%Y%m%d%H%M%S')
+    
+    # Deterministic split by message hash so reruns evaluate the same examples
+    held_out = [zlib.crc32(text.encode('utf-8')) % 1000 < holdout * 1000 for text in texts]
+    train_rows = [i for i, held in enumerate(held_out) if not held]
+    test_rows = [i for i, held in enumerate(held_out) if held]
+    
+    if test_rows and len(set(labels[i] for i in train_rows)) >= 2:
+        model = IntentModel.train([texts[i] for i in train_rows], [labels[i] for i in train_rows], model_version)
+        predictions = model.predict([texts[i] for i in test_rows])
+        correct = sum(predicted == labels[i] for (predicted, _), i in zip(predictions, test_rows))
+        accuracy = correct / len(test_rows)
+        print(f"Held-out accuracy: {accuracy:.3f} on {len(test_rows)} of {len(texts)} examples")
+    else:
+        accuracy = None
+    
+    model = IntentModel.train(texts, labels, model_version)
+    model.meta["holdout_accuracy"] = accuracy
+    model.save(output_path)
+    
+    counts: Dict[str, int] = {}
+    for label in labels:
+        counts[label.value] = counts.get(label.value, 0) + 1
+    print(f"Wrote intent model {model_version} to {output_path}: " +
+          ", ".join(f"{intent}={count}" for intent, count in sorted(counts.items())))
+    return model
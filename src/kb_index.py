@@ -0,0 +1,1022 @@
+"""Knowledge base retrieval: TF-IDF and semantic indexes with memory-mapped artifacts"""
+
+import os
+import json
+import hashlib
+import logging
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from dataclasses import dataclass, field
+import re
+import threading
+import functools
+import zlib
+
+import numpy as np
+
+from conversation import LanguageCode
+from profiling import optional_import
+from sessions import LRUCache
+
+if TYPE_CHECKING:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+class KnowledgeMatch(NamedTuple):
+    """Knowledge base search hit, indexable like the old (question, score) pairs"""
+    question: str
+    score: float
+    answer: Optional[str]
+    category: str
+    row: int
+
+class StringTable:
+    """Read-only sequence of strings kept as one UTF-8 buffer plus offsets.
+    
+    Backed by memory-mapped arrays, rows cost no Python objects until they are
+    read, so every worker mapping the same artifact shares the same pages.
+    Rows whose ``mask`` is 0 read as None.
+    """
+    
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, mask: Optional[np.ndarray] = None):
+        self.data = data
+        self.offsets = offsets
+        self.mask = mask
+    
+    @staticmethod
+    def pack(values: List[Optional[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """UTF-8 buffer, offsets and presence mask for a list of strings"""
+        encoded = [(value or '').encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        mask = np.array([value is not None for value in values], dtype=np.uint8)
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, mask
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if self.mask is not None and not self.mask[row]:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+    
+    def __iter__(self) -> Iterator[Optional[str]]:
+        return (self[row] for row in range(len(self)))
+
+# Function words dropped before indexing non-English knowledge base questions
+KB_STOP_WORDS = {
+    'af': frozenset("""
+        aan al as asseblief by daar dat die dit een en het hier hoe hulle hy is jou jy kan maar met moet my
+        na nie of om ons ook op se sal so sy te uit van vir waar wanneer was wat watter wie word
+    """.split()),
+    'zu': frozenset("""
+        bona futhi kakhulu kanjani khona kodwa kuphi lapho le lezi lo lokhu manje mina na nami ngiyacela
+        ngoba nje noma sicela thina uma ukuba ukuthi wena yena yini
+    """.split()),
+    'xh': frozenset("""
+        apha apho bona ezi kakhulu ke kodwa kule kwaye le lo mna na ndicela ngoba ngoku nje njani ntoni
+        oku okanye phi sicela thina ukuba wena xa yena
+    """.split()),
+}
+
+def strip_stop_words(text: str, stop_words: frozenset) -> str:
+    """Lowercase text and drop stop words, for analyzers that ignore ``stop_words``"""
+    return " ".join(word for word in re.findall(r"\w+", text.lower()) if word not in stop_words)
+
+@dataclass
+class KnowledgeIndex:
+    """Search index over one language's knowledge base entries, one row id per entry"""
+    # On-disk artifact layout: magic, header length, JSON header, aligned arrays
+    ARTIFACT_MAGIC = b'VOOKBIDX'
+    ARTIFACT_VERSION = 2
+    ARTIFACT_ARRAYS = ('idf', 'data', 'indices', 'indptr', 't_data', 't_indices', 't_indptr',
+                       'categories', 'category_offsets', 'questions', 'question_offsets',
+                       'answers', 'answer_offsets', 'answer_mask')
+    VECTORIZER_PARAMS = {'stop_words': 'english', 'max_features': 1000}
+    # English and Afrikaans are matched on words; Zulu and Xhosa are agglutinative
+    # (prefixes and concords fuse onto stems), so they are matched on character
+    # n-grams within words instead
+    LANGUAGE_PARAMS = {
+        'en': VECTORIZER_PARAMS,
+        'af': {'stop_words': 'af', 'max_features': 1000},
+        'zu': {'analyzer': 'char_wb', 'ngram_range': [3, 5], 'stop_words': 'zu', 'max_features': 5000},
+        'xh': {'analyzer': 'char_wb', 'ngram_range': [3, 5], 'stop_words': 'xh', 'max_features': 5000},
+    }
+    
+    language: LanguageCode = LanguageCode.ENGLISH
+    vectorizer: Optional['TfidfVectorizer'] = None
+    vectors: Any = None
+    vectors_t: Any = None
+    # Lists while building; StringTables over the artifact when memory-mapped
+    categories: List[str] = field(default_factory=list)
+    questions: List[str] = field(default_factory=list)
+    answers: List[Optional[str]] = field(default_factory=list)
+    # Built on first use for mapped indexes, which are never searched by exact question
+    answer_lookup: Optional[Dict[str, int]] = field(default_factory=dict)
+    patched_rows: int = 0
+    semantic: Optional['SemanticIndex'] = None
+    
+    @staticmethod
+    def entries(knowledge_data: Dict[str, Any],
+                language: LanguageCode = LanguageCode.ENGLISH) -> List[Tuple[str, str, Optional[str]]]:
+        """Flatten knowledge data into (category, question, answer) rows for a language.
+        
+        English rows are the entries themselves; other languages come from an
+        entry's ``translations``, e.g. ``{"af": {"question": ..., "answer": ...}}``,
+        and fall back to the English answer when the variant has none.
+        """
+        rows = []
+        for category, items in knowledge_data.items():
+            if isinstance(items, list):
+                for item in items:
+                    if isinstance(item, dict) and 'question' in item:
+                        if language is LanguageCode.ENGLISH:
+                            rows.append((category, item['question'], item.get('answer')))
+                            continue
+                        variant = (item.get('translations') or {}).get(language.value)
+                        if isinstance(variant, dict) and variant.get('question'):
+                            rows.append((category, variant['question'], variant.get('answer', item.get('answer'))))
+                    elif isinstance(item, str) and language is LanguageCode.ENGLISH:
+                        rows.append((category, item, None))
+        return rows
+    
+    @classmethod
+    def make_vectorizer(cls, sklearn_text, language: LanguageCode) -> 'TfidfVectorizer':
+        """Unfitted TF-IDF vectorizer with the language's tokenization and stop list"""
+        params = dict(cls.LANGUAGE_PARAMS[language.value])
+        stop_words = KB_STOP_WORDS.get(params.get('stop_words'))
+        if 'ngram_range' in params:
+            params['ngram_range'] = tuple(params['ngram_range'])
+        if stop_words is not None:
+            del params['stop_words']
+            if params.get('analyzer', 'word') == 'word':
+                params['stop_words'] = sorted(stop_words)
+            else:
+                params['preprocessor'] = functools.partial(strip_stop_words, stop_words=stop_words)
+        return sklearn_text.TfidfVectorizer(**params)
+    
+    @classmethod
+    def build(cls, knowledge_data: Dict[str, Any], language: LanguageCode = LanguageCode.ENGLISH) -> 'KnowledgeIndex':
+        """Build row arrays, answer lookup and TF-IDF matrix from knowledge data"""
+        index = cls(language=language)
+        for category, question, answer in cls.entries(knowledge_data, language):
+            index.add_row(category, question, answer)
+        
+        sklearn_text = optional_import('sklearn.feature_extraction.text')
+        if sklearn_text is None:
+            logger.warning("scikit-learn not installed, knowledge base search disabled")
+            return index
+        
+        if index.questions:
+            index.vectorizer = cls.make_vectorizer(sklearn_text, language)
+            index.vectors = index.vectorizer.fit_transform(index.questions).tocsr()
+            index.vectors_t = index.vectors.T.tocsr()
+        
+        return index
+    
+    def patched(self, knowledge_data: Dict[str, Any], max_ratio: float) -> Optional['KnowledgeIndex']:
+        """Build a new index reusing this one's fitted vocabulary and row vectors.
+        
+        Rows whose question is unchanged keep their vector and only new questions
+        are transformed. Returns None when a full refit is due: no fitted index
+        yet, or more than ``max_ratio`` of the rows would be vectorised against
+        a vocabulary that was not fitted on them.
+        """
+        sparse = optional_import('scipy.sparse')
+        if self.vectors is None or sparse is None:
+            return None
+        
+        entries = self.entries(knowledge_data, self.language)
+        old_rows = {}
+        for row, question in enumerate(self.questions):
+            old_rows.setdefault(question, row)
+        new_questions = list(dict.fromkeys(
+            question for _, question, _ in entries if question not in old_rows
+        ))
+        
+        if not entries or self.patched_rows + len(new_questions) > max_ratio * len(entries):
+            return None
+        
+        index = KnowledgeIndex(language=self.language, vectorizer=self.vectorizer, patched_rows=self.patched_rows + len(new_questions))
+        for category, question, answer in entries:
+            index.add_row(category, question, answer)
+        
+        # Select existing rows and append freshly transformed ones in entry order
+        if new_questions:
+            stacked = sparse.vstack([self.vectors, self.vectorizer.transform(new_questions)]).tocsr()
+            new_rows = {question: len(self.questions) + i for i, question in enumerate(new_questions)}
+        else:
+            stacked, new_rows = self.vectors, {}
+        order = [old_rows[q] if q in old_rows else new_rows[q] for q in index.questions]
+        index.vectors = stacked[order]
+        index.vectors_t = index.vectors.T.tocsr()
+        
+        return index
+    
+    def save(self, path: str, content_hash: str):
+        """Write rows, vocabulary, IDF weights and CSR matrices to a versioned artifact.
+        
+        A language without entries is saved too, so a complete set of artifacts
+        tells readers they need not parse the knowledge base file.
+        """
+        if self.vectors is None and self.questions:
+            raise ValueError("Cannot save an unfitted knowledge base index")
+        
+        if self.vectors is not None:
+            arrays = {
+                'idf': np.ascontiguousarray(self.vectorizer.idf_, dtype=np.float64),
+                'data': self.vectors.data, 'indices': self.vectors.indices, 'indptr': self.vectors.indptr,
+                't_data': self.vectors_t.data, 't_indices': self.vectors_t.indices, 't_indptr': self.vectors_t.indptr,
+            }
+            vocabulary = sorted(self.vectorizer.vocabulary_, key=self.vectorizer.vocabulary_.get)
+            shape = list(self.vectors.shape)
+        else:
+            empty = np.empty(0, dtype=np.int32)
+            arrays = {'idf': np.empty(0), 'data': np.empty(0), 'indices': empty, 'indptr': empty,
+                      't_data': np.empty(0), 't_indices': empty, 't_indptr': empty}
+            vocabulary, shape = [], [0, 0]
+        arrays['categories'], arrays['category_offsets'], _ = StringTable.pack(list(self.categories))
+        arrays['questions'], arrays['question_offsets'], _ = StringTable.pack(list(self.questions))
+        arrays['answers'], arrays['answer_offsets'], arrays['answer_mask'] = StringTable.pack(list(self.answers))
+        
+        # Lay arrays out at 64-byte aligned offsets after the header
+        layout, offset = {}, 0
+        for name in self.ARTIFACT_ARRAYS:
+            array = np.ascontiguousarray(arrays[name])
+            arrays[name] = array
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += -(-array.nbytes // 64) * 64
+        
+        header = json.dumps({
+            'version': self.ARTIFACT_VERSION,
+            'content_hash': content_hash,
+            'vectorizer_params': self.LANGUAGE_PARAMS[self.language.value],
+            'rows': len(self.questions),
+            'shape': shape,
+            'vocabulary': vocabulary,
+            'arrays': layout,
+        }, ensure_ascii=False).encode('utf-8')
+        data_start = -(-(len(self.ARTIFACT_MAGIC) + 8 + len(header)) // 64) * 64
+        
+        # Write to a temporary file and rename so readers never see a partial artifact
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.ARTIFACT_MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for name in self.ARTIFACT_ARRAYS:
+                f.seek(data_start + layout[name]['offset'])
+                f.write(arrays[name].tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str, content_hash: str,
+             language: LanguageCode = LanguageCode.ENGLISH) -> Optional['KnowledgeIndex']:
+        """Memory-map a saved artifact, or return None if it is missing or stale.
+        
+        Row strings stay in the mapping as well, so loading a fresh artifact
+        needs neither the knowledge base file nor a Python object per entry.
+        """
+        sklearn_text = optional_import('sklearn.feature_extraction.text')
+        sparse = optional_import('scipy.sparse')
+        if sklearn_text is None or sparse is None:
+            return None
+        
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(cls.ARTIFACT_MAGIC)) != cls.ARTIFACT_MAGIC:
+                    logger.warning(f"Ignoring knowledge base index {path}: bad magic")
+                    return None
+                header_length = int.from_bytes(f.read(8), 'little')
+                header = json.loads(f.read(header_length).decode('utf-8'))
+        except FileNotFoundError:
+            return None
+        
+        if (header.get('version') != cls.ARTIFACT_VERSION
+                or header.get('content_hash') != content_hash
+                or header.get('vectorizer_params') != cls.LANGUAGE_PARAMS[language.value]):
+            logger.info(f"Knowledge base index {path} is stale, refitting")
+            return None
+        
+        data_start = -(-(len(cls.ARTIFACT_MAGIC) + 8 + header_length) // 64) * 64
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if not shape[0]:
+                arrays[name] = np.empty(shape, dtype=spec['dtype'])
+                continue
+            arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                     offset=data_start + spec['offset'], shape=shape)
+        
+        index = cls(
+            language=language,
+            categories=StringTable(arrays['categories'], arrays['category_offsets']),
+            questions=StringTable(arrays['questions'], arrays['question_offsets']),
+            answers=StringTable(arrays['answers'], arrays['answer_offsets'], arrays['answer_mask']),
+            answer_lookup=None
+        )
+        if not header['rows']:
+            return index
+        
+        index.vectorizer = cls.make_vectorizer(sklearn_text, language)
+        index.vectorizer.vocabulary_ = {term: column for column, term in enumerate(header['vocabulary'])}
+        index.vectorizer.idf_ = np.asarray(arrays['idf'])
+        
+        rows, columns = header['shape']
+        index.vectors = sparse.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']), shape=(rows, columns), copy=False
+        )
+        index.vectors_t = sparse.csr_matrix(
+            (arrays['t_data'], arrays['t_indices'], arrays['t_indptr']), shape=(columns, rows), copy=False
+        )
+        return index
+    
+    def find(self, question: str) -> Optional[int]:
+        """Row of an exact (case-insensitive) question match"""
+        if self.answer_lookup is None:
+            lookup = {}
+            for row, text in enumerate(self.questions):
+                lookup.setdefault(text.lower(), row)
+            self.answer_lookup = lookup
+        return self.answer_lookup.get(question.lower())
+    
+    def add_row(self, category: str, question: str, answer: Optional[str]):
+        """Append an entry; the first entry wins for duplicate questions"""
+        row = len(self.questions)
+        self.categories.append(category)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.answer_lookup.setdefault(question.lower(), row)
+    
+    def top_k(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[KnowledgeMatch]:
+        """Select the best rows above the similarity threshold, highest first"""
+        keep = scores > 0.1  # Minimum similarity threshold
+        rows, scores = rows[keep], scores[keep]
+        if top_k <= 0 or not len(scores):
+            return []
+        
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        
+        return [
+            KnowledgeMatch(self.questions[row], float(score), self.answers[row], self.categories[row], int(row))
+            for row, score in zip(rows[order], scores[order])
+        ]
+
+class TextEncoder:
+    """Local CPU sentence encoder: a Hugging Face model, mean pooled and L2-normalised.
+    
+    The model is loaded from the local cache or a directory only (offline), and
+    query embeddings are memoised, since USSD users repeat the same questions.
+    """
+    
+    def __init__(self, model_name: str, cache_size: int, batch_size: int = 32):
+        # Never reach for the network at runtime; a missing model is a configuration error
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+        transformers = optional_import('transformers')
+        torch = optional_import('torch')
+        if transformers is None or torch is None:
+            raise RuntimeError("Semantic search requires the transformers and torch packages")
+        
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.torch = torch
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+        self.model = transformers.AutoModel.from_pretrained(model_name, local_files_only=True).to('cpu').eval()
+        self.cache = LRUCache(cache_size, float(os.getenv('AI_EMBEDDING_CACHE_TTL', 86400))) if cache_size > 0 else None
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        torch = self.torch
+        batches = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                tokens = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                        max_length=128, return_tensors='pt')
+                hidden = self.model(**tokens).last_hidden_state
+                mask = tokens['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                batches.append(torch.nn.functional.normalize(pooled, dim=1).numpy())
+        return np.vstack(batches).astype(np.float32, copy=False)
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Unit-length float32 embeddings, one row per text"""
+        if self.cache is None:
+            return self._encode(texts)
+        
+        keys = [" ".join(text.lower().split()) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self._encode([texts[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return np.vstack(vectors)
+
+@dataclass
+class SemanticIndex:
+    """Int8-quantised embeddings of the knowledge base questions, one row per index row.
+    
+    Each row is stored as int8 codes with a float32 scale (symmetric, per
+    row), a quarter of the float32 size; cosine scores for a query are one
+    matrix-vector product rescaled per row.
+    """
+    ARTIFACT_VERSION = 1
+    # Rows dequantised per step when scoring, bounding the float32 scratch to block x dim
+    SCORE_BLOCK_ROWS = 4096
+    
+    model_name: str
+    questions: List[str]
+    codes: np.ndarray    # (rows, dim) int8
+    scales: np.ndarray   # (rows,) float32
+    
+    @staticmethod
+    def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Symmetric per-row int8 quantisation"""
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    
+    @classmethod
+    def build(cls, encoder: TextEncoder, questions: List[str], previous: Optional['SemanticIndex'] = None) -> 'SemanticIndex':
+        """Embed questions, reusing rows of a previous index for unchanged questions"""
+        reusable = {}
+        if previous is not None and previous.model_name == encoder.model_name:
+            reusable = {question: row for row, question in enumerate(previous.questions)}
+        
+        dim = previous.codes.shape[1] if reusable else None
+        new_rows = [row for row, question in enumerate(questions) if question not in reusable]
+        encoded = encoder._encode([questions[row] for row in new_rows]) if new_rows else None
+        if encoded is not None:
+            dim = encoded.shape[1]
+        
+        codes = np.zeros((len(questions), dim or 0), dtype=np.int8)
+        scales = np.ones(len(questions), dtype=np.float32)
+        if encoded is not None:
+            codes[new_rows], scales[new_rows] = cls.quantize(encoded)
+        for row, question in enumerate(questions):
+            old_row = reusable.get(question)
+            if old_row is not None:
+                codes[row], scales[row] = previous.codes[old_row], previous.scales[old_row]
+        
+        logger.info(f"Embedded {len(new_rows)} of {len(questions)} knowledge base questions")
+        return cls(encoder.model_name, list(questions), codes, scales)
+    
+    @staticmethod
+    def fingerprint(model_name: str, questions: List[str]) -> str:
+        """Key tying an artifact to the model and the exact question rows"""
+        digest = hashlib.sha256(model_name.encode('utf-8'))
+        for question in questions:
+            digest.update(b'\0' + question.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def save(self, path: str):
+        """Persist codes and scales atomically"""
+        meta = {"version": self.ARTIFACT_VERSION, "model": self.model_name,
+                "fingerprint": self.fingerprint(self.model_name, self.questions)}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, codes=self.codes, scales=self.scales, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str, model_name: str, questions: List[str]) -> Optional['SemanticIndex']:
+        """Load an artifact if it was built by this model for exactly these questions"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as artifact:
+            meta = json.loads(str(artifact['meta']))
+            if meta.get('version') != cls.ARTIFACT_VERSION or meta.get('fingerprint') != cls.fingerprint(model_name, questions):
+                return None
+            return cls(model_name, list(questions), artifact['codes'], artifact['scales'])
+    
+    def scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of each query against every row.
+        
+        The int8 codes are converted to float32 one block of rows at a time,
+        so scoring never holds a float32 copy of the whole matrix.
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        rows = self.codes.shape[0]
+        scores = np.empty((query_vectors.shape[0], rows), dtype=np.float32)
+        for start in range(0, rows, self.SCORE_BLOCK_ROWS):
+            end = min(start + self.SCORE_BLOCK_ROWS, rows)
+            block = self.codes[start:end].astype(np.float32)
+            scores[:, start:end] = query_vectors @ block.T
+        scores *= self.scales
+        return scores
+
+class LanguageDetector:
+    """Character trigram naive Bayes language identification for short messages.
+    
+    Only overrides the client's language hint when the message is long enough
+    and another language is clearly more likely.
+    """
+    # Seed text per language, extended with the knowledge base's own rows
+    SEED_SAMPLES = {
+        LanguageCode.ENGLISH: [
+            "How do I apply for a bursary? What documents do I need for my application?",
+            "Where is the ward office and when is it open? I want to report a problem with the water.",
+            "Please check the status of my application, the street light in our area is not working.",
+            "Can you tell me which areas the ward covers and how I can contact the councillor?",
+        ],
+        LanguageCode.AFRIKAANS: [
+            "Hoe doen ek aansoek vir 'n beurs? Watter dokumente het ek nodig vir my aansoek?",
+            "Waar is die wyk kantoor en wanneer is dit oop? Ek wil 'n probleem met die water aanmeld.",
+            "Kan u asseblief die status van my aansoek nagaan, die straatlig in ons area werk nie.",
+            "Kan jy my sê watter gebiede die wyk dek en hoe ek die raadslid kan kontak?",
+        ],
+        LanguageCode.ZULU: [
+            "Ngifaka kanjani isicelo somxhaso wemfundo? Yimiphi imibhalo engiyidingayo esicelweni sami?",
+            "Likuphi ihhovisi lewadi futhi livulwa nini? Ngifuna ukubika inkinga yamanzi.",
+            "Ngicela uhlole isimo sesicelo sami, isibani sasemgwaqweni endaweni yethu asisebenzi.",
+            "Ungangitshela ukuthi iwadi ihlanganisa ziphi izindawo nokuthi ngingamthinta kanjani ikhansela?",
+        ],
+        LanguageCode.XHOSA: [
+            "Ndenza njani isicelo sebhasari? Ndifuna ntoni amaxwebhu kwisicelo sam?",
+            "Iphi iofisi yewadi kwaye ivulwa nini? Ndifuna ukuxela ingxaki yamanzi.",
+            "Ndicela ukhangele imeko yesicelo sam, isibane sesitrato kummandla wethu asisebenzi.",
+            "Ungandixelela ukuba iwadi iquka eyiphi imimandla nokuba ndingaqhagamshelana njani nekhansile?",
+        ],
+    }
+    
+    def __init__(self, samples: Dict[LanguageCode, List[str]], buckets: int = 4096,
+                 min_ngrams: int = 12, margin: float = 0.3):
+        self.languages = [language for language in LanguageCode if samples.get(language)]
+        self.rows = {language: row for row, language in enumerate(self.languages)}
+        self.buckets = buckets
+        self.min_ngrams = min_ngrams
+        self.margin = margin
+        
+        counts = np.ones((len(self.languages), buckets))  # Add-one smoothing
+        for row, language in enumerate(self.languages):
+            for text in samples[language]:
+                np.add.at(counts[row], self.ngram_ids(text), 1)
+        self.log_probs = np.log(counts / counts.sum(axis=1, keepdims=True))
+    
+    def ngram_ids(self, text: str) -> np.ndarray:
+        """Hashed character trigrams of the text's words, padded with spaces"""
+        padded = " " + " ".join(re.findall(r"[^\W\d_]+", text.lower())) + " "
+        return np.fromiter(
+            (zlib.crc32(padded[i:i + 3].encode('utf-8')) % self.buckets for i in range(len(padded) - 2)),
+            dtype=np.intp
+        )
+    
+    def detect(self, text: str, hint: LanguageCode = LanguageCode.ENGLISH) -> LanguageCode:
+        """Most likely language of the text, or the hint when the evidence is weak"""
+        ids = self.ngram_ids(text)
+        if len(ids) < self.min_ngrams or hint not in self.rows:
+            return hint
+        
+        # Mean log-likelihood per trigram, so the margin does not depend on length
+        scores = self.log_probs[:, ids].sum(axis=1) / len(ids)
+        best = int(np.argmax(scores))
+        if scores[best] - scores[self.rows[hint]] > self.margin:
+            return self.languages[best]
+        return hint
+
+class KnowledgeBase:
+    """Knowledge base for FAQ and information retrieval"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('AI_KNOWLEDGE_BASE_PATH', 'knowledge_base.json')
+        self.index_path = os.getenv('AI_KB_INDEX_PATH') or os.path.splitext(self.path)[0] + '.index'
+        self.indexes: Dict[LanguageCode, KnowledgeIndex] = {LanguageCode.ENGLISH: KnowledgeIndex()}
+        self.language_detector = LanguageDetector(LanguageDetector.SEED_SAMPLES)
+        self.detect_languages = os.getenv('AI_LANGUAGE_DETECTION', 'true').lower() == 'true'
+        
+        # Share of rows that may be patched in before a full refit
+        self.incremental_ratio = float(os.getenv('AI_KB_INCREMENTAL_RATIO', 0.1))
+        # Workers on one host map one set of artifacts, built by whichever gets the lock first
+        self.shared_index = os.getenv('AI_KB_SHARED_INDEX', 'false').lower() == 'true'
+        self._mtime = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        
+        # Optional dense retrieval: tfidf (default), semantic, or hybrid (best of both per row)
+        self.search_mode = os.getenv('AI_KB_SEARCH_MODE', 'tfidf').lower()
+        self.embeddings_path = os.getenv('AI_KB_EMBEDDINGS_PATH') or os.path.splitext(self.path)[0] + '.emb.npz'
+        self.encoder: Optional[TextEncoder] = None
+        if self.search_mode in ('semantic', 'hybrid'):
+            try:
+                self.encoder = TextEncoder(
+                    os.getenv('AI_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2'),
+                    int(os.getenv('AI_EMBEDDING_CACHE_SIZE', 10000))
+                )
+            except Exception as e:
+                logger.warning(f"Semantic knowledge base search unavailable, using TF-IDF: {e}")
+                self.search_mode = 'tfidf'
+        
+        self.load_knowledge_base()
+    
+    @property
+    def index(self) -> KnowledgeIndex:
+        """Current English index"""
+        return self.indexes[LanguageCode.ENGLISH]
+    
+    @property
+    def vectorizer(self) -> Optional['TfidfVectorizer']:
+        """Fitted TF-IDF vectorizer of the current index"""
+        return self.index.vectorizer
+    
+    @property
+    def knowledge_vectors(self):
+        """TF-IDF matrix of the current index, one row per entry"""
+        return self.index.vectors
+    
+    @property
+    def knowledge_texts(self) -> List[str]:
+        """Questions of the current index, by row id"""
+        return self.index.questions
+    
+    def load_knowledge_base(self):
+        """Load knowledge base from JSON file"""
+        try:
+            self.reload(incremental=False)
+            
+        except FileNotFoundError:
+            logger.warning("Knowledge base file not found, creating default")
+            self.create_default_knowledge_base()
+        except Exception as e:
+            logger.error(f"Error loading knowledge base: {e}")
+            self.create_default_knowledge_base()
+    
+    def reload(self, incremental: bool = True) -> KnowledgeIndex:
+        """Re-read the knowledge base file and atomically swap in new indexes.
+        
+        Searches hold their own reference to the index they started with, so
+        they never observe a partially built one. Errors leave the current
+        indexes in place and propagate to the caller. Returns the English index.
+        """
+        with self._reload_lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            content_hash = self.content_hash(raw)
+            
+            # Prefer prebuilt artifacts for exactly this content, then patch, then fit
+            indexes = self.load_index_artifacts(content_hash)
+            modes = dict.fromkeys(LanguageCode, "mapped")
+            if indexes is None and self.shared_index:
+                with self.artifact_lock():
+                    # Another worker may have built them while we waited
+                    indexes = self.load_index_artifacts(content_hash)
+                    if indexes is None:
+                        self.build_index_artifact(raw)
+                        indexes = self.load_index_artifacts(content_hash)
+            if indexes is None:
+                knowledge_data = json.loads(raw.decode('utf-8'))
+                indexes = {}
+                for language in LanguageCode:
+                    index = None
+                    modes[language] = "patched"
+                    previous = self.indexes.get(language)
+                    if incremental and previous is not None:
+                        index = previous.patched(knowledge_data, self.incremental_ratio)
+                    if index is None:
+                        index = KnowledgeIndex.build(knowledge_data, language)
+                        modes[language] = "fitted"
+                    indexes[language] = index
+            indexes = {
+                language: index for language, index in indexes.items()
+                if index.questions or language is LanguageCode.ENGLISH
+            }
+            self.attach_semantic_index(indexes[LanguageCode.ENGLISH])
+            
+            self.swap_indexes(indexes)
+            self._mtime = mtime
+            
+            index = indexes[LanguageCode.ENGLISH]
+            languages = "".join(
+                f", {language.value}: {len(other.questions)} ({modes[language]})"
+                for language, other in indexes.items() if language is not LanguageCode.ENGLISH
+            )
+            logger.info(f"Knowledge base loaded with {len(index.questions)} entries ({modes[LanguageCode.ENGLISH]}){languages}")
+            return index
+    
+    def swap_indexes(self, indexes: Dict[LanguageCode, KnowledgeIndex]):
+        """Make new indexes live, with a language detector that has seen their questions"""
+        samples = {language: list(texts) for language, texts in LanguageDetector.SEED_SAMPLES.items()}
+        for language, index in indexes.items():
+            samples[language].extend(index.questions[:500])
+        detector = LanguageDetector(samples)
+        
+        self.indexes = indexes
+        self.language_detector = detector
+    
+    def attach_semantic_index(self, index: KnowledgeIndex):
+        """Load or build the embeddings for an index's rows before it goes live"""
+        if self.encoder is None:
+            return
+        questions = index.questions
+        try:
+            semantic = SemanticIndex.load(self.embeddings_path, self.encoder.model_name, questions)
+            if semantic is None:
+                semantic = SemanticIndex.build(self.encoder, questions, self.index.semantic)
+                semantic.save(self.embeddings_path)
+            index.semantic = semantic
+        except Exception as e:
+            logger.error(f"Error building knowledge base embeddings: {e}")
+    
+    @staticmethod
+    def content_hash(raw: bytes) -> str:
+        """Content hash that keys the prebuilt index artifact"""
+        return hashlib.sha256(raw).hexdigest()
+    
+    def index_artifact_path(self, language: LanguageCode) -> str:
+        """Artifact path for a language's index; English uses the configured path"""
+        if language is LanguageCode.ENGLISH:
+            return self.index_path
+        root, ext = os.path.splitext(self.index_path)
+        return f"{root}.{language.value}{ext}"
+    
+    def load_index_artifact(self, content_hash: str,
+                            language: LanguageCode = LanguageCode.ENGLISH) -> Optional[KnowledgeIndex]:
+        """Memory-map the prebuilt index if it matches the knowledge base content"""
+        path = self.index_artifact_path(language)
+        try:
+            return KnowledgeIndex.load(path, content_hash, language)
+        except Exception as e:
+            logger.warning(f"Error loading knowledge base index {path}: {e}")
+            return None
+    
+    def load_index_artifacts(self, content_hash: str) -> Optional[Dict[LanguageCode, KnowledgeIndex]]:
+        """Memory-map every language's prebuilt index, or None unless all are current"""
+        indexes = {}
+        for language in LanguageCode:
+            index = self.load_index_artifact(content_hash, language)
+            if index is None:
+                return None
+            indexes[language] = index
+        return indexes
+    
+    @contextmanager
+    def artifact_lock(self):
+        """Exclusive lock across processes while one of them builds the artifacts"""
+        fcntl = optional_import('fcntl')
+        with open(f"{self.index_path}.lock", 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def build_index_artifact(self, raw: Optional[bytes] = None) -> KnowledgeIndex:
+        """Fit the knowledge base file from scratch and persist an index artifact per language"""
+        if raw is None:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        knowledge_data = json.loads(raw.decode('utf-8'))
+        for language in LanguageCode:
+            index = KnowledgeIndex.build(knowledge_data, language)
+            if language is LanguageCode.ENGLISH:
+                english = index
+            path = self.index_artifact_path(language)
+            index.save(path, self.content_hash(raw))
+            logger.info(f"Knowledge base index written to {path} ({len(index.questions)} entries)")
+        return english
+    
+    def reload_if_changed(self) -> bool:
+        """Reload when the knowledge base file's mtime has changed"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        
+        if mtime == self._mtime:
+            return False
+        
+        self.reload()
+        return True
+    
+    def start_watcher(self, interval: float):
+        """Poll the knowledge base file in a background thread and reload on change"""
+        if self._watcher and self._watcher.is_alive():
+            return
+        
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    logger.error(f"Error reloading knowledge base: {e}")
+        
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=watch, name="kb-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.path} for changes every {interval}s")
+    
+    def stop_watcher(self):
+        """Stop the background file watcher"""
+        self._stop_watching.set()
+    
+    def create_default_knowledge_base(self):
+        """Create default knowledge base"""
+        knowledge_data = {
+            "bursary_info": [
+                {
+                    "question": "How do I apply for a bursary?",
+                    "answer": "To apply for a bursary, dial *120*8001# and follow the prompts. You'll need your ID number and school details.",
+                    "translations": {
+                        "af": {
+                            "question": "Hoe doen ek aansoek vir 'n beurs?",
+                            "answer": "Om vir 'n beurs aansoek te doen, skakel *120*8001# en volg die opdragte. Jy sal jou ID-nommer en skoolbesonderhede nodig hê."
+                        },
+                        "zu": {
+                            "question": "Ngifaka kanjani isicelo somxhaso wemfundo?",
+                            "answer": "Ukufaka isicelo somxhaso wemfundo, shayela *120*8001# bese ulandela imiyalelo. Uzodinga inombolo kamazisi wakho nemininingwane yesikole."
+                        },
+                        "xh": {
+                            "question": "Ndenza njani isicelo sebhasari?",
+                            "answer": "Ukwenza isicelo sebhasari, cofa *120*8001# uze ulandele imiyalelo. Uza kudinga inombolo yesazisi sakho neenkcukacha zesikolo."
+                        }
+                    }
+                },
+                {
+                    "question": "What documents do I need for bursary application?",
+                    "answer": "You need: ID copy, proof of registration, academic transcript, and proof of income (if applicable).",
+                    "translations": {
+                        "af": {
+                            "question": "Watter dokumente het ek nodig vir 'n beursaansoek?",
+                            "answer": "Jy benodig: 'n afskrif van jou ID, bewys van registrasie, akademiese rekord, en bewys van inkomste (indien van toepassing)."
+                        },
+                        "zu": {
+                            "question": "Yimiphi imibhalo engiyidingayo esicelweni somxhaso wemfundo?",
+                            "answer": "Udinga: ikhophi kamazisi, ubufakazi bokubhalisa, imiphumela yezifundo, nobufakazi bemali engenayo (uma kudingeka)."
+                        },
+                        "xh": {
+                            "question": "Ndifuna maxwebhu mani kwisicelo sebhasari?",
+                            "answer": "Ufuna: ikopi yesazisi, ubungqina bokubhalisa, iziphumo zezifundo, nobungqina bengeniso (ukuba kuyimfuneko)."
+                        }
+                    }
+                },
+                {
+                    "question": "When will I know about my bursary application status?",
+                    "answer": "Bursary applications are reviewed within 30 days. You can check status by dialing *120*8001# and selecting 'Check Status'."
+                }
+            ],
+            "contact_info": [
+                {
+                    "question": "How can I contact the ward office?",
+                    "answer": "Ward office: 021-XXX-XXXX\nEmail: ward@voo.gov.za\nOffice hours: Monday-Friday 8AM-4PM",
+                    "translations": {
+                        "af": {
+                            "question": "Hoe kan ek die wykskantoor kontak?",
+                            "answer": "Wykskantoor: 021-XXX-XXXX\nE-pos: ward@voo.gov.za\nKantoorure: Maandag-Vrydag 08:00-16:00"
+                        },
+                        "zu": {
+                            "question": "Ngingaxhumana kanjani nehhovisi lewadi?",
+                            "answer": "Ihhovisi lewadi: 021-XXX-XXXX\nI-imeyili: ward@voo.gov.za\nAmahora ehhovisi: UMsombuluko-ULwesihlanu 8AM-4PM"
+                        },
+                        "xh": {
+                            "question": "Ndingaqhagamshelana njani neofisi yewadi?",
+                            "answer": "Iofisi yewadi: 021-XXX-XXXX\nI-imeyile: ward@voo.gov.za\nIiyure zeofisi: NgoMvulo-NgoLwesihlanu 8AM-4PM"
+                        }
+                    }
+                },
+                {
+                    "question": "Where is the ward office located?",
+                    "answer": "VOO Ward Office\n123 Main Street, Cape Town\nBuilding A, Ground Floor"
+                }
+            ],
+            "services": [
+                {
+                    "question": "What services does the ward offer?",
+                    "answer": "Services include: Bursary applications, Issue reporting, Information requests, Document assistance, Community programs"
+                },
+                {
+                    "question": "How do I report a community issue?",
+                    "answer": "Dial *120*8001#, select 'Report Issue', and provide details. Include location, description, and urgency level.",
+                    "translations": {
+                        "af": {
+                            "question": "Hoe meld ek 'n gemeenskapsprobleem aan?",
+                            "answer": "Skakel *120*8001#, kies 'Report Issue' en gee besonderhede. Sluit die ligging, 'n beskrywing en hoe dringend dit is in."
+                        },
+                        "zu": {
+                            "question": "Ngiyibika kanjani inkinga yomphakathi?",
+                            "answer": "Shayela *120*8001#, khetha 'Report Issue', bese unikeza imininingwane. Faka indawo, incazelo, nokuthi kuphuthuma kangakanani."
+                        },
+                        "xh": {
+                            "question": "Ndiyixela njani ingxaki yoluntu?",
+                            "answer": "Cofa *120*8001#, khetha 'Report Issue', uze unike iinkcukacha. Faka indawo, inkcazo, nokuba ingxamiseke kangakanani."
+                        }
+                    }
+                }
+            ],
+            "areas": [
+                {
+                    "question": "Which areas does this ward cover?",
+                    "answer": "The ward covers multiple areas. Use *120*8001# and select 'Area Information' for specific area details."
+                }
+            ]
+        }
+        
+        indexes = {}
+        for language in LanguageCode:
+            index = KnowledgeIndex.build(knowledge_data, language)
+            if index.questions or language is LanguageCode.ENGLISH:
+                indexes[language] = index
+        self.attach_semantic_index(indexes[LanguageCode.ENGLISH])
+        self.swap_indexes(indexes)
+        
+        # Save default knowledge base
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(knowledge_data, f, indent=2, ensure_ascii=False)
+            self._mtime = os.stat(self.path).st_mtime_ns
+            logger.info("Default knowledge base created")
+        except Exception as e:
+            logger.error(f"Error creating default knowledge base: {e}")
+    
+    def detect_language(self, text: str, hint: LanguageCode = LanguageCode.ENGLISH) -> LanguageCode:
+        """Language a message is written in, falling back to the client's hint"""
+        if not self.detect_languages:
+            return hint
+        return self.language_detector.detect(text, hint)
+    
+    def search_knowledge(self, query: str, top_k: int = 3,
+                         language: LanguageCode = LanguageCode.ENGLISH) -> List[KnowledgeMatch]:
+        """Search knowledge base using TF-IDF similarity"""
+        return self.search_knowledge_batch([query], top_k, [language])[0]
+    
+    def search_knowledge_batch(self, queries: List[str], top_k: int = 3,
+                               languages: Optional[List[LanguageCode]] = None) -> List[List[KnowledgeMatch]]:
+        """Search knowledge base for many queries, one product per language.
+        
+        Each query is searched in its language's index, or the English index
+        when the knowledge base has no entries in that language.
+        """
+        indexes = self.indexes
+        english = indexes[LanguageCode.ENGLISH]
+        if languages is None:
+            return self.search_index(english, queries, top_k)
+        
+        groups: Dict[int, Tuple[KnowledgeIndex, List[int]]] = {}
+        for i, language in enumerate(languages):
+            index = indexes.get(language, english)
+            groups.setdefault(id(index), (index, []))[1].append(i)
+        if len(groups) == 1:
+            return self.search_index(next(iter(groups.values()))[0], queries, top_k)
+        
+        results: List[List[KnowledgeMatch]] = [[] for _ in queries]
+        for index, positions in groups.values():
+            for i, matches in zip(positions, self.search_index(index, [queries[i] for i in positions], top_k)):
+                results[i] = matches
+        return results
+    
+    def search_index(self, index: KnowledgeIndex, queries: List[str], top_k: int) -> List[List[KnowledgeMatch]]:
+        """Search one index for many queries with one transform and one matrix product"""
+        if not queries:
+            return []
+        if index.semantic is not None and self.search_mode != 'tfidf':
+            try:
+                return self.search_semantic(index, queries, top_k)
+            except Exception as e:
+                logger.error(f"Error in semantic knowledge base search, using TF-IDF: {e}")
+        if index.vectors is None:
+            return [[] for _ in queries]
+        
+        try:
+            # TF-IDF rows are L2-normalised, so the dot product is the cosine similarity
+            query_vectors = index.vectorizer.transform(queries)
+            similarities = (query_vectors @ index.vectors_t).tocsr()
+            
+            # Only the non-zero similarities of each query are candidates
+            indptr = similarities.indptr
+            return [
+                index.top_k(similarities.indices[start:end], similarities.data[start:end], top_k)
+                for start, end in zip(indptr[:-1], indptr[1:])
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error searching knowledge base: {e}")
+            return [[] for _ in queries]
+    
+    def search_semantic(self, index: KnowledgeIndex, queries: List[str], top_k: int) -> List[List[KnowledgeMatch]]:
+        """Dense search; in hybrid mode each row takes the better of its dense and TF-IDF score"""
+        scores = index.semantic.scores(self.encoder.encode(queries))
+        if self.search_mode == 'hybrid' and index.vectors is not None:
+            tfidf = (index.vectorizer.transform(queries) @ index.vectors_t).toarray()
+            np.maximum(scores, tfidf, out=scores)
+        
+        rows = np.arange(scores.shape[1])
+        return [index.top_k(rows, row_scores, top_k) for row_scores in scores]
+    
+    def get_answer(self, question: str) -> Optional[str]:
+        """Get answer for a specific question"""
+        index = self.index
+        row = index.find(question)
+        return index.answers[row] if row is not None else None
@@ -0,0 +1,214 @@
+"""Bounded, deadline-aware access to the LLM completion API"""
+
+import time
+import json
+import hashlib
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from sessions import BackgroundEventLoop
+
+logger = logging.getLogger(__name__)
+
+class LLMStreamError(Exception):
+    """A streamed completion broke off after some text had already been yielded"""
+
+class LLMGateway:
+    """Concurrency-limited, coalescing OpenAI client with deadlines and a circuit breaker.
+    
+    Calls run on the background event loop so the semaphore, in-flight table
+    and breaker state are shared by every request in the process. Returns None
+    instead of raising, so callers fall back to template text; only a stream
+    that fails part-way raises, as LLMStreamError.
+    """
+    
+    def __init__(self, client, io_loop: BackgroundEventLoop, model: str, max_concurrency: int,
+                 timeout: float, failure_threshold: int, cooldown: float):
+        self.client = client
+        self.io_loop = io_loop
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+    
+    @property
+    def state(self) -> str:
+        """Circuit breaker state: closed, open or half_open"""
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+    
+    def rebind(self):
+        """Drop loop-bound state after the I/O loop changes"""
+        self._semaphore = None
+        self._in_flight.clear()
+    
+    async def complete(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Return the completion for a prompt, or None if it failed or was shed"""
+        return await self.io_loop.run(self._complete(messages))
+    
+    async def _complete(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        # Identical prompts already in flight share one upstream call
+        key = hashlib.sha1(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+        
+        if not self._allow_call():
+            self.rejected += 1
+            return None
+        
+        task = asyncio.ensure_future(self._call(messages))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Yield completion text as it arrives, or nothing if the call failed or was rejected.
+        
+        The deadline covers each wait for a chunk; LLMStreamError means the call failed after yielding text.
+        """
+        async for text in self.io_loop.iterate(self._stream(messages)):
+            yield text
+    
+    async def _stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        if not self._allow_call():
+            self.rejected += 1
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        outcome = None
+        acquired = False
+        yielded = False
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            acquired = True
+            self.calls += 1
+            chunks = await asyncio.wait_for(self.client.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                max_tokens=200,
+                temperature=0.7,
+                stream=True,
+                request_timeout=self.timeout
+            ), self.timeout)
+            
+            chunk_iterator = chunks.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunk_iterator.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta
+                text = delta.get('content') if isinstance(delta, dict) else getattr(delta, 'content', None)
+                if text:
+                    yielded = True
+                    yield text
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.timeouts += 1
+            logger.warning(f"OpenAI stream exceeded {self.timeout}s deadline")
+            self._record_failure()
+        except Exception as e:
+            outcome = "error"
+            self.failures += 1
+            logger.error(f"OpenAI API error: {e}")
+            self._record_failure()
+        finally:
+            if acquired:
+                self._semaphore.release()
+            if outcome is None:
+                # The consumer went away mid-stream; that says nothing about upstream health
+                self._probe_in_flight = False
+        
+        if outcome == "ok":
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+        elif yielded:
+            raise LLMStreamError(f"OpenAI stream interrupted ({outcome})")
+    
+    def _allow_call(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self._probe_in_flight:
+            return False
+        
+        # Half open: let a single probe through
+        self._probe_in_flight = True
+        return True
+    
+    async def _call(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def guarded_call():
+            async with self._semaphore:
+                self.calls += 1
+                return await self.client.ChatCompletion.acreate(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=200,
+                    temperature=0.7,
+                    request_timeout=self.timeout
+                )
+        
+        # The deadline covers waiting for a slot as well as the call itself
+        try:
+            response = await asyncio.wait_for(guarded_call(), self.timeout)
+            answer = response.choices[0].message.content.strip()
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"OpenAI call exceeded {self.timeout}s deadline")
+            self._record_failure()
+            return None
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"OpenAI API error: {e}")
+            self._record_failure()
+            return None
+        
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        return answer
+    
+    def _record_failure(self):
+        self._consecutive_failures += 1
+        was_probe, self._probe_in_flight = self._probe_in_flight, False
+        if was_probe or self._consecutive_failures >= self.failure_threshold:
+            if self._opened_at is None or was_probe:
+                logger.warning(f"OpenAI circuit breaker open for {self.cooldown}s")
+            self._opened_at = time.monotonic()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state and call counters"""
+        return {
+            "state": self.state,
+            "in_flight": len(self._in_flight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failures": self.failures
+        }
@@ -0,0 +1,131 @@
+"""In-process metrics rendered in Prometheus text format"""
+
+import logging
+from collections import deque
+from typing import Any, Dict, List, Tuple
+import bisect
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Metrics:
+    """In-process counters and per-stage latency histograms, rendered in Prometheus text format.
+    
+    Hot paths only append an event to a deque, which is thread-safe without a
+    lock; events are folded into counters and buckets at scrape time, or
+    inline once ``max_pending`` pile up. Component counters that already exist
+    (cache, gateway, queue stats) are read by collectors at scrape time
+    instead of being mirrored on every request.
+    """
+    
+    LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, max_pending: int = 10000):
+        self.buckets = buckets
+        self.max_pending = max_pending
+        self._events: deque = deque()
+        # name -> (help, label name); name -> label value -> count
+        self._counter_info: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        # stage -> [per-bucket counts..., +Inf count, sum]
+        self._histograms: Dict[str, List[float]] = {}
+        self._collectors: List[Any] = []
+        self._lock = threading.Lock()
+    
+    def counter(self, name: str, help_text: str, label: str):
+        """Declare a counter with one label"""
+        self._counter_info[name] = (help_text, label)
+        self._counters.setdefault(name, {})
+    
+    def inc(self, name: str, label_value: str, amount: float = 1):
+        """Increment a declared counter"""
+        self._events.append((name, label_value, amount))
+        if len(self._events) > self.max_pending:
+            self._fold()
+    
+    def observe(self, stage: str, seconds: float):
+        """Record one stage latency"""
+        self._events.append((stage, seconds))
+        if len(self._events) > self.max_pending:
+            self._fold()
+    
+    def _fold(self):
+        """Apply queued events to the counters and histograms"""
+        events = self._events
+        buckets = self.buckets
+        with self._lock:
+            while True:
+                try:
+                    event = events.popleft()
+                except IndexError:
+                    return
+                if len(event) == 3:
+                    values = self._counters[event[0]]
+                    values[event[1]] = values.get(event[1], 0) + event[2]
+                    continue
+                
+                stage, seconds = event
+                histogram = self._histograms.get(stage)
+                if histogram is None:
+                    histogram = self._histograms[stage] = [0] * (len(buckets) + 2)
+                histogram[bisect.bisect_left(buckets, seconds)] += 1
+                histogram[-1] += seconds
+    
+    def collector(self, fn):
+        """Register fn() -> [(name, type, help, {label_value_tuple: value} or value, label_names)] for scrape time"""
+        self._collectors.append(fn)
+        return fn
+    
+    @staticmethod
+    def _labels(names: Tuple[str, ...], values: Tuple[Any, ...]) -> str:
+        if not names:
+            return ""
+        pairs = ",".join(
+            f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+            for name, value in zip(names, values)
+        )
+        return "{" + pairs + "}"
+    
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format"""
+        self._fold()
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            histograms = {stage: list(values) for stage, values in self._histograms.items()}
+        
+        lines = []
+        for name, values in counters.items():
+            help_text, label = self._counter_info[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for label_value, value in sorted(values.items()):
+                lines.append(f"{name}{self._labels((label,), (label_value,))} {value}")
+        
+        name = "ai_stage_latency_seconds"
+        lines.append(f"# HELP {name} Latency of each message processing stage")
+        lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += histogram[-2]
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-1]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+        
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, values, label_names in samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for label_values, value in sorted(values.items()):
+                    lines.append(f"{name}{self._labels(label_names, label_values)} {value}")
+        
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,197 @@
+"""Startup and on-demand profiling, and optional dependency imports"""
+
+import os
+import sys
+import time
+import importlib
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+
+logger = logging.getLogger(__name__)
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, if the platform exposes it"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StartupProfiler:
+    """Records import and initialisation cost for --profile-startup"""
+    
+    def __init__(self):
+        self.records: List[Tuple[str, float, Optional[int], Optional[int]]] = []
+    
+    def record(self, label: str, seconds: float, rss_before: Optional[int] = None):
+        """Record a finished step with its duration and RSS growth"""
+        rss_after = current_rss()
+        rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        self.records.append((label, seconds, rss_delta, rss_after))
+    
+    @contextmanager
+    def measure(self, label: str):
+        """Time a block and record how much it grew the process"""
+        rss_before = current_rss()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(label, time.perf_counter() - started, rss_before)
+    
+    def report(self) -> str:
+        """Render recorded steps as a text table"""
+        def megabytes(value: Optional[int]) -> str:
+            return f"{value / 1048576:8.1f}" if value is not None else "     n/a"
+        
+        lines = [f"{'step':<44} {'ms':>9} {'+RSS MB':>8} {'RSS MB':>8}"]
+        for label, seconds, rss_delta, rss_after in self.records:
+            lines.append(f"{label:<44} {seconds * 1000:9.1f} {megabytes(rss_delta)} {megabytes(rss_after)}")
+        return "\n".join(lines)
+
+startup_profiler = StartupProfiler()
+
+_optional_modules: Dict[str, Any] = {}
+
+def optional_import(module_name: str) -> Optional[Any]:
+    """Import an optional dependency on first use; None if it is not installed"""
+    if module_name not in _optional_modules:
+        try:
+            with startup_profiler.measure(f"import {module_name}"):
+                _optional_modules[module_name] = importlib.import_module(module_name)
+        except ImportError as e:
+            logger.warning(f"Optional dependency {module_name} unavailable: {e}")
+            _optional_modules[module_name] = None
+    return _optional_modules[module_name]
+
+def loaded_optional_modules() -> List[str]:
+    """Names of the optional dependencies imported so far, sorted"""
+    return sorted(name for name, module in _optional_modules.items() if module is not None)
+
+class SamplingProfiler:
+    """Time-boxed wall-clock sampler over every thread, emitting collapsed stacks.
+    
+    A daemon thread snapshots ``sys._current_frames()`` at a fixed interval,
+    so nothing is instrumented and the cost is zero while no profile runs.
+    The output (``thread;outer;...;leaf count`` per line) feeds flamegraph.pl
+    or speedscope directly.
+    """
+    
+    # Leaf frames of threads parked waiting for work, dropped unless idle stacks are requested
+    IDLE_LEAVES = {
+        ('threading.py', 'wait'), ('selectors.py', 'select'), ('socket.py', 'accept'),
+        ('socketserver.py', 'serve_forever'), ('queue.py', 'get'), ('threading.py', '_wait_for_tstate_lock'),
+        ('thread.py', '_worker')
+    }
+    
+    def __init__(self):
+        self.max_seconds = float(os.getenv('AI_PROFILE_MAX_SECONDS', 60))
+        self.default_interval = float(os.getenv('AI_PROFILE_INTERVAL_MS', 10)) / 1000
+        self._busy = threading.Lock()
+    
+    @property
+    def running(self) -> bool:
+        """Whether a profile is being taken"""
+        return self._busy.locked()
+    
+    @staticmethod
+    def _frame_label(code) -> str:
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+    
+    def profile(self, seconds: float, interval: Optional[float] = None, include_idle: bool = False) -> Tuple[str, int]:
+        """Sample all other threads for ``seconds``; return (collapsed stacks, sample count).
+        
+        Raises RuntimeError if a profile is already running.
+        """
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(min(seconds, self.max_seconds), interval or self.default_interval, include_idle)
+        finally:
+            self._busy.release()
+    
+    def _sample(self, seconds: float, interval: float, include_idle: bool) -> Tuple[str, int]:
+        me = threading.get_ident()
+        labels: Dict[Any, str] = {}
+        stacks: Dict[Tuple[str, ...], int] = {}
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                leaf = frame.f_code
+                if not include_idle and (os.path.basename(leaf.co_filename), leaf.co_name) in self.IDLE_LEAVES:
+                    continue
+                
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = self._frame_label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(';', ':').replace(' ', '_'))
+                
+                key = tuple(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(interval)
+        
+        lines = [f"{';'.join(stack)} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + ("\n" if lines else ""), samples
+    
+    def profile_to_file(self, seconds: float, directory: str) -> Optional[str]:
+        """Take a profile and write it to ``directory``; returns the path"""
+        try:
+            collapsed, samples = self.profile(seconds)
+        except RuntimeError as e:
+            logger.warning(f"Profile skipped: {e}")
+            return None
+        
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{os.getpid()}-{datetime.now():%Y%m%d-%H%M%S}.collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(collapsed)
+        logger.info(f"Wrote {samples}-sample profile to {path}")
+        return path
+    
+    def install_signal_handler(self, signal_name: str, seconds: float, directory: str) -> bool:
+        """Profile in the background to a file whenever ``signal_name`` (e.g. SIGUSR2) arrives"""
+        import signal
+        signum = getattr(signal, signal_name, None)
+        if signum is None:
+            logger.warning(f"Unknown profile signal {signal_name}")
+            return False
+        
+        def on_signal(_signum, _frame):
+            threading.Thread(
+                target=self.profile_to_file, args=(seconds, directory), name="ai-profiler", daemon=True
+            ).start()
+        
+        try:
+            signal.signal(signum, on_signal)
+        except ValueError as e:
+            # Only the main thread may install handlers
+            logger.warning(f"Profile signal handler not installed: {e}")
+            return False
+        logger.info(f"{signal_name} takes a {seconds:.0f}s profile into {directory}")
+        return True
+
+sampling_profiler = SamplingProfiler()
+
+def install_profile_signal() -> bool:
+    """Install the AI_PROFILE_SIGNAL handler, if configured; servers call this, offline CLI modes do not"""
+    if not os.getenv('AI_PROFILE_SIGNAL'):
+        return False
+    return sampling_profiler.install_signal_handler(
+        os.getenv('AI_PROFILE_SIGNAL'),
+        float(os.getenv('AI_PROFILE_SIGNAL_SECONDS', 30)),
+        os.getenv('AI_PROFILE_DIR', 'profiles')
+    )
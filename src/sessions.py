@@ -0,0 +1,483 @@
+"""Redis-backed conversation sessions, the in-process session cache and write-behind"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import threading
+
+from conversation import HISTORY_MAX
+from profiling import optional_import
+
+logger = logging.getLogger(__name__)
+
+class BackgroundEventLoop:
+    """Process-wide event loop in a daemon thread that owns pooled async clients.
+    
+    Flask runs each async view on a fresh event loop, so clients that must be
+    shared across requests live on this loop and callers hand coroutines over.
+    """
+    
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread on first use"""
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="ai-io-loop", daemon=True)
+                self._thread.start()
+        return self.loop
+    
+    def adopt(self, loop: asyncio.AbstractEventLoop):
+        """Use an already running loop, such as the ASGI server's, and stop the thread"""
+        with self._lock:
+            old_loop, self.loop = self.loop, loop
+            self._thread = None
+        if old_loop is not None and old_loop is not loop:
+            old_loop.call_soon_threadsafe(old_loop.stop)
+    
+    def run_sync(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop from synchronous code and wait for the result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.start()).result(timeout)
+    
+    async def run(self, coro):
+        """Await a coroutine on the loop from any event loop"""
+        loop = self.start()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    
+    async def iterate(self, agen) -> AsyncIterator[Any]:
+        """Consume an async generator on the loop from any event loop"""
+        loop = self.start()
+        caller = asyncio.get_running_loop()
+        if caller is loop:
+            async for item in agen:
+                yield item
+            return
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        
+        def hand_over(item, error=None):
+            try:
+                caller.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                pass  # The consumer's loop is gone
+        
+        async def pump():
+            try:
+                async for item in agen:
+                    hand_over(item)
+                hand_over(finished)
+            except Exception as e:
+                hand_over(finished, e)
+            finally:
+                await agen.aclose()
+        
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is finished:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+class RedisSessionStore:
+    """Async Redis client with a bounded connection pool, socket timeouts and retry.
+    
+    Once ``connect`` has been called, a failed connection or a dropped server
+    is retried in the background with exponential backoff, so the store
+    becomes available again without a restart.
+    """
+    # Refill every bucket, then take the cost from all of them or from none.
+    # Returns 0 when taken, else milliseconds until the emptiest bucket has enough.
+    TOKEN_BUCKET_SCRIPT = """
+local now, capacity, rate, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local levels, wait = {}, 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+    levels[i] = math.min(capacity, tokens + elapsed * rate / 1000)
+    if levels[i] < cost then wait = math.max(wait, (cost - levels[i]) * 1000 / rate) end
+end
+if wait > 0 then return math.ceil(wait) end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity * 1000 / rate))
+end
+return 0
+"""
+    
+    def __init__(self, io_loop: BackgroundEventLoop):
+        self.io_loop = io_loop
+        self.client = None
+        self._token_bucket = None
+        
+        self.host = os.getenv('REDIS_HOST', 'localhost')
+        self.port = int(os.getenv('REDIS_PORT', 6379))
+        self.password = os.getenv('REDIS_PASSWORD')
+        self.max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', 20))
+        self.pool_timeout = float(os.getenv('REDIS_POOL_TIMEOUT', 1.0))
+        self.socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.5))
+        self.connect_timeout = float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.5))
+        self.retries = int(os.getenv('REDIS_RETRIES', 2))
+        self.reconnect_delay = float(os.getenv('REDIS_RECONNECT_DELAY', 1.0))
+        self.reconnect_max_delay = float(os.getenv('REDIS_RECONNECT_MAX_DELAY', 30.0))
+        self.errors: Dict[str, int] = {}
+        self.reconnects = 0
+        self._retry_delay = self.reconnect_delay
+        self._reconnect_at: Optional[float] = None  # None until a connect attempt fails
+        self._reconnecting = False
+        self._connection_errors: Tuple[type, ...] = ()
+        self._lock = threading.Lock()
+        # Called after every successful connect, e.g. to start components that need Redis
+        self.on_connect: List[Callable[[], None]] = []
+    
+    @property
+    def available(self) -> bool:
+        """Whether a connected client is ready; past the backoff, also starts a reconnect"""
+        if self.client is None and self._reconnect_at is not None and time.monotonic() >= self._reconnect_at:
+            self._schedule_reconnect()
+        return self.client is not None
+    
+    def connect(self) -> bool:
+        """Create the pool on the I/O loop and check the server answers"""
+        return self.io_loop.run_sync(self.aconnect())
+    
+    async def aconnect(self) -> bool:
+        """Create the pool on the running loop and check the server answers"""
+        redis_asyncio = optional_import('redis.asyncio')
+        if redis_asyncio is None:
+            logger.warning("Redis connection failed: redis package not installed, sessions will not persist")
+            return False
+        try:
+            await self._connect(redis_asyncio)
+        except Exception as e:
+            self.client = None
+            self._reconnect_at = time.monotonic() + self._retry_delay
+            logger.warning(f"Redis connection failed, retrying in {self._retry_delay:g}s: {e}")
+            self._retry_delay = min(self._retry_delay * 2, self.reconnect_max_delay)
+            return False
+        
+        logger.info("Redis connection established")
+        self._connection_errors = (redis_asyncio.ConnectionError,)
+        self._reconnect_at = None
+        self._retry_delay = self.reconnect_delay
+        for callback in self.on_connect:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Redis connect callback failed: {e}")
+        return True
+    
+    def _schedule_reconnect(self):
+        """Start one background connect attempt on the I/O loop"""
+        with self._lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        
+        async def reconnect():
+            try:
+                if await self.aconnect():
+                    self.reconnects += 1
+            finally:
+                self._reconnecting = False
+        asyncio.run_coroutine_threadsafe(reconnect(), self.io_loop.start())
+    
+    def _connection_lost(self, error: Exception):
+        """Drop a client whose server went away and retry after the backoff"""
+        with self._lock:
+            client, self.client = self.client, None
+            if client is None:
+                return
+            self._reconnect_at = time.monotonic() + self._retry_delay
+        logger.warning(f"Redis connection lost, retrying in {self._retry_delay:g}s: {error}")
+        asyncio.run_coroutine_threadsafe(
+            client.aclose() if hasattr(client, 'aclose') else client.close(), self.io_loop.start()
+        )
+    
+    async def _connect(self, redis_asyncio):
+        from redis.asyncio.retry import Retry
+        from redis.backoff import ExponentialBackoff
+        from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+        
+        # Callers wait up to pool_timeout for a free connection instead of opening more
+        pool = redis_asyncio.BlockingConnectionPool(
+            host=self.host,
+            port=self.port,
+            password=self.password,
+            decode_responses=True,
+            max_connections=self.max_connections,
+            timeout=self.pool_timeout,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.connect_timeout,
+            retry=Retry(ExponentialBackoff(cap=0.2, base=0.01), self.retries),
+            retry_on_error=[RedisConnectionError, RedisTimeoutError]
+        )
+        client = redis_asyncio.Redis(connection_pool=pool)
+        try:
+            await client.ping()
+        except Exception:
+            await client.aclose() if hasattr(client, 'aclose') else await client.close()
+            raise
+        self.client = client
+    
+    @staticmethod
+    def context_key(user_id: str) -> str:
+        """Key of a user's scalar context"""
+        return f"ai_context:{user_id}"
+    
+    @staticmethod
+    def history_key(user_id: str) -> str:
+        """Key of a user's append-only history list"""
+        return f"ai_history:{user_id}"
+    
+    async def load_sessions(self, user_ids: List[str], history_window: int) -> List[Tuple[Optional[str], List[str]]]:
+        """Fetch each user's context and the tail of their history in one round trip"""
+        return await self._run("load_sessions", self._load_sessions(user_ids, history_window))
+    
+    async def _load_sessions(self, user_ids: List[str], history_window: int) -> List[Tuple[Optional[str], List[str]]]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.get(self.context_key(user_id))
+                pipe.lrange(self.history_key(user_id), -history_window, -1)
+            results = await pipe.execute()
+        return list(zip(results[::2], results[1::2]))
+    
+    async def save_sessions(self, sessions: List[Tuple[str, str, List[str]]], ttl: int, history_max: int):
+        """Rewrite scalar contexts and append new history entries in one round trip.
+        
+        ``sessions`` holds (user_id, context_json, new_history_items) tuples; each
+        history list is capped at ``history_max`` entries with LTRIM.
+        """
+        await self._run("save_sessions", self._save_sessions(sessions, ttl, history_max))
+    
+    async def _save_sessions(self, sessions: List[Tuple[str, str, List[str]]], ttl: int, history_max: int):
+        async with self.client.pipeline(transaction=True) as pipe:
+            for user_id, context_json, new_history in sessions:
+                history_key = self.history_key(user_id)
+                pipe.setex(self.context_key(user_id), ttl, context_json)
+                if new_history:
+                    pipe.rpush(history_key, *new_history)
+                    pipe.ltrim(history_key, -history_max, -1)
+                pipe.expire(history_key, ttl)
+            await pipe.execute()
+    
+    async def get_values(self, keys: List[str]) -> List[Optional[str]]:
+        """Fetch plain string keys in one round trip"""
+        return await self._run("get_values", self.client.mget(keys))
+    
+    async def set_values(self, values: Dict[str, str], ttl: int):
+        """Write plain string keys with a TTL in one round trip"""
+        await self._run("set_values", self._set_values(values, ttl))
+    
+    async def _set_values(self, values: Dict[str, str], ttl: int):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.setex(key, ttl, value)
+            await pipe.execute()
+    
+    async def delete_values(self, keys: List[str]):
+        """Delete plain string keys"""
+        await self._run("delete_values", self.client.delete(*keys))
+    
+    async def claim_value(self, key: str, ttl: int) -> Tuple[bool, Optional[str]]:
+        """Set ``key`` to an empty placeholder unless it exists; returns (claimed, current value)"""
+        return await self._run("claim_value", self._claim_value(key, ttl))
+    
+    async def _claim_value(self, key: str, ttl: int) -> Tuple[bool, Optional[str]]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(key, "", nx=True, ex=ttl)
+            pipe.get(key)
+            claimed, value = await pipe.execute()
+        return bool(claimed), value
+    
+    async def take_tokens(self, keys: List[str], capacity: float, rate: float, cost: float = 1.0) -> float:
+        """Atomically take ``cost`` tokens from every bucket or from none.
+        
+        Buckets hold up to ``capacity`` tokens and refill at ``rate`` per second.
+        Returns 0 if the tokens were taken, else seconds until they would be.
+        """
+        return await self._run("rate_limit", self._take_tokens(keys, capacity, rate, cost))
+    
+    async def _take_tokens(self, keys: List[str], capacity: float, rate: float, cost: float) -> float:
+        script = self._token_bucket
+        if script is None or script.registered_client is not self.client:
+            script = self._token_bucket = self.client.register_script(self.TOKEN_BUCKET_SCRIPT)
+        wait_ms = await script(keys=keys, args=[int(time.time() * 1000), capacity, rate, cost])
+        return int(wait_ms) / 1000
+    
+    async def _run(self, operation: str, coro):
+        """Run a command on the I/O loop, counting failures per operation"""
+        try:
+            return await self.io_loop.run(coro)
+        except Exception as e:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            if isinstance(e, self._connection_errors):
+                self._connection_lost(e)
+            raise
+    
+    async def close(self):
+        """Close the connection pool and stop reconnecting"""
+        self._reconnect_at = None
+        if self.client is not None:
+            client, self.client = self.client, None
+            await self.io_loop.run(client.aclose() if hasattr(client, 'aclose') else client.close())
+
+class LRUCache:
+    """Bounded in-process LRU with a sliding TTL and hit/miss/eviction counters"""
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return a live cached value, refreshing its LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: str, value: Any):
+        """Cache a value, evicting the least recently used beyond the bound"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+class SessionWriteBehind:
+    """Coalesces context saves per user and flushes them to Redis off the request path.
+    
+    Snapshots are serialised on the request thread and merged per user until
+    the next flush. Failed flushes are requeued with backoff, so a Redis
+    outage only delays persistence while the in-process cache keeps serving.
+    """
+    
+    def __init__(self, store: RedisSessionStore, ttl: int, flush_interval: float, max_pending: int):
+        self.store = store
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: 'OrderedDict[str, Tuple[str, List[str]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._retry_delay = 0.0
+        self.flushed = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+    
+    def enqueue(self, snapshots: List[Tuple[str, str, List[str]]]):
+        """Queue (user_id, context_json, new_history_items) snapshots for Redis"""
+        with self._lock:
+            for user_id, context_json, history in snapshots:
+                self._merge(user_id, context_json, history)
+            schedule = not self._scheduled
+            self._scheduled = True
+        
+        if schedule:
+            self.store.io_loop.start().call_soon_threadsafe(
+                lambda: asyncio.ensure_future(self._flush_loop())
+            )
+    
+    def _merge(self, user_id: str, context_json: str, history: List[str], older: bool = False):
+        """Combine a snapshot with any queued one for the same user (lock held)"""
+        queued = self._pending.pop(user_id, None)
+        if queued is not None:
+            if older:
+                context_json, history = queued[0], history + queued[1]
+            else:
+                history = queued[1] + history
+        self._pending[user_id] = (context_json, history[-HISTORY_MAX:])
+        
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+    
+    def _take(self) -> List[Tuple[str, str, List[str]]]:
+        with self._lock:
+            batch = [(user_id, context_json, history) for user_id, (context_json, history) in self._pending.items()]
+            self._pending.clear()
+            if not batch:
+                self._scheduled = False
+            return batch
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval + self._retry_delay)
+            batch = self._take()
+            if not batch:
+                return
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[Tuple[str, str, List[str]]]):
+        try:
+            await self.store.save_sessions(batch, self.ttl, HISTORY_MAX)
+            self.flushed += len(batch)
+            self._retry_delay = 0.0
+        except Exception as e:
+            self.failed_flushes += 1
+            self._retry_delay = min(max(self._retry_delay * 2, 0.5), 30.0)
+            logger.warning(f"Session write-behind failed, retrying in {self._retry_delay}s: {e}")
+            with self._lock:
+                for user_id, context_json, history in batch:
+                    self._merge(user_id, context_json, history, older=True)
+    
+    async def drain(self):
+        """Flush everything queued now, e.g. at shutdown"""
+        batch = self._take()
+        if batch:
+            await self.store.io_loop.run(self._flush(batch))
+    
+    def stats(self) -> Dict[str, int]:
+        """Queue depth and flush counters"""
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "failed_flushes": self.failed_flushes,
+                "dropped": self.dropped
+            }
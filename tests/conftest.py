@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from sessions import BackgroundEventLoop, RedisSessionStore
+
+
+@pytest.fixture
+def io_loop():
+    """Background I/O loop, as the assistant runs its async clients on"""
+    return BackgroundEventLoop()
+
+
+@pytest.fixture
+def offline_store(io_loop):
+    """Session store whose Redis is unreachable"""
+    return RedisSessionStore(io_loop)
+
+
+@pytest.fixture
+def redis_server():
+    """One in-memory Redis server; stores made from it behave like workers sharing Redis"""
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def make_redis_store(io_loop, redis_server):
+    """Factory for connected session stores backed by ``redis_server``"""
+    import fakeredis
+
+    def make() -> RedisSessionStore:
+        store = RedisSessionStore(io_loop)
+        store.client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+        return store
+    return make
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import LoadShedder, RateLimiter
+
+
+def acquire(limiter, user_id, phone_number=None):
+    return asyncio.run(limiter.acquire(user_id, phone_number))
+
+
+def test_local_bucket_admits_a_burst_then_limits(offline_store):
+    limiter = RateLimiter(offline_store, capacity=2, per_minute=60)
+
+    assert acquire(limiter, "u1") == 0
+    assert acquire(limiter, "u1") == 0
+    wait = acquire(limiter, "u1")
+    assert 0 < wait <= 1.0
+    assert acquire(limiter, "u2") == 0
+    assert limiter.stats()["limited"] == 1
+    assert limiter.stats()["local_decisions"] == 4
+
+
+def test_local_bucket_refills_over_time(offline_store):
+    limiter = RateLimiter(offline_store, capacity=1, per_minute=600)
+
+    assert acquire(limiter, "u1") == 0
+    assert acquire(limiter, "u1") > 0
+    time.sleep(0.12)
+    assert acquire(limiter, "u1") == 0
+
+
+def test_phone_number_bucket_is_shared_across_user_ids(offline_store):
+    limiter = RateLimiter(offline_store, capacity=2, per_minute=60)
+
+    assert acquire(limiter, "u1", "+27820000000") == 0
+    assert acquire(limiter, "u2", "+27820000000") == 0
+    assert acquire(limiter, "u3", "+27820000000") > 0
+    assert acquire(limiter, "u3") == 0
+
+
+def test_redis_buckets_are_shared_between_workers(make_redis_store):
+    pytest.importorskip('lupa')
+    worker_a = RateLimiter(make_redis_store(), capacity=2, per_minute=60)
+    worker_b = RateLimiter(make_redis_store(), capacity=2, per_minute=60)
+
+    assert acquire(worker_a, "u1") == 0
+    assert acquire(worker_b, "u1") == 0
+    assert 0 < acquire(worker_a, "u1") <= 1.0
+    assert worker_a.stats()["local_decisions"] == 0
+
+
+def test_shedder_enters_overload_at_max_in_flight_and_recovers_with_hysteresis():
+    shedder = LoadShedder(max_in_flight=10, latency_threshold=0, recover=0.8)
+
+    with shedder.track(9):
+        assert not shedder.overloaded()
+    with shedder.track(10):
+        assert shedder.overloaded()
+    # Leaving overload needs load back under the recovery point...
+    with shedder.track(9):
+        assert shedder.overloaded()
+    with shedder.track(8):
+        assert not shedder.overloaded()
+    # ...and entering it again needs the full threshold
+    with shedder.track(9):
+        assert not shedder.overloaded()
+    assert shedder.stats()["in_flight"] == 0
+
+
+def test_shedder_tracks_turn_latency():
+    shedder = LoadShedder(max_in_flight=0, latency_threshold=0.01, smoothing=1.0)
+
+    with shedder.track():
+        time.sleep(0.02)
+    assert shedder.overloaded()
+    assert shedder.stats()["shedding"] is True
+
+    with shedder.track():
+        pass
+    assert not shedder.overloaded()
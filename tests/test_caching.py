@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+
+from caching import MessageDeduplicator, NearDuplicateIndex, ResponseCache
+from conversation import IntentType, LanguageCode
+
+
+class Turn:
+    """``process`` callback for MessageDeduplicator.run that counts its calls"""
+
+    def __init__(self, payload, status=200, answered=True, delay=0.0, error=None):
+        self.payload = payload
+        self.status = status
+        self.answered = answered
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.payload, self.status, self.answered
+
+
+@pytest.fixture
+def deduplicator(offline_store):
+    return MessageDeduplicator(offline_store, ttl=60, max_entries=100, wait=1.0, poll_interval=0.01)
+
+
+KEY = MessageDeduplicator.key("u1", "1", 7)
+
+
+def test_key_depends_on_user_sequence_and_text():
+    assert MessageDeduplicator.key("u1", "1", 7) == KEY
+    assert MessageDeduplicator.key("u2", "1", 7) != KEY
+    assert MessageDeduplicator.key("u1", "1", 8) != KEY
+    assert MessageDeduplicator.key("u1", "2", 7) != KEY
+
+
+def test_text_key_depends_on_user_and_text_only():
+    assert MessageDeduplicator.text_key("u1", "1") == MessageDeduplicator.text_key("u1", "1")
+    assert MessageDeduplicator.text_key("u2", "1") != MessageDeduplicator.text_key("u1", "1")
+    assert MessageDeduplicator.text_key("u1", "2") != MessageDeduplicator.text_key("u1", "1")
+    assert MessageDeduplicator.text_key("u1", "1") != KEY
+
+
+def test_retry_replays_the_answered_payload(deduplicator):
+    turn = Turn({"response": "hi"})
+
+    assert asyncio.run(deduplicator.run(KEY, turn)) == ({"response": "hi"}, 200)
+    assert asyncio.run(deduplicator.run(KEY, Turn({"response": "again"}))) == ({"response": "hi"}, 200)
+    assert turn.calls == 1
+    assert deduplicator.stats()["replayed"] == 1
+
+
+def test_concurrent_copy_waits_for_the_original(deduplicator):
+    original = Turn({"response": "hi"}, delay=0.1)
+    copy = Turn({"response": "copy"})
+
+    async def both():
+        return await asyncio.gather(deduplicator.run(KEY, original), deduplicator.run(KEY, copy))
+
+    assert asyncio.run(both()) == [({"response": "hi"}, 200), ({"response": "hi"}, 200)]
+    assert (original.calls, copy.calls) == (1, 0)
+    assert deduplicator.stats()["joined"] == 1
+    assert deduplicator.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize('status, answered', [(200, False), (429, False), (500, True)])
+def test_unanswered_turns_are_not_kept(deduplicator, status, answered):
+    failed = Turn({"response": "technical difficulties"}, status=status, answered=answered)
+    assert asyncio.run(deduplicator.run(KEY, failed)) == ({"response": "technical difficulties"}, status)
+
+    retry = Turn({"response": "hi"})
+    assert asyncio.run(deduplicator.run(KEY, retry)) == ({"response": "hi"}, 200)
+    assert retry.calls == 1
+
+
+def test_waiting_copy_takes_over_when_the_original_fails(deduplicator):
+    original = Turn(None, delay=0.1, answered=False, status=200)
+    copy = Turn({"response": "hi"})
+
+    async def both():
+        return await asyncio.gather(deduplicator.run(KEY, original), deduplicator.run(KEY, copy))
+
+    assert asyncio.run(both())[1] == ({"response": "hi"}, 200)
+    assert (original.calls, copy.calls) == (1, 1)
+
+
+def test_exception_releases_the_key(deduplicator):
+    original = Turn(None, delay=0.1, error=RuntimeError("boom"))
+    copy = Turn({"response": "hi"})
+
+    async def both():
+        return await asyncio.gather(deduplicator.run(KEY, original), deduplicator.run(KEY, copy),
+                                    return_exceptions=True)
+
+    first, second = asyncio.run(both())
+    assert isinstance(first, RuntimeError)
+    assert second == ({"response": "hi"}, 200)
+    assert deduplicator.stats()["in_flight"] == 0
+
+
+def test_copy_on_another_worker_waits_through_redis(make_redis_store):
+    worker_a = MessageDeduplicator(make_redis_store(), ttl=60, max_entries=100, wait=2.0, poll_interval=0.01)
+    worker_b = MessageDeduplicator(make_redis_store(), ttl=60, max_entries=100, wait=2.0, poll_interval=0.01)
+    original = Turn({"response": "hi"}, delay=0.1)
+    copy = Turn({"response": "copy"})
+
+    async def both():
+        async def late_copy():
+            await asyncio.sleep(0.02)
+            return await worker_b.run(KEY, copy)
+        return await asyncio.gather(worker_a.run(KEY, original), late_copy())
+
+    assert asyncio.run(both()) == [({"response": "hi"}, 200), ({"response": "hi"}, 200)]
+    assert copy.calls == 0
+    assert worker_b.stats()["shared"] == 1
+
+
+def test_release_on_another_worker_lets_the_copy_process(make_redis_store):
+    worker_a = MessageDeduplicator(make_redis_store(), ttl=60, max_entries=100, wait=2.0, poll_interval=0.01)
+    worker_b = MessageDeduplicator(make_redis_store(), ttl=60, max_entries=100, wait=2.0, poll_interval=0.01)
+    failed = Turn({"response": "technical difficulties"}, answered=False, delay=0.1)
+    copy = Turn({"response": "hi"})
+
+    async def both():
+        async def late_copy():
+            await asyncio.sleep(0.02)
+            return await worker_b.run(KEY, copy)
+        return await asyncio.gather(worker_a.run(KEY, failed), late_copy())
+
+    assert asyncio.run(both())[1] == ({"response": "hi"}, 200)
+    assert copy.calls == 1
+
+
+TOPICS = ["bursary", "water", "electricity", "roads", "housing", "clinic", "library", "permits", "rates", "parks"]
+
+
+class FakeKnowledgeBase:
+    """Knowledge base stand-in exposing only the fitted vectorizer"""
+
+    def __init__(self, texts):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.vectorizer = TfidfVectorizer().fit(texts)
+
+
+def question(topic):
+    return f"How do I get help with {topic} services?"
+
+
+@pytest.fixture
+def response_cache(offline_store):
+    pytest.importorskip('sklearn')
+    knowledge_base = FakeKnowledgeBase([question(topic) for topic in TOPICS])
+    return ResponseCache(offline_store, knowledge_base, max_entries=100, ttl=60, similarity=0.8)
+
+
+def test_near_duplicates_are_found_between_batched_rebuilds(response_cache, monkeypatch):
+    monkeypatch.setattr(NearDuplicateIndex, 'REBUILD_PENDING', 3)
+    intent, language = IntentType.INFORMATION_REQUEST, LanguageCode.ENGLISH
+
+    for topic in TOPICS:
+        asyncio.run(response_cache.put(question(topic), intent, language, f"answer about {topic}"))
+        # Same vector under the vectorizer, different cache key
+        reworded = f"how do I get help with {topic} services, thanks"
+        assert asyncio.run(response_cache.get(reworded, intent, language)) == f"answer about {topic}"
+
+    bucket = response_cache._buckets[(intent.value, language.value)]
+    assert bucket.rebuilds == 2
+    assert response_cache.stats()["near_duplicate_hits"] == len(TOPICS)
+    assert asyncio.run(response_cache.get("how do I pay a parking fine", intent, language)) is None
+
+
+def test_replaced_and_evicted_rows_are_masked_until_the_next_rebuild():
+    sparse = pytest.importorskip('scipy.sparse')
+    index = NearDuplicateIndex(max_entries=2)
+    index.add("a", sparse.csr_matrix([[1.0, 0.0]]))
+    index.add("b", sparse.csr_matrix([[0.0, 1.0]]))
+    index.rebuild(sparse)
+
+    index.add("a", sparse.csr_matrix([[0.6, 0.8]]))
+    keys, matrix, alive, pending_keys, _ = index.candidates(sparse)
+    assert (keys, list(alive), pending_keys) == (["a", "b"], [False, True], ["a"])
+    assert matrix.shape == (2, 2)
+
+    index.add("c", sparse.csr_matrix([[1.0, 1.0]]))
+    assert list(index.vectors) == ["a", "c"]
+    # Both stacked rows are now dead, so the next lookup restacks
+    keys, matrix, alive, pending_keys, _ = index.candidates(sparse)
+    assert (keys, list(alive), pending_keys) == (["a", "c"], [True, True], [])
+    assert index.rebuilds == 2
@@ -0,0 +1,197 @@
+import json
+import time
+
+import pytest
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # ai_assistant logs to the working directory, and the assistant writes a default knowledge base there
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    import ai_assistant
+    return ai_assistant.app.test_client()
+
+
+def test_batch_results_follow_input_order_with_per_item_errors(client):
+    messages = [
+        {"user_id": "u1", "message": "hello"},
+        {"message": "hello"},
+        {"user_id": "u2", "message": "hello", "language": "fr"},
+        "hello",
+        {"user_id": "u3", "message": "The street light is broken, I want to report a problem"},
+        {"user_id": "u1", "message": ""},
+    ]
+
+    response = client.post('/chat/batch', json={"messages": messages})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == len(messages)
+    assert results[0]["intent"] == "greeting"
+    assert results[1] == {"error": "Missing required fields: message, user_id"}
+    assert results[2] == {"error": "Unsupported language: fr"}
+    assert results[3] == {"error": "Message must be an object"}
+    assert results[4]["intent"] == "issue_reporting"
+    assert results[5] == {"error": "Missing required fields: message, user_id"}
+
+
+def test_batch_answers_match_single_messages(client, monkeypatch):
+    import ai_assistant
+    # Otherwise the single messages would be answered as retries of the batch
+    monkeypatch.setattr(ai_assistant.get_assistant(), 'text_deduplicator', None)
+    messages = [
+        {"user_id": "u1", "message": "hello"},
+        {"user_id": "u2", "message": "Where is my application? I want to check the status"},
+        {"user_id": "u3", "message": "thanks, that's all, goodbye"},
+    ]
+
+    batch = client.post('/chat/batch', json={"messages": messages}).get_json()["results"]
+    single = [client.post('/chat', json=message).get_json() for message in messages]
+
+    assert [(r["intent"], r["response"]) for r in batch] == [(r["intent"], r["response"]) for r in single]
+
+
+def test_batch_size_is_bounded(client, monkeypatch):
+    import ai_assistant
+    monkeypatch.setattr(ai_assistant, 'MAX_BATCH_SIZE', 2)
+
+    response = client.post('/chat/batch', json={"messages": [{"user_id": "u1", "message": "hi"}] * 3})
+    assert response.status_code == 400
+
+    assert client.post('/chat/batch', json={"messages": []}).status_code == 400
+
+
+class FakeGateway:
+    """LLM gateway stand-in that streams fixed tokens, optionally breaking after them"""
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+
+    async def complete(self, messages):
+        return "".join(self.tokens) or None
+
+    async def stream(self, messages):
+        for token in self.tokens:
+            yield token
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def assistant(client, monkeypatch):
+    import ai_assistant
+    assistant = ai_assistant.get_assistant()
+    monkeypatch.setattr(assistant, 'response_cache', None)
+    return assistant
+
+
+def stream_frames(client, message, user_id="u1"):
+    response = client.post('/chat/stream', json={"user_id": user_id, "message": message})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    frames = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if block:
+            event, data = block.split("\n")
+            frames.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return frames
+
+
+def test_llm_tokens_stream_before_a_single_done_frame(client, assistant, monkeypatch):
+    monkeypatch.setattr(assistant, 'llm_gateway', FakeGateway(["Ward ", "office ", "hours"]))
+
+    frames = stream_frames(client, "qwerty zxcv")
+
+    assert [event for event, _ in frames] == ["token", "token", "token", "done"]
+    assert "".join(data["text"] for event, data in frames if event == "token") == "Ward office hours"
+    assert frames[-1][1]["response"] == "Ward office hours"
+
+
+def test_template_answer_is_used_when_the_gateway_yields_no_tokens(client, assistant, monkeypatch):
+    monkeypatch.setattr(assistant, 'llm_gateway', FakeGateway([]))
+
+    frames = stream_frames(client, "qwerty zxcv")
+    expected = client.post('/chat', json={"user_id": "u2", "message": "qwerty zxcv"}).get_json()
+
+    assert [event for event, _ in frames] == ["done"]
+    assert frames[0][1]["response"] == expected["response"]
+    assert frames[0][1]["intent"] == "unknown"
+
+
+def test_interrupted_stream_keeps_the_partial_answer(client, assistant, monkeypatch):
+    import ai_assistant
+    error = ai_assistant.LLMStreamError("OpenAI stream interrupted (error)")
+    monkeypatch.setattr(assistant, 'llm_gateway', FakeGateway(["Ward ", "office"], error=error))
+
+    frames = stream_frames(client, "qwerty zxcv")
+
+    assert [event for event, _ in frames] == ["token", "token", "done"]
+    assert frames[-1][1]["response"] == "Ward office"
+
+
+def test_non_llm_answers_send_only_the_done_frame(client, assistant, monkeypatch):
+    monkeypatch.setattr(assistant, 'llm_gateway', FakeGateway(["unused"]))
+
+    frames = stream_frames(client, "hello")
+
+    assert [event for event, _ in frames] == ["done"]
+    assert frames[0][1]["intent"] == "greeting"
+
+
+def test_stream_rejects_missing_fields(client):
+    assert client.post('/chat/stream', json={"message": "hello"}).status_code == 400
+
+
+@pytest.fixture
+def turns(assistant, monkeypatch):
+    """Messages that reached process_message or process_batch"""
+    seen = []
+    process_message, process_batch = assistant.process_message, assistant.process_batch
+
+    async def count_message(user_input, context):
+        seen.append(user_input)
+        return await process_message(user_input, context)
+
+    async def count_batch(batch):
+        seen.extend(user_input for user_input, _ in batch)
+        return await process_batch(batch)
+    monkeypatch.setattr(assistant, 'process_message', count_message)
+    monkeypatch.setattr(assistant, 'process_batch', count_batch)
+    return seen
+
+
+def test_retry_without_sequence_id_is_answered_from_the_first_turn(client, turns):
+    message = {"user_id": "retry-u1", "message": "Where is my application? I want to check the status"}
+
+    first = client.post('/chat', json=message).get_json()
+    second = client.post('/chat', json=message).get_json()
+
+    assert second == first
+    assert len(turns) == 1
+    assert client.get('/health').get_json()["text_deduplicator"]["replayed"] >= 1
+
+
+def test_repeat_after_the_text_window_is_a_new_turn(client, assistant, turns, monkeypatch):
+    import ai_assistant
+    monkeypatch.setattr(assistant, 'text_deduplicator',
+                        ai_assistant.MessageDeduplicator(assistant.session_store, 1, 100, 1.0))
+    message = {"user_id": "retry-u2", "message": "1"}
+
+    client.post('/chat', json=message)
+    time.sleep(1.1)
+    client.post('/chat', json=message)
+
+    assert turns == ["1", "1"]
+
+
+def test_batch_copies_without_sequence_id_share_one_turn(client, turns):
+    message = {"user_id": "retry-u3", "message": "hello"}
+    other_user = {"user_id": "retry-u4", "message": "hello"}
+
+    results = client.post('/chat/batch', json={"messages": [message, message, other_user]}).get_json()["results"]
+
+    assert results[0] == results[1]
+    assert results[2]["intent"] == "greeting"
+    assert turns == ["hello", "hello"]
@@ -0,0 +1,80 @@
+import pytest
+
+
+def with_check_digit(first_twelve):
+    """Append the Luhn check digit SA ID numbers end with"""
+    total = 0
+    for i, ch in enumerate(reversed(first_twelve + "0")):
+        digit = int(ch) * (2 if i % 2 else 1)
+        total += digit - 9 if digit > 9 else digit
+    return first_twelve + str((10 - total % 10) % 10)
+
+
+VALID_ID = with_check_digit("800101500908")
+
+
+@pytest.fixture
+def extractor(tmp_path, monkeypatch):
+    # Importing ai_assistant writes its log and a default knowledge base to the working directory
+    monkeypatch.chdir(tmp_path)
+    import ai_assistant
+    return ai_assistant.EntityExtractor()
+
+
+def test_valid_id_number_is_kept(extractor):
+    assert VALID_ID == "8001015009087"
+    assert extractor.extract_entities(f"My ID is {VALID_ID}") == {"id_number": VALID_ID}
+
+
+@pytest.mark.parametrize('id_number', [
+    VALID_ID[:-1] + str((int(VALID_ID[-1]) + 1) % 10),  # wrong check digit
+    with_check_digit("801301500908"),                    # month 13
+    with_check_digit("800132500908"),                    # day 32
+])
+def test_invalid_id_numbers_are_dropped_and_not_read_as_amounts(extractor, id_number):
+    assert extractor.extract_entities(f"My ID is {id_number}") == {}
+
+
+@pytest.mark.parametrize('text', [
+    "call me on +27 82 123 4567",
+    "call me on +27821234567",
+    "call me on 27821234567",
+    "call me on 082 123 4567",
+    "call me on 082-123-4567",
+    "call me on 0821234567",
+])
+def test_phone_numbers_are_normalised_to_local_form(extractor, text):
+    assert extractor.extract_entities(text) == {"phone_number": "0821234567"}
+
+
+def test_landlines_are_consumed_but_not_reported(extractor):
+    assert extractor.extract_entities("the office is on 021 123 4567") == {}
+
+
+@pytest.mark.parametrize('text, amount', [
+    ("I paid R1,500.00 for fees", "1,500.00"),
+    ("I paid R 250 for fees", "250"),
+    ("the bursary is 12,000 a year", "12,000"),
+    ("I owe 99.50", "99.50"),
+])
+def test_amounts_keep_separators_and_drop_the_currency(extractor, text, amount):
+    assert extractor.extract_entities(text) == {"amount": amount}
+
+
+def test_id_number_wins_over_the_phone_number_in_its_first_digits(extractor):
+    # The first ten digits of this ID read as a mobile number on their own
+    id_number = with_check_digit("071210500908")
+    text = f"ID {id_number}"
+
+    assert extractor.scan(text) == [("id_number", id_number, 3, 16)]
+
+
+def test_id_and_phone_side_by_side_are_both_found(extractor):
+    entities = extractor.extract_entities(f"{VALID_ID} 0821234567 R200")
+
+    assert entities == {"phone_number": "0821234567", "id_number": VALID_ID, "amount": "200"}
+
+
+def test_messages_without_digits_skip_the_scan(extractor):
+    assert extractor.scan("hello, I need help") == []
+    assert extractor.extract_batch(["hi", "0821234567"]) == [{}, {"phone_number": "0821234567"}]
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+
+import pytest
+
+pymongo = pytest.importorskip('pymongo')
+
+from ingestion import TranscriptSink
+
+
+class FakeCollection:
+    """Collection stand-in with a unique ``_id`` index that can be taken down"""
+
+    def __init__(self):
+        self.documents = {}
+        self.down = False
+
+    def insert_many(self, documents, ordered=True):
+        if self.down:
+            raise pymongo.errors.ServerSelectionTimeoutError("mongo down")
+        errors = []
+        for i, document in enumerate(documents):
+            if document["_id"] in self.documents:
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.documents[document["_id"]] = document
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+
+def transcript(n):
+    return {"_id": f"t{n}", "user_id": "u1", "timestamp": 1700000000.0 + n, "message": f"message {n}"}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+@pytest.fixture
+def make_sink(tmp_path, collection):
+    sinks = []
+
+    def make(**overrides):
+        options = dict(uri='mongodb://unused', database='test', collection='transcripts', batch_size=2,
+                       flush_interval=0.02, max_pending=100, spill_path=str(tmp_path / 'spill.jsonl'),
+                       spill_max_bytes=1 << 20)
+        options.update(overrides)
+        sink = TranscriptSink(**options)
+        sink._collection = collection
+        sinks.append(sink)
+        return sink
+    yield make
+    for sink in sinks:
+        sink.close()
+
+
+def test_full_batches_are_written(make_sink, collection):
+    sink = make_sink()
+    for n in range(4):
+        sink.record(transcript(n))
+
+    wait_for(lambda: sink.stats()["written"] == 4)
+    assert sorted(collection.documents) == ["t0", "t1", "t2", "t3"]
+    assert collection.documents["t0"]["timestamp"].timestamp() == 1700000000.0
+
+
+def test_batches_spill_while_mongo_is_down_and_replay_in_order(make_sink, collection, tmp_path):
+    sink = make_sink()
+    collection.down = True
+    sink.record(transcript(0))
+    sink.record(transcript(1))
+    wait_for(lambda: sink.stats()["spilled"] == 2)
+
+    spilled = [json.loads(line) for line in open(tmp_path / 'spill.jsonl', encoding='utf-8')]
+    assert [record["_id"] for record in spilled] == ["t0", "t1"]
+    assert sink.stats()["failed_flushes"] == 1
+
+    collection.down = False
+    wait_for(lambda: sink.stats()["replayed"] == 2)
+    sink.record(transcript(2))
+    sink.record(transcript(3))
+    wait_for(lambda: sink.stats()["written"] == 2)
+
+    assert list(collection.documents) == ["t0", "t1", "t2", "t3"]
+    assert not os.path.exists(tmp_path / 'spill.jsonl')
+    assert not os.path.exists(tmp_path / 'spill.jsonl.replay')
+
+
+def test_interrupted_replay_inserts_nothing_twice(make_sink, collection, tmp_path):
+    sink = make_sink()
+    # A previous replay died after inserting the first record
+    collection.insert_many([dict(transcript(0))])
+    with open(tmp_path / 'partial', 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(transcript(n)) + "\n" for n in range(3))
+    os.replace(tmp_path / 'partial', tmp_path / 'spill.jsonl.replay')
+
+    wait_for(lambda: sink.stats()["replayed"] == 3)
+
+    assert list(collection.documents) == ["t0", "t1", "t2"]
+    assert not os.path.exists(tmp_path / 'spill.jsonl.replay')
+
+
+def test_close_spills_what_cannot_be_written(make_sink, collection, tmp_path):
+    sink = make_sink(batch_size=10, flush_interval=60)
+    collection.down = True
+    sink.record(transcript(0))
+    sink.close()
+
+    assert sink.stats()["spilled"] == 1
+    assert os.path.exists(tmp_path / 'spill.jsonl')
+
+
+def test_full_queue_drops_new_records(make_sink, collection):
+    sink = make_sink(batch_size=10, flush_interval=60, max_pending=2)
+    for n in range(3):
+        sink.record(transcript(n))
+
+    assert sink.stats()["pending"] == 2
+    assert sink.stats()["dropped"] == 1
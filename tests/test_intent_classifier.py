@@ -0,0 +1,80 @@
+import pytest
+
+MESSAGES = [
+    "",
+    "hello",
+    "Hi, I want to apply for a bursary",
+    "how do I apply for bursary funding for university",
+    "My school needs money and help with fees",
+    "The street light is broken, I want to report a problem",
+    "water problem in my area, report issue please",
+    "Where is my application? I want to check the status",
+    "what happened to my bursary application progress",
+    "What is the office address and phone number?",
+    "I need to speak to someone at the office, when open",
+    "EMERGENCY! there is a fire, call the police right now",
+    "urgent help urgent help urgent",
+    "which area code covers this district and its boundaries",
+    "thanks, that's all, goodbye",
+    "Bye bye bye",
+    "explain how to register for the menu options",
+    "report report report the issue issue",
+    "I'm done thank you",
+    "INFORMATION about bursary details please",
+    "Dısabled sſtreet light not working",
+    "ngicela usizo nge-bursary",
+    "ek wil aansoek doen vir 'n beurs",
+    "help!!! ambulance asap",
+    "status? update? progress?",
+]
+
+
+@pytest.fixture
+def classifier(tmp_path, monkeypatch):
+    # ai_assistant logs to ai_assistant.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AI_INTENT_MODEL_PATH', str(tmp_path / 'missing.npz'))
+    import ai_assistant
+    return ai_assistant.IntentClassifier()
+
+
+def regex_scores(classifier, text):
+    """Scores as the original per-pattern regex classifier computed them"""
+    text = text.lower().strip()
+    scores = {}
+    for intent, patterns in classifier.compiled_patterns.items():
+        score = 0
+        for pattern in patterns:
+            matches = len(pattern.findall(text))
+            if matches > 0:
+                score += matches * 0.3
+                if pattern.search(text):
+                    score += 0.2
+        scores[intent] = score
+    return scores
+
+
+def regex_classify(classifier, text):
+    from conversation import IntentType
+    scores = regex_scores(classifier, text)
+    best_intent, best_score = max(scores.items(), key=lambda x: x[1])
+    if best_score > 0.2:
+        return best_intent, min(best_score, 1.0)
+    return IntentType.UNKNOWN, 0.0
+
+
+@pytest.mark.parametrize('text', MESSAGES)
+def test_fused_match_counts_equal_regex_findall(classifier, text):
+    counts = classifier._count_matches(text.lower().strip())
+    for intent, slot_ids in classifier._intent_slots:
+        expected = [len(pattern.findall(text.lower().strip())) for pattern in classifier.compiled_patterns[intent]]
+        assert [counts[slot] for slot in slot_ids] == expected, intent
+
+
+@pytest.mark.parametrize('text', MESSAGES)
+def test_fused_classification_equals_regex_path(classifier, text):
+    assert classifier.classify_rules(text) == regex_classify(classifier, text)
+
+
+def test_classify_batch_matches_single_messages(classifier):
+    assert classifier.classify_batch(MESSAGES) == [classifier.classify_intent(text) for text in MESSAGES]
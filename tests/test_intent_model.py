@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+
+from conversation import IntentType
+from intent_model import IntentModel, read_labelled_messages, train_intent_model
+
+COMPLAINTS = [
+    "the clinic staff were rude to me",
+    "terrible service at the ward office",
+    "nobody answers the phone, very poor service",
+    "I am unhappy with how my case was handled",
+    "the queue was too long and the staff were rude",
+    "this service is terrible and slow",
+    "I want to complain about the rude official",
+    "very bad service from the municipality",
+]
+GREETINGS = ["hello", "hi there", "good morning", "sawubona", "molo", "hallo", "hey", "good afternoon"]
+# Labelled as complaints, so a model alone would miss the emergency
+ALARMS = ["there is a fire in my street, terrible", "call the police, the service is terrible"]
+
+
+def write_labelled(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for text, intent in rows:
+            f.write(json.dumps({"message": text, "intent": intent}) + "\n")
+
+
+@pytest.fixture
+def training_data(tmp_path):
+    path = tmp_path / 'labelled.jsonl'
+    rows = [(text, "complaint") for text in COMPLAINTS + ALARMS] + [(text, "greeting") for text in GREETINGS]
+    write_labelled(path, rows)
+    return path
+
+
+def test_read_labelled_messages_skips_bad_rows(tmp_path):
+    path = tmp_path / 'labelled.jsonl'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"text": "hello", "label": "greeting"}) + "\n")
+        f.write(json.dumps({"message": "hi", "intent": "not_an_intent"}) + "\n")
+        f.write(json.dumps({"message": "", "intent": "greeting"}) + "\n")
+        f.write("not json\n\n")
+
+    assert read_labelled_messages(str(path)) == (["hello"], [IntentType.GREETING])
+
+
+def test_trained_model_round_trips_through_its_artifact(training_data, tmp_path):
+    output = tmp_path / 'intent_model.npz'
+    trained = train_intent_model(str(training_data), str(output), model_version="test")
+
+    loaded = IntentModel.load(str(output))
+
+    assert loaded.classes == [IntentType.COMPLAINT, IntentType.GREETING]
+    assert loaded.model_version == "test"
+    assert loaded.meta["examples"] == len(COMPLAINTS + ALARMS + GREETINGS)
+    assert np.array_equal(loaded.weights, trained.weights)
+    assert np.array_equal(loaded.bias, trained.bias)
+    texts = ["the staff were rude", "good morning", ""]
+    assert np.allclose(loaded.predict_proba(texts), trained.predict_proba(texts))
+    assert loaded.predict(texts)[:2] == [(IntentType.COMPLAINT, pytest.approx(trained.predict(texts)[0][1])),
+                                         (IntentType.GREETING, pytest.approx(trained.predict(texts)[1][1]))]
+
+
+def test_artifact_with_another_format_version_is_rejected(training_data, tmp_path):
+    output = tmp_path / 'intent_model.npz'
+    model = train_intent_model(str(training_data), str(output))
+    model.FORMAT_VERSION = IntentModel.FORMAT_VERSION + 1
+    model.save(str(output))
+
+    with pytest.raises(ValueError):
+        IntentModel.load(str(output))
+
+
+def test_classify_batch_keeps_emergencies_from_the_rules(training_data, tmp_path, monkeypatch):
+    output = tmp_path / 'intent_model.npz'
+    train_intent_model(str(training_data), str(output))
+    # ai_assistant logs to ai_assistant.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AI_INTENT_MODEL_PATH', str(output))
+    monkeypatch.setenv('AI_INTENT_MODEL_THRESHOLD', '0')
+    import ai_assistant
+    classifier = ai_assistant.IntentClassifier()
+    alarm = "EMERGENCY! there is a fire, call the police, terrible"
+    assert classifier.model.predict([alarm])[0][0] == IntentType.COMPLAINT
+
+    results = classifier.classify_batch([alarm, "the staff were rude", "hello"])
+
+    assert results[0] == classifier.classify_rules(alarm)
+    assert results[0][0] == IntentType.EMERGENCY
+    assert [intent for intent, _ in results[1:]] == [IntentType.COMPLAINT, IntentType.GREETING]
+    assert classifier.classify_intent(alarm)[0] == IntentType.EMERGENCY
@@ -0,0 +1,210 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+pytest.importorskip('scipy')
+
+from conversation import LanguageCode
+from kb_index import KnowledgeBase, KnowledgeIndex, LanguageDetector, SemanticIndex, StringTable
+
+TOPICS = [
+    "bursary", "water", "electricity", "roads", "street lights", "garbage", "clinic", "library",
+    "housing", "permits", "rates", "parks", "schools", "transport", "sanitation", "youth",
+    "elders", "sports", "markets", "cemeteries",
+]
+
+
+def knowledge_data(topics):
+    return {
+        "faq": [
+            {"question": f"How do I get help with {topic} services?", "answer": f"Visit the ward office about {topic}."}
+            for topic in topics
+        ]
+    }
+
+
+def write_kb(path, topics):
+    raw = json.dumps(knowledge_data(topics))
+    path.write_text(raw)
+    # Reloads are keyed on mtime; make sure each write is seen as a change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def kb_path(tmp_path, monkeypatch):
+    monkeypatch.delenv('AI_KB_INDEX_PATH', raising=False)
+    monkeypatch.setenv('AI_KB_SEARCH_MODE', 'tfidf')
+    monkeypatch.setenv('AI_KB_INCREMENTAL_RATIO', '0.25')
+    path = tmp_path / 'knowledge_base.json'
+    write_kb(path, TOPICS)
+    return path
+
+
+def best_question(kb, query):
+    matches = kb.search_knowledge(query, top_k=1)
+    return matches[0].question if matches else None
+
+
+def test_reload_patches_new_rows_into_the_fitted_index(kb_path):
+    kb = KnowledgeBase(str(kb_path))
+    fitted = kb.index
+    assert fitted.patched_rows == 0
+
+    write_kb(kb_path, TOPICS + ["swimming pools"])
+    patched = kb.reload()
+
+    assert patched is kb.index
+    assert patched.patched_rows == 1
+    assert patched.vectorizer is fitted.vectorizer
+    assert patched.vectors.shape[0] == len(TOPICS) + 1
+    # Unchanged rows keep their vectors; only the new question was transformed
+    assert (patched.vectors[:len(TOPICS)] != fitted.vectors).nnz == 0
+    assert best_question(kb, "help with swimming pools") == "How do I get help with swimming pools services?"
+
+
+def test_reload_refits_once_too_many_rows_are_new(kb_path):
+    kb = KnowledgeBase(str(kb_path))
+    fitted = kb.index
+
+    write_kb(kb_path, TOPICS + [f"new topic {i}" for i in range(10)])
+    index = kb.reload()
+
+    assert index.patched_rows == 0
+    assert index.vectorizer is not fitted.vectorizer
+    assert index.vectors.shape[0] == len(TOPICS) + 10
+
+
+def test_full_reload_refits_from_scratch(kb_path):
+    kb = KnowledgeBase(str(kb_path))
+    write_kb(kb_path, TOPICS + ["swimming pools"])
+    assert kb.reload(incremental=False).patched_rows == 0
+
+
+def test_artifact_is_memory_mapped_and_searches_like_the_fitted_index(kb_path):
+    fitted = KnowledgeBase(str(kb_path))
+    fitted.build_index_artifact()
+
+    mapped = KnowledgeBase(str(kb_path))
+    assert isinstance(mapped.index.questions, StringTable)
+    assert list(mapped.index.questions) == list(fitted.index.questions)
+    assert list(mapped.index.answers) == list(fitted.index.answers)
+    for query in ["water services", "help with the library", "garbage collection"]:
+        assert mapped.search_knowledge(query) == fitted.search_knowledge(query)
+    assert mapped.get_answer("How do I get help with clinic services?") == "Visit the ward office about clinic."
+
+
+def test_stale_artifact_falls_back_to_fitting(kb_path):
+    kb = KnowledgeBase(str(kb_path))
+    kb.build_index_artifact()
+    old_hash = kb.content_hash(kb_path.read_bytes())
+
+    write_kb(kb_path, TOPICS + ["swimming pools"])
+    new_hash = kb.content_hash(kb_path.read_bytes())
+    assert KnowledgeIndex.load(kb.index_path, new_hash) is None
+    assert KnowledgeIndex.load(kb.index_path, old_hash) is not None
+
+    reloaded = KnowledgeBase(str(kb_path))
+    assert isinstance(reloaded.index.questions, list)
+    assert len(reloaded.index.questions) == len(TOPICS) + 1
+    assert best_question(reloaded, "help with swimming pools") == "How do I get help with swimming pools services?"
+
+
+def test_artifact_with_bad_magic_is_ignored(kb_path):
+    kb = KnowledgeBase(str(kb_path))
+    kb.build_index_artifact()
+    with open(kb.index_path, 'r+b') as f:
+        f.write(b'NOTANIDX')
+
+    content_hash = kb.content_hash(kb_path.read_bytes())
+    assert KnowledgeIndex.load(kb.index_path, content_hash, LanguageCode.ENGLISH) is None
+    assert len(KnowledgeBase(str(kb_path)).index.questions) == len(TOPICS)
+
+
+TRANSLATED = {
+    "services": [
+        {
+            "question": "How do I apply for a bursary?",
+            "answer": "Apply at the ward office with your ID and results.",
+            "translations": {
+                "af": {"question": "Hoe doen ek aansoek vir 'n beurs?",
+                       "answer": "Doen aansoek by die wyk kantoor met jou ID en uitslae."},
+                "zu": {"question": "Ngifaka kanjani isicelo somxhaso wemfundo?",
+                       "answer": "Faka isicelo ehhovisi lewadi nomazisi wakho nemiphumela."},
+            },
+        },
+        {
+            "question": "How do I report a water leak?",
+            "answer": "Report water leaks to the municipality call centre.",
+            "translations": {
+                "af": {"question": "Hoe meld ek 'n waterlek aan?",
+                       "answer": "Meld waterlekke by die munisipaliteit se inbelsentrum aan."},
+            },
+        },
+    ]
+}
+
+
+@pytest.mark.parametrize("language, text", [
+    (LanguageCode.AFRIKAANS, "Ek wil graag weet wanneer die kliniek in ons gebied weer oop sal wees"),
+    (LanguageCode.ZULU, "Ngicela ukwazi ukuthi umtholampilo endaweni yethu uzovulwa nini futhi"),
+    (LanguageCode.XHOSA, "Ndicela ukwazi ukuba ikliniki kummandla wethu iza kuvulwa nini kwakhona"),
+])
+def test_detector_tags_the_message_language(language, text):
+    detector = LanguageDetector(LanguageDetector.SEED_SAMPLES)
+
+    assert detector.detect(text, LanguageCode.ENGLISH) is language
+    assert detector.detect("When will the clinic in our area open again, please let me know") is LanguageCode.ENGLISH
+
+
+def test_detector_keeps_the_hint_for_short_messages():
+    detector = LanguageDetector(LanguageDetector.SEED_SAMPLES)
+
+    assert detector.detect("molo", LanguageCode.ENGLISH) is LanguageCode.ENGLISH
+    assert detector.detect("hallo daar", LanguageCode.ZULU) is LanguageCode.ZULU
+
+
+def test_search_routes_to_the_language_index(tmp_path, monkeypatch):
+    monkeypatch.delenv('AI_KB_INDEX_PATH', raising=False)
+    monkeypatch.setenv('AI_KB_SEARCH_MODE', 'tfidf')
+    path = tmp_path / 'knowledge_base.json'
+    path.write_text(json.dumps(TRANSLATED))
+    kb = KnowledgeBase(str(path))
+    assert set(kb.indexes) == {LanguageCode.ENGLISH, LanguageCode.AFRIKAANS, LanguageCode.ZULU}
+
+    af = kb.search_knowledge("aansoek vir 'n beurs", top_k=1, language=LanguageCode.AFRIKAANS)
+    assert af[0].answer == "Doen aansoek by die wyk kantoor met jou ID en uitslae."
+    zu = kb.search_knowledge("isicelo somxhaso wemfundo", top_k=1, language=LanguageCode.ZULU)
+    assert zu[0].answer == "Faka isicelo ehhovisi lewadi nomazisi wakho nemiphumela."
+    # No Xhosa entries, so Xhosa queries fall back to the English index
+    xh = kb.search_knowledge("report a water leak", top_k=1, language=LanguageCode.XHOSA)
+    assert xh[0].answer == "Report water leaks to the municipality call centre."
+
+    batch = kb.search_knowledge_batch(
+        ["apply for a bursary", "meld 'n waterlek aan"], top_k=1,
+        languages=[LanguageCode.ENGLISH, LanguageCode.AFRIKAANS],
+    )
+    assert [matches[0].answer for matches in batch] == [
+        "Apply at the ward office with your ID and results.",
+        "Meld waterlekke by die munisipaliteit se inbelsentrum aan.",
+    ]
+
+
+def test_semantic_scores_are_computed_block_by_block(monkeypatch):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((10, 8)).astype(np.float32)
+    codes, scales = SemanticIndex.quantize(vectors)
+    index = SemanticIndex("test-model", [f"q{row}" for row in range(10)], codes, scales)
+    queries = rng.standard_normal((3, 8)).astype(np.float32)
+    expected = (queries @ codes.astype(np.float32).T) * scales
+
+    monkeypatch.setattr(SemanticIndex, 'SCORE_BLOCK_ROWS', 4)
+    scores = index.scores(queries)
+
+    assert scores.dtype == np.float32
+    assert np.allclose(scores, expected, rtol=1e-5)
+    assert np.allclose(scores, queries @ vectors.T, atol=0.1)
+    assert index.codes.dtype == np.int8
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_gateway import LLMGateway
+
+
+class FakeChatCompletion:
+    """ChatCompletion stand-in that answers after a delay, or fails while ``failing`` is set"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.failing = False
+        self.calls = 0
+
+    async def acreate(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise ConnectionError("upstream down")
+        content = f" answer to {kwargs['messages'][-1]['content']} "
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def prompt(text):
+    return [{"role": "user", "content": text}]
+
+
+@pytest.fixture
+def chat():
+    return FakeChatCompletion()
+
+
+@pytest.fixture
+def gateway(chat, io_loop):
+    client = SimpleNamespace(ChatCompletion=chat)
+    return LLMGateway(client, io_loop, 'fake-model', max_concurrency=4, timeout=1.0,
+                      failure_threshold=2, cooldown=0.2)
+
+
+def complete(gateway, text):
+    return asyncio.run(gateway.complete(prompt(text)))
+
+
+def test_identical_prompts_in_flight_share_one_call(gateway, chat):
+    chat.delay = 0.1
+
+    async def burst():
+        return await asyncio.gather(*(gateway.complete(prompt("hours")) for _ in range(5)))
+
+    assert asyncio.run(burst()) == ["answer to hours"] * 5
+    assert chat.calls == 1
+    assert gateway.stats()["coalesced"] == 4
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_finished_prompts_are_not_coalesced(gateway, chat):
+    assert complete(gateway, "hours") == "answer to hours"
+    assert complete(gateway, "hours") == "answer to hours"
+    assert chat.calls == 2
+
+
+def test_slow_call_times_out_without_raising(gateway, chat):
+    chat.delay = 2.0
+    gateway.timeout = 0.05
+
+    assert complete(gateway, "hours") is None
+    assert gateway.stats()["timeouts"] == 1
+
+
+def test_breaker_opens_after_consecutive_failures(gateway, chat):
+    chat.failing = True
+    assert complete(gateway, "a") is None
+    assert gateway.state == "closed"
+    assert complete(gateway, "b") is None
+    assert gateway.state == "open"
+
+    # Open: calls are rejected without reaching upstream
+    assert complete(gateway, "c") is None
+    assert chat.calls == 2
+    assert gateway.stats()["rejected"] == 1
+
+
+def test_successful_probe_closes_the_breaker(gateway, chat):
+    chat.failing = True
+    complete(gateway, "a")
+    complete(gateway, "b")
+    time.sleep(0.25)
+    assert gateway.state == "half_open"
+
+    chat.failing = False
+    assert complete(gateway, "c") == "answer to c"
+    assert gateway.state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker(gateway, chat):
+    chat.failing = True
+    complete(gateway, "a")
+    complete(gateway, "b")
+    time.sleep(0.25)
+
+    assert complete(gateway, "c") is None
+    assert chat.calls == 3
+    assert gateway.state == "open"
+
+
+def test_half_open_admits_a_single_probe(gateway, chat):
+    chat.failing = True
+    complete(gateway, "a")
+    complete(gateway, "b")
+    time.sleep(0.25)
+    chat.failing = False
+    chat.delay = 0.1
+
+    async def probes():
+        return await asyncio.gather(gateway.complete(prompt("c")), gateway.complete(prompt("d")))
+
+    results = asyncio.run(probes())
+    assert results.count(None) == 1
+    assert chat.calls == 3
+    assert gateway.state == "closed"
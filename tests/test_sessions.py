@@ -0,0 +1,177 @@
+import asyncio
+import time
+
+import pytest
+
+from sessions import RedisSessionStore, SessionWriteBehind
+
+
+class FlakyStore:
+    """Session store stand-in that records saves and can be made to fail"""
+
+    def __init__(self, io_loop):
+        self.io_loop = io_loop
+        self.saved = []
+        self.failures = 0
+
+    async def save_sessions(self, sessions, ttl, history_max):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("redis down")
+        self.saved.append(list(sessions))
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_snapshots_are_coalesced_per_user(io_loop):
+    store = FlakyStore(io_loop)
+    write_behind = SessionWriteBehind(store, ttl=60, flush_interval=60, max_pending=100)
+
+    write_behind.enqueue([("u1", '{"turn": 1}', ["h1"]), ("u2", '{"turn": 1}', ["x1"])])
+    write_behind.enqueue([("u1", '{"turn": 2}', ["h2"])])
+    asyncio.run(write_behind.drain())
+
+    assert store.saved == [[("u2", '{"turn": 1}', ["x1"]), ("u1", '{"turn": 2}', ["h1", "h2"])]]
+    assert write_behind.stats() == {"pending": 0, "flushed": 2, "failed_flushes": 0, "dropped": 0}
+
+
+def test_flushes_in_the_background(io_loop):
+    store = FlakyStore(io_loop)
+    write_behind = SessionWriteBehind(store, ttl=60, flush_interval=0.01, max_pending=100)
+
+    write_behind.enqueue([("u1", '{"turn": 1}', ["h1"])])
+    wait_for(lambda: store.saved)
+
+    assert store.saved == [[("u1", '{"turn": 1}', ["h1"])]]
+
+
+def test_failed_flush_is_requeued_under_newer_snapshots(io_loop):
+    store = FlakyStore(io_loop)
+    store.failures = 1
+    write_behind = SessionWriteBehind(store, ttl=60, flush_interval=60, max_pending=100)
+
+    write_behind.enqueue([("u1", '{"turn": 1}', ["h1"])])
+    asyncio.run(write_behind.drain())
+    assert store.saved == []
+    assert write_behind.stats()["pending"] == 1
+    assert write_behind.stats()["failed_flushes"] == 1
+
+    write_behind.enqueue([("u1", '{"turn": 2}', ["h2"])])
+    asyncio.run(write_behind.drain())
+
+    # The newer context wins and no history is lost or reordered
+    assert store.saved == [[("u1", '{"turn": 2}', ["h1", "h2"])]]
+    assert write_behind.stats()["pending"] == 0
+
+
+def test_oldest_users_are_dropped_past_max_pending(io_loop):
+    store = FlakyStore(io_loop)
+    write_behind = SessionWriteBehind(store, ttl=60, flush_interval=60, max_pending=2)
+
+    write_behind.enqueue([("u1", "{}", []), ("u2", "{}", []), ("u3", "{}", [])])
+    asyncio.run(write_behind.drain())
+
+    assert [user_id for user_id, _, _ in store.saved[0]] == ["u2", "u3"]
+    assert write_behind.stats()["dropped"] == 1
+
+
+def test_write_behind_persists_to_redis(make_redis_store):
+    store = make_redis_store()
+    write_behind = SessionWriteBehind(store, ttl=60, flush_interval=60, max_pending=100)
+
+    write_behind.enqueue([("u1", '{"turn": 1}', ["h1"])])
+    write_behind.enqueue([("u1", '{"turn": 2}', ["h2"])])
+    asyncio.run(write_behind.drain())
+
+    assert asyncio.run(store.load_sessions(["u1"], 10)) == [('{"turn": 2}', ["h1", "h2"])]
+
+
+@pytest.fixture
+def flaky_redis(io_loop, redis_server, monkeypatch):
+    """Store whose first ``failures`` connection attempts fail, then connect to ``redis_server``"""
+    import fakeredis
+    monkeypatch.setenv('REDIS_RECONNECT_DELAY', '0.05')
+    store = RedisSessionStore(io_loop)
+    store.attempts = []
+    store.failures = 0
+
+    async def connect(redis_asyncio):
+        store.attempts.append(time.monotonic())
+        if len(store.attempts) <= store.failures:
+            raise ConnectionRefusedError("redis down")
+        store.client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+    monkeypatch.setattr(store, '_connect', connect)
+    return store
+
+
+def test_failed_connection_is_retried_with_backoff(flaky_redis):
+    flaky_redis.failures = 2
+
+    assert flaky_redis.connect() is False
+    assert not flaky_redis.available
+    assert len(flaky_redis.attempts) == 1
+
+    wait_for(lambda: flaky_redis.available)
+    first, second, third = flaky_redis.attempts
+    assert second - first >= 0.05
+    assert third - second >= 0.1
+    assert flaky_redis.reconnects == 1
+
+
+def test_lost_server_is_dropped_and_reconnected(flaky_redis, redis_server):
+    assert flaky_redis.connect() is True
+    redis_server.connected = False
+
+    from redis.exceptions import ConnectionError as RedisConnectionError
+    with pytest.raises(RedisConnectionError):
+        asyncio.run(flaky_redis.load_sessions(["u1"], 10))
+    assert not flaky_redis.available
+
+    redis_server.connected = True
+    wait_for(lambda: flaky_redis.available)
+    assert asyncio.run(flaky_redis.load_sessions(["u1"], 10)) == [(None, [])]
+    assert flaky_redis.errors == {"load_sessions": 1}
+
+
+def test_connect_callbacks_run_on_reconnect(flaky_redis):
+    connected = []
+    flaky_redis.on_connect.append(lambda: connected.append(flaky_redis.available))
+    flaky_redis.failures = 1
+
+    assert flaky_redis.connect() is False
+    assert connected == []
+    wait_for(lambda: flaky_redis.available)
+    wait_for(lambda: connected)
+    assert connected == [True]
+
+
+def test_assistant_starts_write_behind_once_redis_connects(tmp_path, redis_server, monkeypatch):
+    import fakeredis
+    # ai_assistant logs to ai_assistant.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('REDIS_PORT', '1')
+    monkeypatch.setenv('REDIS_RECONNECT_DELAY', '0.05')
+    import ai_assistant
+    assistant = ai_assistant.VOOWardAIAssistant()
+    assert assistant.write_behind is None
+
+    async def connect(redis_asyncio):
+        assistant.session_store.client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+    monkeypatch.setattr(assistant.session_store, '_connect', connect)
+    wait_for(lambda: assistant.session_store.available)
+    wait_for(lambda: assistant.write_behind is not None)
+
+    context = ai_assistant.ConversationContext(user_id="u1", phone_number="+27820000000")
+    asyncio.run(assistant.save_context(context))
+    asyncio.run(assistant.write_behind.drain())
+    assert asyncio.run(assistant.session_store.load_sessions(["u1"], 10))[0][0] is not None
+
+
+def test_store_that_never_connected_does_not_retry(offline_store):
+    assert not offline_store.available
+    assert offline_store._reconnect_at is None